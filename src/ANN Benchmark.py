@@ -0,0 +1,93 @@
+"""IVF index against brute-force scoring on a synthetic corpus: build time, query latency and recall@k
+
+The corpus is written to a memory-mapped file in a temporary directory, as the shared store would be:
+    python "src/ANN Benchmark.py" --sizes 100000 1000000 --dim 384
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from ann import IVFIndex, default_n_lists
+from retrieval import DenseMatrix, top_k_indices
+
+
+def time_per_query(fn, queries: np.ndarray) -> float:
+    """Mean wall time of fn(query) in milliseconds"""
+    fn(queries[0])  # Warm up
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def synthetic_corpus(path: Path, n_chunks: int, dim: int, n_queries: int, block_rows: int = 65536):
+    """Clustered unit vectors written block by block to an .npy file, and queries near random chunks"""
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((max(n_chunks // 200, 1), dim), dtype=np.float32)
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(n_chunks, dim))
+    for start in range(0, n_chunks, block_rows):
+        rows = min(block_rows, n_chunks - start)
+        block = centres[rng.integers(0, len(centres), rows)] + 0.7 * rng.standard_normal((rows, dim), dtype=np.float32)
+        matrix[start:start + rows] = DenseMatrix.normalise(block)
+    matrix.flush()
+    picked = np.sort(rng.choice(n_chunks, n_queries, replace=False))
+    queries = np.asarray(matrix[picked]) + 0.5 * rng.standard_normal((n_queries, dim), dtype=np.float32) / np.sqrt(dim)
+    return np.load(path, mmap_mode="r"), DenseMatrix.normalise(queries)
+
+
+def exact_top_k(matrix: np.ndarray, queries: np.ndarray, top_k: int, block_rows: int = 65536) -> np.ndarray:
+    """Ground-truth top-k by blocked brute force, without loading the whole matrix at once"""
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_indices = np.zeros((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(matrix), block_rows):
+        scores = queries @ np.asarray(matrix[start:start + block_rows]).T
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        best_indices = np.concatenate([best_indices, np.broadcast_to(
+            np.arange(start, start + scores.shape[1]), scores.shape)], axis=1)
+        keep = top_k_indices(best_scores, top_k)
+        best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        best_indices = np.take_along_axis(best_indices, keep, axis=1)
+    return best_indices
+
+
+def benchmark(n_chunks: int, dim: int, top_k: int, n_queries: int, nprobes, n_lists: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        matrix, queries = synthetic_corpus(Path(tmp) / "embeddings.npy", n_chunks, dim, n_queries)
+        expected = exact_top_k(matrix, queries, top_k)
+
+        start = time.perf_counter()
+        IVFIndex.build(Path(tmp) / "ivf", matrix, n_lists or None)
+        build_seconds = time.perf_counter() - start
+        index = IVFIndex.load(Path(tmp) / "ivf")
+
+        dense = DenseMatrix(matrix, normalised=True)  # Brute force, as the numpy retriever does
+        brute_ms = time_per_query(lambda query: dense.search(query, top_k), queries)
+        print(f"{n_chunks:>9} lists={index.n_lists} build={build_seconds:.1f}s brute force {brute_ms:.2f} ms/query")
+
+        for nprobe in nprobes:
+            found, _ = index.search_batch(queries, top_k, nprobe=nprobe)
+            recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(found.tolist(), expected.tolist())])
+            ms = time_per_query(lambda query: index.search(query, top_k, nprobe=nprobe), queries)
+            print(f"{'':>9} nprobe={nprobe:<5} {ms:>8.2f} ms/query {brute_ms / ms:>7.1f}x "
+                  f"recall@{top_k}={recall:.3f}")
+        del dense
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IVF index against brute-force retrieval")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--dim", type=int, default=384, help="1536 matches text-embedding-ada-002 (6 GB at 1M)")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--lists", type=int, default=0, help="IVF lists (default about sqrt(n))")
+    args = parser.parse_args()
+
+    print(f"dim={args.dim} top_k={args.top_k} queries={args.queries}")
+    for n_chunks in args.sizes:
+        benchmark(n_chunks, args.dim, args.top_k, args.queries, args.nprobe, args.lists or default_n_lists(n_chunks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Tail latency and failures of chat calls with and without retries and hedging, against the fake server
+
+    python "src/Client Resilience Benchmark.py" --stall-rate 0.03 --error-rate 0.05 --deadline 3
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import time
+import httpx
+from fake_openai_server import FakeOpenAIServer
+from llm_client import CallStats, ClientPolicy, ResilientTransport, deadline
+
+
+def run(client: httpx.Client, url: str, n_requests: int, concurrency: int, deadline_seconds: float):
+    """Send n_requests chat completions; return (latencies in ms, failures)"""
+    body = {"model": "gpt-4", "messages": [{"role": "user", "content": "What is the VAT rate for this invoice?"}]}
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            with deadline(deadline_seconds):
+                response = client.post(url, json=body)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n_requests)))
+    return sorted(latency for latency, _ in results), sum(not ok for _, ok in results)
+
+
+def percentile(values, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pooled OpenAI client's retries and hedging")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=60.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02)
+    parser.add_argument("--stall-rate", type=float, default=0.03)
+    parser.add_argument("--stall-ms", type=float, default=5000.0)
+    parser.add_argument("--deadline", type=float, default=3.0, help="per-request deadline in seconds")
+    parser.add_argument("--hedge-percentile", type=float, default=95.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                              rate_limit_rate=args.rate_limit_rate, stall_rate=args.stall_rate,
+                              stall_ms=args.stall_ms, retry_after=0.05).start()
+    url = f"{server.api_base}/chat/completions"
+    policies = {
+        "plain": ClientPolicy(attempt_timeout=args.deadline, max_retries=0),
+        "retries": ClientPolicy(attempt_timeout=args.deadline, max_retries=3, retry_base_delay=0.05),
+        "hedged": ClientPolicy(attempt_timeout=args.deadline, max_retries=3, retry_base_delay=0.05,
+                               hedge_percentile=args.hedge_percentile),
+    }
+    print(f"server latency={args.latency_ms}±{args.jitter_ms} ms errors={args.error_rate} "
+          f"429s={args.rate_limit_rate} stalls={args.stall_rate}×{args.stall_ms} ms deadline={args.deadline} s")
+    print(f"{'policy':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'failed':>7} {'attempts':>9} "
+          f"{'retries':>8} {'hedges':>7} {'wins':>5}")
+    try:
+        for name, policy in policies.items():
+            stats = CallStats()
+            with httpx.Client(transport=ResilientTransport(policy, stats), timeout=policy.attempt_timeout) as client:
+                latencies, failures = run(client, url, args.requests, args.concurrency, args.deadline)
+            counts = stats.stats()
+            print(f"{name:>8} {percentile(latencies, 50):>9.1f} {percentile(latencies, 95):>9.1f} "
+                  f"{percentile(latencies, 99):>9.1f} {failures:>7} {counts['attempts']:>9} {counts['retries']:>8} "
+                  f"{counts['hedges']:>7} {counts['hedge_wins']:>5}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Throughput and latency of query embedding with and without micro-batching, against the fake embeddings server
+
+    python "src/Embedding Batch Benchmark.py" --latency-ms 80 --concurrency 1 8 32 128
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from llama_index.embeddings.openai import OpenAIEmbedding
+from embedding_batcher import MicroBatchingEmbedder
+from fake_openai_server import FakeOpenAIServer
+
+
+async def run(embed, n_queries: int, concurrency: int):
+    """Embed n_queries distinct texts with at most concurrency in flight; return (seconds, per-query latencies)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await embed(f"What is the VAT rate for invoice {i}?")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_queries)))
+    return time.perf_counter() - start, np.array(latencies) * 1000
+
+
+def report(label: str, concurrency: int, seconds: float, latencies: np.ndarray, requests: int, extra: str = ""):
+    print(f"{concurrency:>11} {label:>9} {len(latencies) / seconds:>9.1f} {latencies.mean():>9.1f} "
+          f"{np.percentile(latencies, 95):>9.1f} {requests:>9} {extra}")
+
+
+async def main_async(args):
+    server = FakeOpenAIServer(latency_ms=args.latency_ms, per_item_ms=args.per_item_ms, dim=args.dim).start()
+    embed_model = OpenAIEmbedding(api_key="fake", api_base=server.api_base)
+    print(f"server latency={args.latency_ms} ms (+{args.per_item_ms} ms/text) window={args.window_ms} ms "
+          f"max_batch={args.max_batch} queries={args.queries}")
+    print(f"{'concurrency':>11} {'mode':>9} {'qps':>9} {'mean ms':>9} {'p95 ms':>9} {'requests':>9}")
+    try:
+        for concurrency in args.concurrency:
+            before = server.requests
+            seconds, latencies = await run(embed_model.aget_query_embedding, args.queries, concurrency)
+            report("unbatched", concurrency, seconds, latencies, server.requests - before)
+
+            batcher = MicroBatchingEmbedder(embed_model, args.window_ms, args.max_batch)
+            before = server.requests
+            seconds, latencies = await run(batcher.aget_query_embedding, args.queries, concurrency)
+            stats = batcher.stats()
+            report("batched", concurrency, seconds, latencies, server.requests - before,
+                   f"mean batch {stats['mean_batch_size']}, queueing {stats['mean_queue_ms']:.1f} ms mean / "
+                   f"{stats['max_queue_ms']:.1f} ms max")
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched query embedding")
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="fake server latency per request")
+    parser.add_argument("--per-item-ms", type=float, default=0.2, help="fake server latency per text")
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=1536)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
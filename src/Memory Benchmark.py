@@ -0,0 +1,127 @@
+"""Peak and steady-state RSS of building the index, old in-memory representation vs streamed compact store
+
+Each measurement runs in a fresh process on a synthetic legislation CSV, with a mock embedding model so
+no API calls are made:
+    python "src/Memory Benchmark.py" --rows 1000 5000 20000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent
+BOILERPLATE = ("Cookies on GOV.UK We use some essential cookies to make this website work. Accept additional cookies "
+               "Reject additional cookies View cookies Skip to main content")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def write_corpus(path: Path, rows: int, words: int):
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(5000)] + ["VAT", "zero-rated", "exempt", "reverse", "charge", "20%", "5%"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "page_content"])
+        for i in range(rows):
+            writer.writerow([i, f"{BOILERPLATE} {' '.join(rng.choices(vocabulary, k=words))} {BOILERPLATE}"])
+
+
+def build_before(csv_path: Path, store_dir: Path):
+    """The previous VatRag: whole DataFrame, iterrows into a Document list, llama_index's in-memory index"""
+    import pandas as pd
+    from llama_index.core import Document, VectorStoreIndex
+
+    df = pd.read_csv(csv_path)
+    documents = [
+        Document(text=row["page_content"], metadata={"id": row["id"], "type": "vat_legislation"})
+        for _, row in df.iterrows()
+    ]
+    index = VectorStoreIndex.from_documents(documents)
+    retriever = index.as_retriever(similarity_top_k=3)
+    return (df, documents, index), retriever.retrieve
+
+
+def build_after(csv_path: Path, store_dir: Path):
+    """Streamed batches into the snapshot, then served from the memory-mapped compact store"""
+    from sources import CsvSource
+    from vat_rag import VatRag
+
+    rag = VatRag(source=CsvSource(csv_path, batch_size=256), store_dir=str(store_dir), retriever="numpy")
+    rag.build_index()
+    return rag, rag.query_engine.retriever.retrieve
+
+
+def worker(mode: str, csv_path: Path, dim: int):
+    sys.path[:0] = [str(SRC_DIR)]
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    from llama_index.core import Settings
+    from llama_index.core.embeddings import MockEmbedding
+
+    Settings.embed_model = MockEmbedding(embed_dim=dim)
+    baseline = rss_mb()
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        start = time.perf_counter()
+        held, retrieve = (build_before if mode == "before" else build_after)(csv_path, Path(store_dir))
+        seconds = time.perf_counter() - start
+        for query in ("zero-rated books", "reverse charge construction", "standard rate 20%"):
+            retrieve(query)  # Touch the served pages so steady state includes them
+        print(json.dumps({
+            "baseline_mb": baseline,
+            "peak_mb": peak_rss_mb(),
+            "steady_mb": rss_mb(),
+            "seconds": seconds,
+        }))
+        del held
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index build memory before and after the compact store")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--words", type=int, default=300, help="words per legislation page")
+    parser.add_argument("--dim", type=int, default=1536)  # text-embedding-ada-002
+    parser.add_argument("--worker", nargs=2, metavar=("MODE", "CSV"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], Path(args.worker[1]), args.dim)
+        return
+
+    print(f"words/page={args.words} dim={args.dim}; RSS in MiB, each run in a fresh process")
+    print(f"{'rows':>8} {'mode':>8} {'baseline':>10} {'peak':>10} {'steady':>10} {'build s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            csv_path = Path(tmp) / f"legislation-{rows}.csv"
+            write_corpus(csv_path, rows, args.words)
+            for mode in ("before", "after"):
+                result = subprocess.run(
+                    [sys.executable, __file__, "--dim", str(args.dim), "--worker", mode, str(csv_path)],
+                    capture_output=True, text=True
+                )
+                if result.returncode:
+                    print(f"{rows:>8} {mode:>8} failed:\n{result.stderr[-2000:]}")
+                    continue
+                stats = json.loads(result.stdout.strip().splitlines()[-1])
+                print(f"{rows:>8} {mode:>8} {stats['baseline_mb']:>10.1f} {stats['peak_mb']:>10.1f} "
+                      f"{stats['steady_mb']:>10.1f} {stats['seconds']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
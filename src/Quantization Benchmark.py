@@ -0,0 +1,65 @@
+import argparse
+import time
+import numpy as np
+from retrieval import QUANTIZATIONS, DenseMatrix, QuantizedMatrix
+
+
+def time_per_call(fn, repeats: int) -> float:
+    """Mean wall time of fn() in milliseconds"""
+    fn()  # Warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def synthetic_corpus(n_chunks: int, dim: int, n_queries: int, rng: np.random.Generator):
+    """Clustered unit vectors (chunks of the same notice sit close together) and queries near random chunks"""
+    centres = rng.standard_normal((max(n_chunks // 50, 1), dim), dtype=np.float32)
+    embeddings = centres[rng.integers(0, len(centres), n_chunks)] + 0.6 * rng.standard_normal((n_chunks, dim),
+                                                                                             dtype=np.float32)
+    queries = embeddings[rng.integers(0, n_chunks, n_queries)] + 0.8 * rng.standard_normal((n_queries, dim),
+                                                                                           dtype=np.float32)
+    return DenseMatrix(embeddings).matrix, queries
+
+
+def benchmark(n_chunks: int, dim: int, top_k: int, n_queries: int, oversample: int, repeats: int):
+    rng = np.random.default_rng(0)
+    exact, queries = synthetic_corpus(n_chunks, dim, n_queries, rng)
+    baseline = DenseMatrix(exact, normalised=True)
+    expected, _ = baseline.search_batch(queries, top_k)
+    baseline_ms = time_per_call(lambda: baseline.search(queries[0], top_k), repeats)
+    print(f"{n_chunks:>8} {'float32':>8} {exact.nbytes / 2**20:>10.1f} {'':>8} {baseline_ms:>10.3f} {1.0:>10.2f}x "
+          f"{1.0:>10.3f}")
+
+    for kind in QUANTIZATIONS:
+        matrix = QuantizedMatrix.from_matrix(exact, kind, oversample)
+        found, _ = matrix.search_batch(queries, top_k)
+        recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(found.tolist(), expected.tolist())])
+        ms = time_per_call(lambda: matrix.search(queries[0], top_k), repeats)
+        saved = 1 - matrix.nbytes / exact.nbytes
+        print(f"{n_chunks:>8} {kind:>8} {matrix.nbytes / 2**20:>10.1f} {saved:>7.0%} {ms:>10.3f} "
+              f"{ms / baseline_ms:>10.2f}x {recall:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantised candidate search with exact re-rank")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)  # text-embedding-ada-002
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200, help="queries used for recall@k")
+    parser.add_argument("--oversample", type=int, default=4, help="candidates re-scored = top_k * oversample")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"dim={args.dim} top_k={args.top_k} oversample={args.oversample} queries={args.queries}")
+    print(f"{'chunks':>8} {'storage':>8} {'MiB':>10} {'saved':>8} {'ms/query':>10} {'vs float32':>11} "
+          f"{f'recall@{args.top_k}':>10}")
+    for n_chunks in args.sizes:
+        benchmark(n_chunks, args.dim, args.top_k, args.queries, args.oversample, args.repeats)
+    print("Quantisation trades latency for memory: NumPy has no int8/float16 BLAS kernel, so the codes are "
+          "converted to float32 block by block and each query is slower than the float32 search.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import time
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import SimpleVectorStore, VectorStoreQuery
+from retrieval import DenseMatrix
+
+
+def time_per_call(fn, repeats: int) -> float:
+    """Mean wall time of fn() in milliseconds"""
+    fn()  # Warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def benchmark(n_chunks: int, dim: int, top_k: int, repeats: int, batch_size: int):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((n_chunks, dim), dtype=np.float32)
+    queries = rng.standard_normal((batch_size, dim), dtype=np.float32)
+
+    # Current store: llama_index SimpleVectorStore
+    store = SimpleVectorStore()
+    store.add([
+        TextNode(id_=f"node-{i}", text="", embedding=embedding.tolist())
+        for i, embedding in enumerate(embeddings)
+    ])
+    query_list = queries[0].tolist()
+    simple_ms = time_per_call(
+        lambda: store.query(VectorStoreQuery(query_embedding=query_list, similarity_top_k=top_k)),
+        repeats
+    )
+
+    # Vectorised store: one contiguous pre-normalised float32 matrix
+    matrix = DenseMatrix(embeddings)
+    numpy_ms = time_per_call(lambda: matrix.search(queries[0], top_k), repeats)
+    batch_ms = time_per_call(lambda: matrix.search_batch(queries, top_k), repeats) / batch_size
+
+    # Same top-k as the current store
+    expected = store.query(VectorStoreQuery(query_embedding=query_list, similarity_top_k=top_k)).ids
+    indices, _ = matrix.search(queries[0], top_k)
+    agree = [f"node-{i}" for i in indices.tolist()] == list(expected)
+
+    print(f"{n_chunks:>8} {simple_ms:>18.3f} {numpy_ms:>14.3f} {batch_ms:>20.4f} "
+          f"{simple_ms / numpy_ms:>9.1f}x {'yes' if agree else 'NO':>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SimpleVectorStore against the NumPy retriever")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)  # text-embedding-ada-002
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"dim={args.dim} top_k={args.top_k} repeats={args.repeats} batch_size={args.batch_size}")
+    print(f"{'chunks':>8} {'SimpleVectorStore ms':>18} {'NumPy ms':>14} {'NumPy batch ms/query':>20} "
+          f"{'speedup':>10} {'same top-k':>8}")
+    for n_chunks in args.sizes:
+        benchmark(n_chunks, args.dim, args.top_k, args.repeats, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
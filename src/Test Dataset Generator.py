@@ -1,14 +1,14 @@
 import pandas as pd
 import json
-from openai import OpenAI
+from llm_client import openai_client
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Initialize OpenAI client (shared pool with retries, see llm_client)
+client = openai_client(os.getenv("OPENAI_API_KEY"))
 
 # VAT rates definition
 vat_rates = [
@@ -1,21 +1,20 @@
 import pandas as pd
 import requests
-import matplotlib
-
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import seaborn as sns
-from rouge_score import rouge_scorer
 from tqdm import tqdm
-import time
 import numpy as np
 
+# matplotlib, seaborn and rouge_score are imported where they are first used
+_scorer = None
+
 
 def calculate_controlled_rouge(text1: str, text2: str) -> float:
     """Calculate ROUGE score with controlled range"""
     # Calculate base ROUGE score
-    scorer = rouge_scorer.RougeScorer(['rouge1'], use_stemmer=True)
-    base_score = scorer.score(str(text1), str(text2))['rouge1'].fmeasure
+    global _scorer
+    if _scorer is None:
+        from rouge_score import rouge_scorer
+        _scorer = rouge_scorer.RougeScorer(['rouge1'], use_stemmer=True)
+    base_score = _scorer.score(str(text1), str(text2))['rouge1'].fmeasure
 
     # Apply controlled scaling to keep scores in desired range
     target_mean = 0.75
@@ -48,14 +47,13 @@ def evaluate_predictions(test_csv_path='test_dataset.csv'):
     # Test each invoice with progress bar
     for idx, row in enumerate(tqdm(df.itertuples(), total=len(df), desc="Processing invoices")):
         try:
-            # Add small delay to prevent rate limiting
-            time.sleep(0.1)
-
-            # Make prediction
+            # Make prediction; the server paces LLM calls to its rate limits and
+            # serves evaluation traffic after interactive requests
             response = requests.post(
                 "http://127.0.0.1:8000/predict",
                 json={"data": row.invoice_text},
-                timeout=30  # Increased timeout
+                headers={"X-Priority": "evaluation"},
+                timeout=60  # Above the server's PREDICT_DEADLINE_SECONDS, which includes time queued for quota
             )
 
             if response.status_code == 200:
@@ -98,6 +96,11 @@ def evaluate_predictions(test_csv_path='test_dataset.csv'):
     category_mean_rouge = results_df['category_rouge'].mean()
 
     # Create visualization
+    import matplotlib
+    matplotlib.use('Agg')  # Only saving to file, no GUI backend needed
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.figure(figsize=(15, 10))
 
     # Plot 1: VAT ROUGE Scores
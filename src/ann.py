@@ -0,0 +1,179 @@
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import json
+import math
+import os
+import shutil
+import numpy as np
+from retrieval import DenseMatrix, top_k_indices
+
+
+CENTROIDS_FILE = "centroids.npy"
+LIST_OFFSETS_FILE = "list_offsets.npy"
+ORDER_FILE = "order.npy"
+VECTORS_FILE = "vectors.npy"
+META_FILE = "meta.json"
+
+
+def default_n_lists(n_rows: int) -> int:
+    """About sqrt(n) lists keeps both the centroid scan and each probed list short"""
+    return max(1, min(n_rows, int(round(math.sqrt(n_rows)))))
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+    """Nearest centroid (by dot product) of every row, computed block by block"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(sample: np.ndarray, n_lists: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """Unit-norm centroids of unit-norm rows; empty clusters are re-seeded from random rows"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+        centroids[non_empty] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = DenseMatrix.normalise(centroids)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file (IVF-flat) approximate nearest-neighbour index over unit-norm vectors
+
+    Rows are clustered by spherical k-means into n_lists lists and stored contiguously
+    list by list. A query scores the centroids, then scans only the nprobe closest lists
+    exactly. Raising nprobe trades speed for recall; nprobe = n_lists is brute force.
+    """
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, order: np.ndarray, vectors: np.ndarray,
+                 nprobe: int = 8):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.order = order
+        self.vectors = vectors
+        self.nprobe = nprobe
+        self.position = np.empty(len(order), dtype=np.int64)
+        self.position[np.asarray(order)] = np.arange(len(order))
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    normalise = staticmethod(DenseMatrix.normalise)
+
+    @classmethod
+    def build(cls, directory: Path, matrix: np.ndarray, n_lists: Optional[int] = None, nprobe: int = 8,
+              n_iter: int = 10, sample_per_list: int = 64, max_sample: int = 100000, seed: int = 0,
+              block_rows: int = 16384) -> "IVFIndex":
+        """Cluster the unit-norm matrix (which may be memory-mapped) and persist the index to directory
+
+        Centroids are trained on a random sample; every row is then assigned block by block and
+        copied into its list. The directory appears atomically.
+        """
+        directory = Path(directory)
+        n_rows, dim = matrix.shape
+        n_lists = min(n_lists or default_n_lists(n_rows), n_rows)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n_rows, max(n_lists, min(n_lists * sample_per_list, max_sample)))
+        sample = np.asarray(matrix[np.sort(rng.choice(n_rows, sample_size, replace=False))], dtype=np.float32)
+        centroids = spherical_kmeans(sample, n_lists, n_iter, seed)
+        del sample
+
+        assignments = _assign(matrix, centroids, block_rows)
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+
+        staging = directory.with_name(f".{directory.name}.tmp-{os.getpid()}")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        vectors = np.lib.format.open_memmap(staging / VECTORS_FILE, mode="w+", dtype=np.float32, shape=(n_rows, dim))
+        for start in range(0, n_rows, block_rows):
+            rows = order[start:start + block_rows]
+            by_row = np.argsort(rows)  # Read the mapped rows in file order
+            block = np.empty((len(rows), dim), dtype=np.float32)
+            block[by_row] = matrix[rows[by_row]]
+            vectors[start:start + len(rows)] = block
+        vectors.flush()
+        del vectors
+        np.save(staging / CENTROIDS_FILE, centroids)
+        np.save(staging / LIST_OFFSETS_FILE, list_offsets)
+        np.save(staging / ORDER_FILE, order)
+        with open(staging / META_FILE, "w", encoding="utf-8") as f:
+            json.dump({"n_rows": n_rows, "dim": dim, "n_lists": n_lists}, f)
+
+        try:
+            os.replace(staging, directory)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)  # Another worker built it first
+        return cls.load(directory, nprobe)
+
+    @classmethod
+    def load(cls, directory: Path, nprobe: int = 8) -> "IVFIndex":
+        directory = Path(directory)
+        return cls(
+            np.load(directory / CENTROIDS_FILE),
+            np.load(directory / LIST_OFFSETS_FILE),
+            np.load(directory / ORDER_FILE, mmap_mode="r"),
+            np.load(directory / VECTORS_FILE, mmap_mode="r"),
+            nprobe
+        )
+
+    @classmethod
+    def load_or_build(cls, directory: Path, matrix: np.ndarray, n_lists: Optional[int] = None,
+                      nprobe: int = 8) -> "IVFIndex":
+        if (Path(directory) / META_FILE).exists():
+            return cls.load(directory, nprobe)
+        return cls.build(directory, matrix, n_lists, nprobe)
+
+    def _probe(self, query: np.ndarray, top_k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Scan the nprobe closest lists, plus more if they hold fewer than top_k rows"""
+        ranked = np.argsort(-(self.centroids @ query), kind="stable")
+        positions, scores = [], []
+        found = 0
+        for probed, list_id in enumerate(ranked.tolist()):
+            if probed >= nprobe and found >= top_k:
+                break
+            start, end = int(self.list_offsets[list_id]), int(self.list_offsets[list_id + 1])
+            if start == end:
+                continue
+            positions.append(np.arange(start, end))
+            scores.append(np.asarray(self.vectors[start:end]) @ query)
+            found += end - start
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        positions, scores = np.concatenate(positions), np.concatenate(scores)
+        best = top_k_indices(scores, top_k)
+        return np.asarray(self.order[positions[best]]), scores[best]
+
+    def search(self, query: Sequence[float], top_k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, scores) of the approximate top_k rows for one query"""
+        return self._probe(self.normalise(query), top_k, nprobe or self.nprobe)
+
+    def search_batch(self, queries: Sequence[Sequence[float]], top_k: int,
+                     nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores), each of shape (n_queries, min(top_k, len(self)))"""
+        results = [self._probe(query, top_k, nprobe or self.nprobe)
+                   for query in self.normalise(np.atleast_2d(queries))]
+        return np.stack([indices for indices, _ in results]), np.stack([scores for _, scores in results])
+
+    def rescore(self, query: Sequence[float], indices: Sequence[int]) -> np.ndarray:
+        """Exact cosine similarity of the query to the given rows"""
+        positions = self.position[np.asarray(indices, dtype=np.int64)]
+        order = np.argsort(positions)
+        scores = np.empty(len(positions), dtype=np.float32)
+        scores[order] = np.asarray(self.vectors[positions[order]]) @ self.normalise(query)
+        return scores
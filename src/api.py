@@ -1,9 +1,20 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any
-import mlflow
-from .gl_predictor import GLPredictor
-from .vat_rag import VatRag
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
+import asyncio
+import hmac
+import time
+import json
+import os
+from .metrics_writer import MetricsWriter
+
+# The predictor stack (llama_index, OpenAI, numpy, pandas, rouge_score) is imported by
+# load_components() in the startup thread, so importing this module stays fast
+if TYPE_CHECKING:
+    from .gl_predictor import GLPredictor
+    from .vat_rag import VatRag
 
 
 class InvoiceRequest(BaseModel):
@@ -15,13 +26,135 @@ class PredictionResponse(BaseModel):
     category_prediction: Dict[str, Any]
 
 
-app = FastAPI()
+class BatchInvoiceItem(BaseModel):
+    id: str
+    data: str
+
+
+class BatchInvoiceRequest(BaseModel):
+    invoices: List[BatchInvoiceItem]
+    max_concurrency: Optional[int] = None
+
+
+# Upper bound on invoices predicted at once within a single batch request
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+
+
+# Canned invoices run through the predictor at startup to prime caches and connections
+WARMUP_INVOICES = [
+    "Invoice for IT consulting services\nAmount: £1,000\nVAT (20%): £200\nTotal: £1,200",
+    "Invoice for printed books supplied to staff training\nAmount: £300\nZero-rated supply\nTotal: £300",
+    "Construction services invoice\nAmount: £5,000\nVAT reverse charge applies\nTotal: £5,000",
+]
+
+# Seconds between checks for a snapshot published by another worker's reindex; 0 disables
+INDEX_REFRESH_INTERVAL = float(os.getenv("INDEX_REFRESH_INTERVAL", "30"))
+
+# POST /admin/reindex requires a matching X-Admin-Token header, and is disabled (403) while this is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Built in the background by the lifespan hook; requests get 503 until they are set
+vat_rag: Optional["VatRag"] = None
+predictor: Optional["GLPredictor"] = None
+readiness: Dict[str, Any] = {"index_loaded": False, "warmed_up": False, "error": None, "timings": {}}
+
+# MLflow writes happen on a background thread, off the request path
+metrics_writer = MetricsWriter(
+    max_queue=int(os.getenv("METRICS_QUEUE_SIZE", "10000")),
+    flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", "5")),
+    flush_size=int(os.getenv("METRICS_FLUSH_SIZE", "500"))
+)
+
+
+def load_components():
+    """Initialize VAT RAG and GL Predictor (blocking; runs in a worker thread)"""
+    global vat_rag, predictor
+    start = time.perf_counter()
+    from .gl_predictor import GLPredictor
+    from .vat_rag import VatRag
+    readiness["timings"]["import_seconds"] = round(time.perf_counter() - start, 3)
+
+    rag = VatRag("data/vat_legislation.csv")
+    rag.build_index()  # Reuses the on-disk snapshot unless the CSV or settings changed
+    new_predictor = GLPredictor(rag)
+    readiness["timings"]["index_load_seconds"] = round(time.perf_counter() - start, 3)
+    readiness["timings"]["phases"] = rag.timings
+    vat_rag, predictor = rag, new_predictor
+
+
+async def warm_up():
+    """Best-effort: run the canned invoices and one direct query so the first real request is warm"""
+    start = time.perf_counter()
+    try:
+        await vat_rag.aquery("What is the standard rate of VAT in the UK?")
+        for invoice in WARMUP_INVOICES:
+            await predictor.apredict(invoice)
+    except Exception as e:
+        print(f"Warm-up error: {str(e)}")
+    readiness["timings"]["warm_up_seconds"] = round(time.perf_counter() - start, 3)
+
+
+async def initialise():
+    try:
+        await asyncio.to_thread(load_components)
+        readiness["index_loaded"] = True
+        await warm_up()
+        readiness["warmed_up"] = True
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Startup error: {str(e)}")
+
+
+async def refresh_index():
+    """Pick up snapshots saved by a reindex in another worker process"""
+    while True:
+        await asyncio.sleep(INDEX_REFRESH_INTERVAL)
+        if vat_rag is None:
+            continue
+        try:
+            await asyncio.to_thread(vat_rag.refresh_if_stale)
+        except Exception as e:
+            print(f"Index refresh error: {str(e)}")
 
-# Initialize VAT RAG and GL Predictor
-vat_rag = VatRag("data/vat_legislation.csv")
-vat_rag.load_documents()
-vat_rag.build_index()
-predictor = GLPredictor(vat_rag)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    metrics_writer.start()
+    # The server accepts connections straight away; /readyz reports when the index is usable
+    tasks = [asyncio.create_task(initialise())]
+    if INDEX_REFRESH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(refresh_index()))
+    yield
+    for task in tasks:
+        task.cancel()
+    # Flush queued metrics before the worker exits
+    await asyncio.to_thread(metrics_writer.stop)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def get_predictor() -> "GLPredictor":
+    if predictor is None:
+        raise HTTPException(status_code=503, detail=readiness["error"] or "Index is still loading")
+    return predictor
+
+
+def llm_priority(requested: Optional[str], default: str):
+    """Scheduling class for a request's LLM calls; X-Priority may lower it (e.g. evaluation runs), never raise it"""
+    # Same module object as vat_rag's (imported from src/, not as part of this package)
+    from llm_scheduler import PRIORITIES, priority
+
+    if requested in PRIORITIES and PRIORITIES.index(requested) > PRIORITIES.index(default):
+        return priority(requested)
+    return priority(default)
+
+
+def log_prediction_metrics(predictions: Dict[str, Any]):
+    metrics_writer.log({
+        "vat_rouge_score": predictions["vat_prediction"]["rouge_score"],
+        "category_rouge_score": predictions["category_prediction"]["rouge_score"]
+    })
 
 """
 Paste in the below /predict thing and ask Claude
@@ -47,49 +180,126 @@ To “train” the AI at the top of the prompt.
 
 """
 @app.post("/predict", response_model=PredictionResponse)
-async def predict_gl_codes(request: InvoiceRequest):
+async def predict_gl_codes(request: InvoiceRequest, x_priority: Optional[str] = Header(default=None)):
     """Endpoint to predict VAT rate and Chart of Account category"""
+    predictor = get_predictor()
     try:
-        # Get predictions
-        predictions = predictor.predict(request.data)
+        # Get predictions; interactive calls are scheduled ahead of batch and evaluation work
+        with llm_priority(x_priority, "interactive"):
+            predictions = await predictor.apredict(request.data)
 
-        # Log to MLFlow
-        with mlflow.start_run():
-            mlflow.log_metrics({
-                "vat_rouge_score": predictions["vat_prediction"]["rouge_score"],
-                "category_rouge_score": predictions["category_prediction"]["rouge_score"]
-            })
+        # Queue for MLFlow
+        log_prediction_metrics(predictions)
 
         return predictions
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/predict/batch")
+async def predict_gl_codes_batch(request: BatchInvoiceRequest, x_priority: Optional[str] = Header(default=None)):
+    """Stream one NDJSON line per invoice, in completion order, tagged with the client's id"""
+    predictor = get_predictor()
+    limit = max(1, min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(limit)
+
+    async def predict_item(item: BatchInvoiceItem) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                with llm_priority(x_priority, "batch"):
+                    predictions = await predictor.apredict(item.data)
+                log_prediction_metrics(predictions)
+                return {"id": item.id, "prediction": PredictionResponse(**predictions).model_dump()}
+            except Exception as e:
+                # A failed invoice is reported on its own line and does not abort the batch
+                return {"id": item.id, "error": str(e)}
+
+    async def stream_results():
+        tasks = [asyncio.create_task(predict_item(item)) for item in request.invoices]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield json.dumps(result, default=str) + "\n"
+        finally:
+            # Client disconnected or stream finished: make sure nothing is left running
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/admin/reindex")
+async def reindex(x_admin_token: Optional[str] = Header(default=None)):
+    """Re-embed new and changed CSV rows, drop removed ones and swap the new index in"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Reindexing is disabled: set ADMIN_TOKEN to enable it")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if vat_rag is None:
+        raise HTTPException(status_code=503, detail=readiness["error"] or "Index is still loading")
+    try:
+        # Queries keep being served from the old index until the new one is swapped in
+        return await asyncio.to_thread(vat_rag.update_index)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def metrics():
+    """Prediction counters (cache hits, misses and evictions) and metrics writer counters"""
+    # The on-disk cache and supplier memo count their rows in SQLite, so off the event loop
+    stats = await asyncio.to_thread(predictor.stats) if predictor is not None else {}
+    return {**stats, "metrics_writer": metrics_writer.stats()}
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving the event loop"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: index loaded and warm-up done, so the load balancer can send traffic"""
+    ready = readiness["index_loaded"] and readiness["warmed_up"]
+    status = "ready" if ready else "failed" if readiness["error"] else "starting"
+    return JSONResponse(status_code=200 if ready else 503, content={"status": status, **readiness})
+
 @app.get("/")
 async def home():
     return "Hello I'm working! And I'm a bit like Flask aren't I?"
 
 @app.post("/evaluate")
 async def evaluate_predictions(data: Dict[str, Dict[str, str]]):
-    """Endpoint to evaluate predictions against actual values"""
+    """Endpoint to evaluate predictions against actual values
+
+    An optional "Invoice": {"data": ...} or "Supplier": {"vat_number": ..., "name": ...} entry
+    teaches the supplier memo the original (correct) labels.
+    """
     try:
-        with mlflow.start_run():
-            # Calculate accuracy metrics
-            vat_match = data["VAT %"]["original"] == data["VAT %"]["prediction"]
-            category_match = data["Chart of Account"]["original"] == data["Chart of Account"]["prediction"]
+        # Calculate accuracy metrics
+        vat_match = data["VAT %"]["original"] == data["VAT %"]["prediction"]
+        category_match = data["Chart of Account"]["original"] == data["Chart of Account"]["prediction"]
+
+        supplier_memo = None
+        if predictor is not None and ("Invoice" in data or "Supplier" in data):
+            supplier_memo = await asyncio.to_thread(
+                predictor.record_feedback,
+                data["VAT %"]["original"],
+                data["Chart of Account"]["original"],
+                invoice_text=data.get("Invoice", {}).get("data"),
+                supplier=data.get("Supplier")
+            )
+
+        # Queue metrics for MLFlow
+        metrics_writer.log({
+            "vat_accuracy": int(vat_match),
+            "category_accuracy": int(category_match),
+            "overall_accuracy": (int(vat_match) + int(category_match)) / 2
+        })
 
-            # Log metrics
-            mlflow.log_metrics({
+        return {
+            "status": "Success",
+            "metrics": {
                 "vat_accuracy": int(vat_match),
-                "category_accuracy": int(category_match),
-                "overall_accuracy": (int(vat_match) + int(category_match)) / 2
-            })
-
-            return {
-                "status": "Success",
-                "metrics": {
-                    "vat_accuracy": int(vat_match),
-                    "category_accuracy": int(category_match)
-                }
-            }
+                "category_accuracy": int(category_match)
+            },
+            "supplier_memo": supplier_memo
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
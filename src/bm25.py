@@ -0,0 +1,122 @@
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+import math
+import re
+import numpy as np
+
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "if", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "will", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens plus adjacent bigrams, so phrases like "reverse charge" score as a unit"""
+    words = [word for word in _TOKEN.findall(str(text).lower()) if word not in STOPWORDS]
+    return words + [f"{first}_{second}" for first, second in zip(words, words[1:])]
+
+
+class BM25Index:
+    """In-process inverted index with Okapi BM25 scoring
+
+    Postings are kept per term as parallel arrays of document positions and term
+    frequencies, so scoring a query only touches the documents containing its terms.
+    Any mapping of terms to such arrays works, e.g. the memory-mapped postings of
+    SharedEmbeddingStore.bm25().
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: Sequence[str] = []
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.postings: Mapping[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def build(self, doc_ids: List[str], texts: List[str]) -> "BM25Index":
+        term_docs: Dict[str, List[int]] = {}
+        term_freqs: Dict[str, List[int]] = {}
+        lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, count in counts.items():
+                term_docs.setdefault(term, []).append(position)
+                term_freqs.setdefault(term, []).append(count)
+
+        self.doc_ids = list(doc_ids)
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.postings = {
+            term: (np.asarray(term_docs[term], dtype=np.int32), np.asarray(term_freqs[term], dtype=np.float32))
+            for term in term_docs
+        }
+        return self
+
+    def idf(self, term: str) -> float:
+        postings = self.postings.get(term)
+        if postings is None:
+            return 0.0
+        n_docs, doc_freq = len(self.doc_ids), len(postings[0])
+        return math.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for query"""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        if not self.doc_ids:
+            return scores
+        avg_length = float(self.doc_lengths.mean()) or 1.0
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            docs, freqs = postings
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / avg_length)
+            scores[docs] += self.idf(term) * freqs * (self.k1 + 1) / (freqs + norm)
+        return scores
+
+    def top_k(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(positions, scores) of the k best documents with a non-zero score, best first"""
+        scores = self.scores(query)
+        matching = np.flatnonzero(scores > 0)
+        if len(matching) == 0:
+            return matching, scores[matching]
+        order = matching[np.argsort(-scores[matching], kind="stable")][:k]
+        return order, scores[order]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "doc_ids": list(self.doc_ids),
+            "doc_lengths": self.doc_lengths.tolist(),
+            "postings": {term: [docs.tolist(), freqs.tolist()] for term, (docs, freqs) in self.postings.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BM25Index":
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_ids = list(data["doc_ids"])
+        index.doc_lengths = np.asarray(data["doc_lengths"], dtype=np.float32)
+        index.postings = {
+            term: (np.asarray(docs, dtype=np.int32), np.asarray(freqs, dtype=np.float32))
+            for term, (docs, freqs) in data["postings"].items()
+        }
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60,
+                           weights: Optional[List[float]] = None) -> List[Tuple[int, float]]:
+    """Fuse ranked lists of positions: score = sum(weight / (k + rank)), best first"""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, position in enumerate(ranking, start=1):
+            fused[position] = fused.get(position, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
@@ -0,0 +1,390 @@
+"""Confidence-gated model cascade in front of the GPT-4 RAG prediction
+
+Cheap tiers answer first, each with an explicit confidence per field (VAT treatment and
+category). A field is settled by the first tier whose confidence reaches that tier's
+threshold; only invoices with a field left unsettled go on to the next tier and, in the
+end, to the RAG path. Tiers:
+
+    arithmetic     VAT rate implied by the invoice's net, VAT and gross amounts (VAT field only)
+    supplier       labels with a stable history for the invoice's supplier, per field (see supplier_memo)
+    rules          keyword rules over the invoice text, no network call
+    llm:<model>    one direct call to a cheaper chat model (e.g. llm:gpt-4o-mini), no retrieval
+
+GL_CASCADE lists them in order with optional thresholds, e.g. "arithmetic,supplier,rules=0.85,llm:gpt-4o-mini=0.8".
+A fraction of fully settled invoices (GL_CASCADE_AUDIT_RATE) still go to the RAG path, so
+agreement of accepted answers with GPT-4 can be measured.
+"""
+from collections import deque
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from supplier_memo import supplier_keys
+from vat_arithmetic import infer_vat_label
+
+if TYPE_CHECKING:
+    from supplier_memo import SupplierMemo
+
+
+FIELDS = ("vat", "category")
+
+# Name under which the GPT-4 RAG path is reported alongside the cheap tiers
+FINAL_TIER = "rag"
+
+
+class Answer:
+    __slots__ = ("label", "confidence", "tier", "evidence")
+
+    def __init__(self, label: str, confidence: float, tier: str, evidence: Optional[Dict[str, Any]] = None):
+        self.label = label
+        self.confidence = confidence
+        self.tier = tier
+        self.evidence = evidence  # What the answer rests on, returned with the prediction
+
+
+class ArithmeticTier:
+    """Answers the VAT field when the stated amounts imply the rate (see vat_arithmetic)"""
+
+    name = "arithmetic"
+
+    def __init__(self, tolerance: Optional[float] = None):
+        self.tolerance = tolerance if tolerance is not None else float(os.getenv("VAT_RATE_TOLERANCE", "0.002"))
+
+    def answer(self, invoice_text: str) -> Dict[str, Answer]:
+        inferred = infer_vat_label(invoice_text, self.tolerance)
+        if inferred is None:
+            return {}
+        label, confidence, rate = inferred
+        return {"vat": Answer(label, confidence, self.name, {"implied_rate": round(rate, 4)})}
+
+    async def aanswer(self, invoice_text: str) -> Dict[str, Answer]:
+        return self.answer(invoice_text)
+
+
+class SupplierTier:
+    """Answers each field the memo has a stable history of for the invoice's supplier"""
+
+    name = "supplier"
+
+    def __init__(self, memo: "SupplierMemo"):
+        self.memo = memo
+
+    def answer(self, invoice_text: str) -> Dict[str, Answer]:
+        answers = {}
+        for field, entry in self.memo.lookup(supplier_keys(invoice_text)).items():
+            # Confirmed by feedback, or more consistent observations, is more certain
+            confidence = 0.97 if entry["confirmed"] else min(0.95, 0.85 + 0.02 * entry["observations"])
+            evidence = {"supplier": entry["key"], "observations": entry["observations"],
+                        "confirmed": entry["confirmed"]}
+            answers[field] = Answer(entry["label"], confidence, self.name, evidence)
+        return answers
+
+    async def aanswer(self, invoice_text: str) -> Dict[str, Answer]:
+        # The memo lives in SQLite, so the lookup runs off the event loop
+        return await asyncio.to_thread(self.answer, invoice_text)
+
+
+class RuleTier:
+    """Keyword rules: explicit VAT wording on the invoice, and category keywords that agree"""
+
+    name = "rules"
+
+    # Checked in order; the first match wins, so a reverse-charge invoice quoting 20% stays reverse charge
+    VAT_RULES = [
+        ("Reverse Charge Expenses (20%)", 0.95, r"reverse[\s-]*charge"),
+        ("No VAT", 0.9, r"\bvat[\s-]*exempt|\bexempt\s+(?:supply|from\s+vat)|outside\s+the\s+scope|\bno\s+vat\b"),
+        ("Zero Rated Expenses", 0.9, r"zero[\s-]*rated|\bvat\s*(?:\(|@|at)?\s*0(?:\.0+)?\s*%|\b0(?:\.0+)?\s*%\s*vat"),
+        ("20% (VAT on Expenses)", 0.9,
+         r"\bvat\s*(?:\(|@|at)?\s*20(?:\.0+)?\s*%|\b20(?:\.0+)?\s*%\s*vat|standard[\s-]*rated?\b"),
+    ]
+
+    # Whole words or phrases only; short stems such as "car", "van" or "mot" match too many other words
+    CATEGORY_KEYWORDS = {
+        "Computer Equipment": ["computer", "computers", "laptop", "laptops", "monitor", "monitors", "hardware",
+                               "software licence", "software license", "keyboard", "printer", "server"],
+        "Professional Services": ["consulting", "consultancy", "legal services", "accountancy", "audit", "advisory",
+                                  "professional services"],
+        "Cost of Goods Sold": ["stock", "inventory", "raw materials", "goods for resale", "wholesale"],
+        "Staff Training": ["training", "workshop", "seminar", "certification", "tuition"],
+        "Motor Vehicle Expenses": ["vehicle", "vehicles", "fuel", "mot test", "tyres", "company car", "car hire",
+                                   "van hire", "mileage"],
+    }
+
+    # Confidence by number of distinct keywords hit: a single keyword stays below the default threshold,
+    # and so does any answer when another category is also hit
+    KEYWORD_CONFIDENCE = {1: 0.7, 2: 0.85}
+    MAX_KEYWORD_CONFIDENCE = 0.9
+    CONFLICTING_KEYWORD_CONFIDENCE = 0.7
+
+    def __init__(self):
+        self._vat_rules = [(label, confidence, re.compile(pattern, re.IGNORECASE))
+                           for label, confidence, pattern in self.VAT_RULES]
+        self._category_patterns = {
+            category: [re.compile(r"\b" + re.escape(keyword) + r"\b", re.IGNORECASE) for keyword in keywords]
+            for category, keywords in self.CATEGORY_KEYWORDS.items()
+        }
+        # Text naming another category ("... related to Cost of Goods Sold") conflicts like its keywords do
+        self._category_names = {category: re.compile(r"\b" + re.escape(category) + r"\b", re.IGNORECASE)
+                                for category in self.CATEGORY_KEYWORDS}
+
+    def answer(self, invoice_text: str) -> Dict[str, Answer]:
+        answers = {}
+        matched = [(label, confidence) for label, confidence, pattern in self._vat_rules if pattern.search(invoice_text)]
+        if matched:
+            label, confidence = matched[0]
+            # Conflicting wording (other than reverse charge, which always quotes a rate) lowers confidence
+            if label != self._vat_rules[0][0] and len({other for other, _ in matched}) > 1:
+                confidence *= 0.5
+            answers["vat"] = Answer(label, confidence, self.name)
+
+        hits = {category: sum(1 for pattern in patterns if pattern.search(invoice_text))
+                for category, patterns in self._category_patterns.items()}
+        total = sum(hits.values())
+        if total:
+            category, top = max(hits.items(), key=lambda item: item[1])
+            total += sum(1 for other, pattern in self._category_names.items()
+                         if other != category and not hits[other] and pattern.search(invoice_text))
+            confidence = self.KEYWORD_CONFIDENCE.get(top, self.MAX_KEYWORD_CONFIDENCE)
+            if total > top:
+                # Keywords of other categories: scaled down, and never enough to settle
+                confidence = min(confidence * top / total, self.CONFLICTING_KEYWORD_CONFIDENCE)
+            answers["category"] = Answer(category, round(confidence, 4), self.name)
+        return answers
+
+    async def aanswer(self, invoice_text: str) -> Dict[str, Answer]:
+        return self.answer(invoice_text)
+
+
+class ModelTier:
+    """One call to a cheaper chat model asked for both labels and its confidence in each
+
+    The call goes straight to the model without retrieval. It is not scheduled against the
+    GPT-4 quota (see llm_scheduler), since other models have their own limits.
+    """
+
+    def __init__(self, model: str, vat_labels: Sequence[str], category_labels: Sequence[str],
+                 api_key: Optional[str] = None):
+        from llm_client import make_llm
+
+        self.model = model
+        self.name = f"llm:{model}"
+        self.vat_labels = list(vat_labels)
+        self.category_labels = list(category_labels)
+        self.llm = make_llm(model=model, temperature=0.0, api_key=api_key)
+
+    def _prompt(self, invoice_text: str) -> str:
+        return (
+            "Classify this UK purchase invoice.\n"
+            f"VAT treatment must be one of: {', '.join(self.vat_labels)}.\n"
+            f"Accounting category must be one of: {', '.join(self.category_labels)}.\n"
+            "For each label give your confidence, the probability from 0 to 1 that it is correct.\n"
+            'Answer only with JSON of the form {"vat_rate": "...", "vat_confidence": 0.0, '
+            '"category": "...", "category_confidence": 0.0}.\n'
+            f"Invoice: {invoice_text}"
+        )
+
+    def _parse(self, text: str) -> Dict[str, Answer]:
+        match = re.search(r"\{.*?\}", text, re.DOTALL)
+        if not match:
+            return {}
+        try:
+            parsed = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            return {}
+
+        answers = {}
+        for field, key, labels in (("vat", "vat_rate", self.vat_labels), ("category", "category", self.category_labels)):
+            label = parsed.get(key)
+            if label not in labels:
+                continue  # Off-list labels are left to the next tier
+            try:
+                confidence = min(1.0, max(0.0, float(parsed.get(f"{field}_confidence", 0.0))))
+            except (TypeError, ValueError):
+                confidence = 0.0
+            answers[field] = Answer(label, confidence, self.name)
+        return answers
+
+    def answer(self, invoice_text: str) -> Dict[str, Answer]:
+        return self._parse(self.llm.complete(self._prompt(invoice_text)).text)
+
+    async def aanswer(self, invoice_text: str) -> Dict[str, Answer]:
+        return self._parse((await self.llm.acomplete(self._prompt(invoice_text))).text)
+
+
+class CascadeResult:
+    """Answers settled so far, plus every tier's proposals for the agreement statistics"""
+
+    def __init__(self):
+        self.accepted: Dict[str, Answer] = {}
+        self.proposals: List[Tuple[str, float, Dict[str, Answer]]] = []
+        self.audit = False
+
+    @property
+    def complete(self) -> bool:
+        return all(field in self.accepted for field in FIELDS)
+
+    @property
+    def needs_final(self) -> bool:
+        """True when the RAG path has to run, to settle the rest or to audit the cheap answers"""
+        return not self.complete or self.audit
+
+    @property
+    def pending(self) -> Tuple[str, ...]:
+        """Fields the RAG path has to answer: the unsettled ones, or all of them on an audit"""
+        return FIELDS if self.audit else tuple(field for field in FIELDS if field not in self.accepted)
+
+
+class _TierStats:
+    def __init__(self, threshold: Optional[float], window: int = 1000):
+        self.threshold = threshold
+        self.invoices = self.finished = self.errors = 0
+        self.fields_answered = {field: 0 for field in FIELDS}
+        self.latencies = deque(maxlen=window)
+        # Agreement with the RAG answer, for answers at or above the threshold and below it
+        self.agreement = {kind: {"compared": 0, "agreed": 0} for kind in ("confident", "unconfident")}
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "threshold": self.threshold,
+            "invoices": self.invoices,
+            "finished": self.finished,
+            "errors": self.errors,
+            "fields_answered": dict(self.fields_answered),
+            "mean_latency_ms": round(sum(latencies) * 1000 / len(latencies), 3) if latencies else 0.0,
+            "p95_latency_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3) if latencies else 0.0,
+            "agreement": {
+                kind: {**counts, "rate": round(counts["agreed"] / counts["compared"], 4) if counts["compared"] else None}
+                for kind, counts in self.agreement.items()
+            },
+        }
+
+
+class Cascade:
+    """Runs the cheap tiers in order and keeps per-tier counts, latency and agreement"""
+
+    def __init__(self, tiers: List[Tuple[Any, float]], audit_rate: float = 0.0):
+        self.tiers = tiers
+        self.audit_rate = audit_rate
+        self._lock = threading.Lock()
+        self._stats = {tier.name: _TierStats(threshold) for tier, threshold in tiers}
+        self._stats[FINAL_TIER] = _TierStats(None)
+        self.invoices = 0
+
+    def run(self, invoice_text: str) -> CascadeResult:
+        result = CascadeResult()
+        for tier, threshold in self.tiers:
+            start = time.perf_counter()
+            try:
+                answers = tier.answer(invoice_text)
+            except Exception as e:
+                print(f"Cascade tier {tier.name} error: {str(e)}")
+                answers = None
+            if self._settle(result, tier, threshold, answers, time.perf_counter() - start):
+                break
+        return self._finish(result)
+
+    async def arun(self, invoice_text: str) -> CascadeResult:
+        result = CascadeResult()
+        for tier, threshold in self.tiers:
+            start = time.perf_counter()
+            try:
+                answers = await tier.aanswer(invoice_text)
+            except Exception as e:
+                print(f"Cascade tier {tier.name} error: {str(e)}")
+                answers = None
+            if self._settle(result, tier, threshold, answers, time.perf_counter() - start):
+                break
+        return self._finish(result)
+
+    def _settle(self, result: CascadeResult, tier, threshold: float, answers: Optional[Dict[str, Answer]],
+                seconds: float) -> bool:
+        """Accept the tier's confident answers for unsettled fields; True once every field is settled"""
+        with self._lock:
+            stats = self._stats[tier.name]
+            stats.invoices += 1
+            stats.latencies.append(seconds)
+            if answers is None:
+                stats.errors += 1
+                return False
+
+            result.proposals.append((tier.name, threshold, answers))
+            for field, answer in answers.items():
+                if field not in result.accepted and answer.confidence >= threshold:
+                    result.accepted[field] = answer
+                    stats.fields_answered[field] += 1
+            if result.complete:
+                stats.finished += 1
+            return result.complete
+
+    def _finish(self, result: CascadeResult) -> CascadeResult:
+        with self._lock:
+            self.invoices += 1
+        result.audit = result.complete and random.random() < self.audit_rate
+        return result
+
+    def record_final(self, result: CascadeResult, labels: Dict[str, str], seconds: float):
+        """Record a RAG answer: its latency, and how the cheap tiers' proposals compare with it"""
+        with self._lock:
+            stats = self._stats[FINAL_TIER]
+            stats.invoices += 1
+            stats.latencies.append(seconds)
+            if not result.complete:
+                stats.finished += 1
+            for field in FIELDS:
+                if field not in result.accepted:
+                    stats.fields_answered[field] += 1
+
+            for name, threshold, answers in result.proposals:
+                for field, answer in answers.items():
+                    if field not in labels:
+                        continue  # Settled by the cascade, so the RAG path did not answer it
+                    counts = self._stats[name].agreement["confident" if answer.confidence >= threshold else "unconfident"]
+                    counts["compared"] += 1
+                    counts["agreed"] += int(answer.label == labels[field])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {name: stats.snapshot() for name, stats in self._stats.items()}
+            invoices = self.invoices
+        cheap = sum(stats["finished"] for name, stats in tiers.items() if name != FINAL_TIER)
+        return {
+            "invoices": invoices,
+            "audit_rate": self.audit_rate,
+            "finished_at_cheap_tiers_rate": round(cheap / invoices, 4) if invoices else 0.0,
+            "tiers": tiers,
+        }
+
+
+def build_cascade(spec: str, vat_labels: Sequence[str], category_labels: Sequence[str],
+                  default_threshold: float = 0.8, audit_rate: float = 0.0, api_key: Optional[str] = None,
+                  supplier_memo: Optional["SupplierMemo"] = None) -> Optional[Cascade]:
+    """Cascade from a spec such as "arithmetic,supplier,rules=0.85,llm:gpt-4o-mini"; None when the spec is empty or "none"
+
+    The supplier tier is left out when no memo is given (SUPPLIER_MEMO_PATH set empty).
+    """
+    tiers = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item or item == "none":
+            continue
+        name, _, threshold = item.partition("=")
+        name = name.strip()
+        if name == ArithmeticTier.name:
+            tier = ArithmeticTier()
+        elif name == SupplierTier.name:
+            if supplier_memo is None:
+                continue
+            tier = SupplierTier(supplier_memo)
+        elif name == RuleTier.name:
+            tier = RuleTier()
+        elif name.startswith("llm:") and len(name) > 4:
+            tier = ModelTier(name[4:], vat_labels, category_labels, api_key)
+        else:
+            raise ValueError(f"Unknown cascade tier {name!r}, expected 'arithmetic', 'supplier', 'rules' or 'llm:<model>'")
+        tiers.append((tier, float(threshold) if threshold else default_threshold))
+    return Cascade(tiers, audit_rate) if tiers else None
@@ -0,0 +1,153 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextvars import Context, copy_context
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import queue
+import threading
+import time
+import llm_client
+
+
+# Statuses that blame the request's content rather than the service
+INPUT_ERROR_STATUSES = {400, 413, 422}
+
+
+class MicroBatchingEmbedder:
+    """Collect embedding requests from concurrent callers and send them as one batched call
+
+    The first text to arrive opens a window of window_ms; texts arriving within it (up to
+    max_batch) go out together in one get_text_embedding_batch call, and each caller gets
+    its own vector back. Identical texts in a batch are embedded once. Batches are sent
+    from a small thread pool, so a slow call does not hold up the next window.
+
+    Exposes the embed-model methods the retrievers and semantic cache use, so it can be
+    passed wherever they take an embed_model. OpenAI's embedding models embed queries and
+    documents the same way, so queries are batched as text embeddings.
+
+    Each caller's context (its llm_client deadline and llm_scheduler priority) is captured
+    at submit. A batch is sent in the context of the member with the latest deadline, so
+    no caller's call is cut short by another's; each caller stops waiting at its own.
+
+    If the model rejects a batch of several texts as invalid input (HTTP 400, 413 or 422),
+    each text is retried on its own, so only the caller whose text is bad gets the error.
+    """
+
+    def __init__(self, embed_model, window_ms: float = 5.0, max_batch: int = 64, max_concurrent_batches: int = 4):
+        self.embed_model = embed_model
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[str, Future, float, Context]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="embed-batch")
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self.requests = self.batches = self.texts_sent = self.errors = 0
+        self.queue_seconds = self.max_queue_seconds = self.call_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter(), copy_context()))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._send, batch)
+
+    @staticmethod
+    def _batch_context(batch: List[Tuple[str, Future, float, Context]]) -> Context:
+        """The member context with the most time left; one without a deadline wins outright"""
+        def time_left(context: Context) -> float:
+            left = context.run(llm_client.remaining)
+            return float("inf") if left is None else left
+
+        return max((context for _, _, _, context in batch), key=time_left)
+
+    def _send(self, batch: List[Tuple[str, Future, float, Context]]):
+        sent_at = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _, _, _ in batch))
+        context = self._batch_context(batch)
+        try:
+            vectors = context.run(self.embed_model.get_text_embedding_batch, texts)
+            embeddings: Dict[str, Any] = dict(zip(texts, vectors))
+        except Exception as e:
+            if len(texts) == 1 or getattr(e, "status_code", None) not in INPUT_ERROR_STATUSES:
+                embeddings = {text: e for text in texts}
+            else:
+                embeddings = {text: self._send_one(context, text) for text in texts}
+
+        finished = time.perf_counter()
+        waits = [sent_at - submitted for _, _, submitted, _ in batch]
+        failed = sum(isinstance(embedding, Exception) for embedding in embeddings.values())
+        with self._lock:
+            self.requests += len(batch)
+            self.batches += 1
+            self.texts_sent += len(texts)
+            self.errors += failed
+            self.queue_seconds += sum(waits)
+            self.max_queue_seconds = max(self.max_queue_seconds, *waits)
+            self.call_seconds += finished - sent_at
+        for text, future, _, _ in batch:
+            embedding = embeddings[text]
+            if isinstance(embedding, Exception):
+                future.set_exception(embedding)
+            else:
+                future.set_result(embedding)
+
+    def _send_one(self, context: Context, text: str) -> Any:
+        """Embed one text of a rejected batch; returns its vector or the exception it raised"""
+        try:
+            return context.run(self.embed_model.get_text_embedding_batch, [text])[0]
+        except Exception as e:
+            return e
+
+    def get_query_embedding(self, query: str) -> List[float]:
+        try:
+            return self.submit(query).result(timeout=llm_client.remaining())
+        except FutureTimeout:
+            raise llm_client.DeadlineExceeded("Deadline exceeded while waiting for a batched embedding") from None
+
+    async def aget_query_embedding(self, query: str) -> List[float]:
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.submit(query)), llm_client.remaining())
+        except asyncio.TimeoutError:
+            raise llm_client.DeadlineExceeded("Deadline exceeded while waiting for a batched embedding") from None
+
+    get_text_embedding = get_query_embedding
+    aget_text_embedding = aget_query_embedding
+
+    def get_text_embedding_batch(self, texts: List[str], **kwargs) -> List[List[float]]:
+        """Callers that already have a batch go straight to the model"""
+        return self.embed_model.get_text_embedding_batch(texts, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "requests": self.requests,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "deduplicated": self.requests - self.texts_sent,
+                "mean_queue_ms": round(self.queue_seconds * 1000 / self.requests, 3) if self.requests else 0.0,
+                "max_queue_ms": round(self.max_queue_seconds * 1000, 3),
+                "mean_call_ms": round(self.call_seconds * 1000 / self.batches, 3) if self.batches else 0.0,
+            }
@@ -0,0 +1,198 @@
+"""Local stand-in for the OpenAI embeddings and chat APIs with configurable latency and faults
+
+    python src/fake_openai_server.py --port 8765 --latency-ms 80 --per-item-ms 0.2
+    python src/fake_openai_server.py --error-rate 0.05 --rate-limit-rate 0.05 --stall-rate 0.02 --stall-ms 5000
+
+Point a client at it with api_base="http://127.0.0.1:8765/v1" (or OPENAI_API_BASE) and any api_key.
+Embeddings are deterministic pseudo-random unit vectors derived from the text; chat completions
+return a fixed VAT/category answer. A fraction of requests can fail with a 500, be rate limited
+with a 429 and Retry-After, or stall for stall_ms before answering.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    rng = random.Random(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering POST /v1/embeddings and /v1/chat/completions after latency_ms
+    (+ per_item_ms per embedding input), with optional injected errors, rate limits and stalls"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 50.0, per_item_ms: float = 0.0,
+                 jitter_ms: float = 0.0, dim: int = 1536, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 stall_rate: float = 0.0, stall_ms: float = 5000.0, retry_after: float = 0.1):
+        super().__init__((host, port), _Handler)
+        self.latency_ms = latency_ms
+        self.per_item_ms = per_item_ms
+        self.jitter_ms = jitter_ms
+        self.dim = dim
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.requests = self.inputs = 0
+        self.errors = self.rate_limited = self.stalls = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        """Serve on a daemon thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def delay(self, n_inputs: int) -> float:
+        jitter = random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + self.per_item_ms * n_inputs + jitter) / 1000
+
+    def fault(self) -> Optional[Tuple[int, Dict[str, Any], Dict[str, str]]]:
+        """Injected failure for this request, if any, as (status, payload, headers); may stall first"""
+        draw = random.random()
+        if draw < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return 500, {"error": {"message": "Injected server error", "type": "server_error"}}, {}
+        draw -= self.error_rate
+        if draw < self.rate_limit_rate:
+            with self._lock:
+                self.rate_limited += 1
+            return 429, {"error": {"message": "Injected rate limit", "type": "rate_limit_error"}}, \
+                {"Retry-After": str(self.retry_after)}
+        draw -= self.rate_limit_rate
+        if draw < self.stall_rate:
+            with self._lock:
+                self.stalls += 1
+            time.sleep(self.stall_ms / 1000)
+        return None
+
+    def embeddings(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        inputs = body.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        with self._lock:
+            self.requests += 1
+            self.inputs += len(inputs)
+        time.sleep(self.delay(len(inputs)))
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(str(text), self.dim)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = sum(len(str(text).split()) for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def chat_completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.delay(0))
+
+        content = json.dumps({"vat_rate": "20% (VAT on Expenses)", "category": "Professional Services"})
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+        return {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 12, "total_tokens": prompt_tokens + 12},
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            endpoint = self.server.embeddings
+        elif path.endswith("/chat/completions"):
+            endpoint = self.server.chat_completion
+        else:
+            self._reply(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        fault = self.server.fault()
+        if fault is not None:
+            self._reply(*fault)
+        else:
+            self._reply(200, endpoint(body))
+
+    def _reply(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up (timeout or lost hedge) while this request stalled
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI API server with configurable latency and faults")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="fixed latency per request")
+    parser.add_argument("--per-item-ms", type=float, default=0.0, help="extra latency per input text")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction answered with a 429")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction that stall before answering")
+    parser.add_argument("--stall-ms", type=float, default=5000.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency_ms, args.per_item_ms, args.jitter_ms, args.dim,
+                              args.error_rate, args.rate_limit_rate, args.stall_rate, args.stall_ms)
+    print(f"Fake OpenAI API on {server.api_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
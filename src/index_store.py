@@ -0,0 +1,137 @@
+from pathlib import Path
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+PRUNE_GRACE_SECONDS = float(os.getenv("INDEX_PRUNE_GRACE_SECONDS", "600"))
+
+
+def fingerprint(content_digest: str, settings: Dict[str, Any]) -> str:
+    """Hash the source content digest together with the settings that shape the index"""
+    digest = hashlib.sha256(content_digest.encode("utf-8"))
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IndexStore:
+    """Directory of persisted VectorStoreIndex snapshots keyed by fingerprint"""
+
+    def __init__(self, root: Path, prune_grace: float = PRUNE_GRACE_SECONDS):
+        self.root = Path(root)
+        # Older snapshots are kept this long after a newer one is published, so workers
+        # still loading or mapping them are not pulled out from under
+        self.prune_grace = prune_grace
+
+    def snapshot_dir(self, key: str) -> Path:
+        return self.root / key[:16]
+
+    def current(self) -> Optional[str]:
+        """Return the key of the most recently saved snapshot, if any"""
+        try:
+            return (self.root / CURRENT_FILE).read_text(encoding="utf-8").strip() or None
+        except FileNotFoundError:
+            return None
+
+    def has(self, key: str) -> bool:
+        manifest = self.read_manifest(key)
+        return manifest is not None and manifest.get("key") == key
+
+    def read_manifest(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.snapshot_dir(key) / MANIFEST_FILE, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def load(self, key: str):
+        """Load the snapshot stored under key back into a VectorStoreIndex"""
+        from llama_index.core import StorageContext, load_index_from_storage
+
+        storage_context = StorageContext.from_defaults(persist_dir=str(self.snapshot_dir(key)))
+        return load_index_from_storage(storage_context)
+
+    def save(self, key: str, index, manifest: Dict[str, Any]) -> Path:
+        """Persist index under key, then point CURRENT at it and drop stale snapshots
+
+        The snapshot is written to a staging directory unique to this call and renamed
+        into place, so other workers never observe a half-written index. A snapshot with
+        the same key that is already published holds the same content, so it is kept
+        and this copy is discarded.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        target = self.snapshot_dir(key)
+        if not self.has(key):
+            staging = Path(tempfile.mkdtemp(prefix=f".{key[:16]}.tmp-", dir=self.root))
+            try:
+                index.storage_context.persist(persist_dir=str(staging))
+                with open(staging / MANIFEST_FILE, "w", encoding="utf-8") as f:
+                    json.dump({**manifest, "key": key, "created_at": time.time()}, f, indent=2, default=str)
+                self._publish(staging, target, key)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        self._write_current(key)
+        self._prune(keep=target.name)
+        return target
+
+    def _publish(self, staging: Path, target: Path, key: str):
+        """Rename staging into place unless another writer published key first"""
+        try:
+            os.rename(staging, target)
+        except OSError:
+            if self.has(key):
+                return
+            # A partial or foreign directory is in the way (e.g. a 16-char prefix collision)
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(staging, target)
+
+    def read_artifact(self, key: str, name: str) -> Optional[Any]:
+        """Read a JSON side file (e.g. the BM25 index) stored with the snapshot"""
+        try:
+            with open(self.snapshot_dir(key) / f"{name}.json", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_artifact(self, key: str, name: str, data: Any):
+        target = self.snapshot_dir(key) / f"{name}.json"
+        tmp = target.with_name(f".{target.name}.tmp-{uuid.uuid4().hex}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, target)
+
+    def _write_current(self, key: str):
+        tmp = self.root / f".{CURRENT_FILE}.tmp-{uuid.uuid4().hex}"
+        tmp.write_text(key, encoding="utf-8")
+        os.replace(tmp, self.root / CURRENT_FILE)
+
+    def _prune(self, keep: str):
+        """Remove snapshots published more than prune_grace seconds before the current one
+
+        Staging directories left behind by crashed writers are removed once they are
+        older than the grace period.
+        """
+        cutoff = self._created_at(self.root / keep) - self.prune_grace
+        for path in self.root.iterdir():
+            if not path.is_dir() or path.name == keep:
+                continue
+            if self._created_at(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def _created_at(path: Path) -> float:
+        try:
+            with open(path / MANIFEST_FILE, encoding="utf-8") as f:
+                return float(json.load(f)["created_at"])
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return time.time()
@@ -0,0 +1,138 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import re
+
+
+_WORD = re.compile(r"\S+")
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, otherwise estimate ~4 chars per token"""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return (len(text) + 3) // 4
+
+
+class BoilerplateStripper:
+    """Remove text shared across many scraped pages (cookie banners, menus, footers)
+
+    Pages are split into overlapping word shingles. A shingle that appears in at
+    least `min_doc_share` of the pages (and at least `min_docs` pages) is treated as
+    boilerplate, and every word it covers is dropped from each page.
+    """
+
+    def __init__(self, shingle_size: int = 8, min_doc_share: float = 0.5, min_docs: int = 2):
+        self.shingle_size = shingle_size
+        self.min_doc_share = min_doc_share
+        self.min_docs = min_docs
+        self.boilerplate = set()
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "shingle_size": self.shingle_size,
+            "min_doc_share": self.min_doc_share,
+            "min_docs": self.min_docs,
+        }
+
+    def _shingles(self, words: List[str]) -> List[str]:
+        size = self.shingle_size
+        return [
+            hashlib.blake2b(" ".join(words[i:i + size]).encode("utf-8"), digest_size=8).hexdigest()
+            for i in range(max(len(words) - size + 1, 0))
+        ]
+
+    def fit(self, texts: Iterable[str]) -> "BoilerplateStripper":
+        """Learn which shingles are shared across pages"""
+        doc_freq: Dict[str, int] = {}
+        n_docs = 0
+        for text in texts:
+            n_docs += 1
+            for shingle in set(self._shingles(_WORD.findall(text))):
+                doc_freq[shingle] = doc_freq.get(shingle, 0) + 1
+
+        threshold = max(self.min_docs, self.min_doc_share * n_docs)
+        self.boilerplate = {shingle for shingle, freq in doc_freq.items() if freq >= threshold}
+        return self
+
+    def digest(self) -> str:
+        """Hash of the fitted boilerplate set, so a snapshot can tell when stripping would change"""
+        return hashlib.sha256(" ".join(sorted(self.boilerplate)).encode("utf-8")).hexdigest()
+
+    def strip(self, text: str) -> str:
+        """Drop every word covered by a boilerplate shingle"""
+        words = _WORD.findall(text)
+        if not self.boilerplate or len(words) < self.shingle_size:
+            return " ".join(words)
+
+        keep = [True] * len(words)
+        for i, shingle in enumerate(self._shingles(words)):
+            if shingle in self.boilerplate:
+                keep[i:i + self.shingle_size] = [False] * self.shingle_size
+        return " ".join(word for word, kept in zip(words, keep) if kept)
+
+
+def row_hashes(rows: Iterable[Tuple[Any, str]]) -> Dict[str, str]:
+    """Content hash of each raw (id, text) row, keyed by str(id)"""
+    return {str(row_id): hashlib.sha256(str(text).encode("utf-8")).hexdigest() for row_id, text in rows}
+
+
+class PageCleaner:
+    """Strip boilerplate and drop duplicate pages batch by batch, keeping running totals
+
+    The stripper must already be fitted; only the digests of pages seen so far are kept.
+    """
+
+    def __init__(self, stripper: Optional[BoilerplateStripper] = None):
+        self.stripper = stripper or BoilerplateStripper()
+        self.seen = set()
+        self.documents_in = self.duplicates = 0
+        self.chars_before = self.chars_after = self.tokens_before = self.tokens_after = 0
+
+    def clean(self, rows: Iterable[Tuple[Any, str]]) -> List[Tuple[Any, str]]:
+        cleaned = []
+        for row_id, text in rows:
+            stripped = self.stripper.strip(text)
+            self.documents_in += 1
+            self.chars_before += len(text)
+            self.tokens_before += count_tokens(text)
+
+            digest = hashlib.sha256(stripped.encode("utf-8")).hexdigest()
+            if not stripped or digest in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(digest)
+
+            self.chars_after += len(stripped)
+            self.tokens_after += count_tokens(stripped)
+            cleaned.append((row_id, stripped))
+        return cleaned
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "documents_in": self.documents_in,
+            "documents_out": self.documents_in - self.duplicates,
+            "duplicates_removed": self.duplicates,
+            "boilerplate_shingles": len(self.stripper.boilerplate),
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "chars_saved": self.chars_before - self.chars_after,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": self.tokens_before - self.tokens_after,
+        }
+
+
+def clean_pages(rows: List[Tuple[Any, str]], stripper: Optional[BoilerplateStripper] = None
+                ) -> Tuple[List[Tuple[Any, str]], Dict[str, Any]]:
+    """Strip shared boilerplate and drop duplicate pages, reporting what was saved
+
+    rows is a list of (id, text) pairs; the cleaned pairs are returned in the same order.
+    """
+    stripper = stripper or BoilerplateStripper()
+    stripper.fit(text for _, text in rows)
+    cleaner = PageCleaner(stripper)
+    cleaned = cleaner.clean(rows)
+    return cleaned, cleaner.report()
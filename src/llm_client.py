@@ -0,0 +1,459 @@
+"""Shared, pooled HTTP layer for every OpenAI call (LLM and embeddings)
+
+All clients share one keep-alive connection pool per process. Each upstream request is
+bounded by the caller's deadline (see deadline() and budget_share()) and gets jittered
+retries on timeouts, connection errors, 429s and 5xx responses. Optionally, when an
+attempt runs past a percentile of recent latencies, a second identical request is
+started and whichever answers first wins (hedging). Inside an extra_attempts() block,
+retries and hedges of chat completions are first cleared with the given budget (see
+llm_scheduler.LLMScheduler.charging), so they count against the same quota as first attempts.
+
+Settings come from the environment:
+    OPENAI_MAX_CONNECTIONS       pool size (default 20)
+    OPENAI_ATTEMPT_TIMEOUT       seconds per attempt (default 30)
+    OPENAI_MAX_RETRIES           retries after the first attempt (default 3)
+    OPENAI_RETRY_BASE_DELAY      first backoff ceiling in seconds, doubled per retry (default 0.25)
+    OPENAI_RETRY_MAX_DELAY       largest backoff in seconds (default 8)
+    OPENAI_HEDGE_PERCENTILE      hedge after this latency percentile, e.g. 95 (default 0: off)
+    OPENAI_API_BASE              point the clients at another server, e.g. src/fake_openai_server.py
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+import asyncio
+import os
+import random
+import threading
+import time
+import httpx
+
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+_extra_attempts: ContextVar[Optional[Any]] = ContextVar("llm_extra_attempts", default=None)
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The caller's deadline passed before the upstream call could complete"""
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """Upstream calls made inside the block, including from tasks started in it, must finish within seconds
+
+    Nested scopes can only shorten the deadline. None or 0 leaves it unchanged.
+    """
+    if not seconds:
+        yield
+        return
+    new = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def budget_share(fraction: float):
+    """Give the block a fraction of the remaining deadline, for sub-queries that run one after another"""
+    left = remaining()
+    with deadline(max(left * fraction, 1e-3) if left is not None else None):
+        yield
+
+
+@contextmanager
+def extra_attempts(budget):
+    """Clear retries and hedges of chat completions in the block with budget first
+
+    budget has retry() and async aretry(), which wait for quota or raise DeadlineExceeded,
+    and hedge(), which returns whether a duplicate may be sent now.
+    """
+    token = _extra_attempts.set(budget)
+    try:
+        yield
+    finally:
+        _extra_attempts.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None when there is none"""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+class ClientPolicy:
+    """Timeouts, retry and hedging settings"""
+
+    def __init__(self, attempt_timeout: float = 30.0, max_retries: int = 3, retry_base_delay: float = 0.25,
+                 retry_max_delay: float = 8.0, hedge_percentile: float = 0.0, hedge_min_samples: int = 20,
+                 max_connections: int = 20):
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_connections = max_connections
+
+    @classmethod
+    def from_env(cls) -> "ClientPolicy":
+        return cls(
+            attempt_timeout=float(os.getenv("OPENAI_ATTEMPT_TIMEOUT", "30")),
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "3")),
+            retry_base_delay=float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.25")),
+            retry_max_delay=float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8")),
+            hedge_percentile=float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0")),
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+        )
+
+    def backoff(self, retry: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential backoff; a numeric Retry-After header takes precedence"""
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.retry_max_delay)
+        except ValueError:
+            pass
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (retry - 1)))
+
+
+class CallStats:
+    """Counters and a window of recent attempt latencies, shared by the sync and async transports"""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.counts = {"requests": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                       "deadline_exceeded": 0, "failures": 0}
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] += n
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < min_samples or not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        latency = {f"p{p}_ms": round(value * 1000, 1) for p in (50, 95, 99)
+                   if (value := self.percentile(p)) is not None}
+        return {**counts, "latency": latency}
+
+
+class _Resilience:
+    """Deadline, retry and hedging decisions shared by both transports"""
+
+    def __init__(self, policy: ClientPolicy, stats: CallStats):
+        self.policy = policy
+        self.stats = stats
+
+    def attempt_timeout(self) -> float:
+        left = remaining()
+        if left is not None and left <= 0:
+            self.stats.count("deadline_exceeded")
+            raise DeadlineExceeded("Deadline exceeded before the upstream call")
+        return self.policy.attempt_timeout if left is None else min(self.policy.attempt_timeout, left)
+
+    @staticmethod
+    def bound_request(request: httpx.Request, timeout: float):
+        current = request.extensions.get("timeout", {})
+        request.extensions["timeout"] = {
+            key: timeout if current.get(key) is None else min(current[key], timeout)
+            for key in ("connect", "read", "write", "pool")
+        }
+
+    def hedge_delay(self, timeout: float) -> Optional[float]:
+        if self.policy.hedge_percentile <= 0:
+            return None
+        delay = self.stats.percentile(self.policy.hedge_percentile, self.policy.hedge_min_samples)
+        return delay if delay is not None and delay < timeout else None
+
+    def retry_delay(self, retry: int, retry_after: Optional[str]) -> float:
+        """Backoff before the next attempt, or DeadlineExceeded if it would not fit in the deadline"""
+        delay = self.policy.backoff(retry, retry_after)
+        left = remaining()
+        if left is not None and delay >= left:
+            self.stats.count("deadline_exceeded")
+            raise DeadlineExceeded("Deadline exceeded while backing off")
+        self.stats.count("retries")
+        return delay
+
+    @staticmethod
+    def _budget(request: httpx.Request):
+        # Embedding calls have their own quota, so only completions are charged
+        return _extra_attempts.get() if request.url.path.endswith("completions") else None
+
+    def charge_retry(self, request: httpx.Request):
+        budget = self._budget(request)
+        if budget is not None:
+            budget.retry()
+
+    async def acharge_retry(self, request: httpx.Request):
+        budget = self._budget(request)
+        if budget is not None:
+            await budget.aretry()
+
+    def may_hedge(self, request: httpx.Request) -> bool:
+        budget = self._budget(request)
+        return budget is None or budget.hedge()
+
+    def retryable(self, retry: int, error: Optional[Exception] = None,
+                  response: Optional[httpx.Response] = None) -> bool:
+        if retry >= self.policy.max_retries or isinstance(error, DeadlineExceeded):
+            return False
+        if error is not None:
+            return isinstance(error, httpx.TransportError)
+        return response.status_code in RETRY_STATUSES
+
+
+def _close_loser(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """httpx transport adding deadlines, jittered retries and hedging in front of a pooled HTTPTransport"""
+
+    def __init__(self, policy: ClientPolicy, stats: CallStats):
+        limits = httpx.Limits(max_connections=policy.max_connections,
+                              max_keepalive_connections=policy.max_connections, keepalive_expiry=60)
+        self.inner = httpx.HTTPTransport(limits=limits)
+        self.resilience = _Resilience(policy, stats)
+        self.stats = stats
+        self._executor = ThreadPoolExecutor(max_workers=max(2, policy.max_connections), thread_name_prefix="hedge")
+
+    def _timed_send(self, request: httpx.Request) -> httpx.Response:
+        start = time.monotonic()
+        self.stats.count("attempts")
+        response = self.inner.handle_request(request)
+        if response.status_code < 500:
+            self.stats.record_latency(time.monotonic() - start)
+        return response
+
+    def _send(self, request: httpx.Request, timeout: float) -> httpx.Response:
+        delay = self.resilience.hedge_delay(timeout)
+        if delay is None:
+            return self._timed_send(request)
+
+        first = self._executor.submit(self._timed_send, request)
+        done, _ = wait([first], timeout=delay)
+        if done or not self.resilience.may_hedge(request):
+            return first.result()
+
+        self.stats.count("hedges")
+        second = self._executor.submit(self._timed_send, request)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [future for future in done if future.exception() is None]
+            if not winners:
+                error = next(iter(done)).exception()
+                continue
+            for loser in pending | set(winners[1:]):
+                loser.add_done_callback(_close_loser)
+            if winners[0] is second:
+                self.stats.count("hedge_wins")
+            return winners[0].result()
+        raise error
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.count("requests")
+        retry = 0
+        while True:
+            timeout = self.resilience.attempt_timeout()
+            self.resilience.bound_request(request, timeout)
+            retry_after = None
+            try:
+                response = self._send(request, timeout)
+            except Exception as e:
+                if not self.resilience.retryable(retry, error=e):
+                    self.stats.count("failures")
+                    raise
+            else:
+                if not self.resilience.retryable(retry, response=response):
+                    return response
+                retry_after = response.headers.get("retry-after")
+                response.close()
+            retry += 1
+            time.sleep(self.resilience.retry_delay(retry, retry_after))
+            self.resilience.charge_retry(request)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.inner.close()
+
+
+class AsyncResilientTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of ResilientTransport; hedges run as tasks on the event loop"""
+
+    def __init__(self, policy: ClientPolicy, stats: CallStats):
+        limits = httpx.Limits(max_connections=policy.max_connections,
+                              max_keepalive_connections=policy.max_connections, keepalive_expiry=60)
+        self.inner = httpx.AsyncHTTPTransport(limits=limits)
+        self.resilience = _Resilience(policy, stats)
+        self.stats = stats
+
+    async def _timed_send(self, request: httpx.Request) -> httpx.Response:
+        start = time.monotonic()
+        self.stats.count("attempts")
+        response = await self.inner.handle_async_request(request)
+        if response.status_code < 500:
+            self.stats.record_latency(time.monotonic() - start)
+        return response
+
+    async def _send(self, request: httpx.Request, timeout: float) -> httpx.Response:
+        delay = self.resilience.hedge_delay(timeout)
+        if delay is None:
+            return await self._timed_send(request)
+
+        first = asyncio.ensure_future(self._timed_send(request))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not self.resilience.may_hedge(request):
+            return await first
+
+        self.stats.count("hedges")
+        second = asyncio.ensure_future(self._timed_send(request))
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if not winners:
+                    error = next(iter(done)).exception()
+                    continue
+                for extra in winners[1:]:
+                    await extra.result().aclose()
+                if winners[0] is second:
+                    self.stats.count("hedge_wins")
+                return winners[0].result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.count("requests")
+        retry = 0
+        while True:
+            timeout = self.resilience.attempt_timeout()
+            self.resilience.bound_request(request, timeout)
+            retry_after = None
+            try:
+                response = await self._send(request, timeout)
+            except Exception as e:
+                if not self.resilience.retryable(retry, error=e):
+                    self.stats.count("failures")
+                    raise
+            else:
+                if not self.resilience.retryable(retry, response=response):
+                    return response
+                retry_after = response.headers.get("retry-after")
+                await response.aclose()
+            retry += 1
+            await asyncio.sleep(self.resilience.retry_delay(retry, retry_after))
+            await self.resilience.acharge_retry(request)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+_lock = threading.Lock()
+_policy: Optional[ClientPolicy] = None
+_stats = CallStats()
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+
+
+def policy() -> ClientPolicy:
+    global _policy
+    with _lock:
+        if _policy is None:
+            _policy = ClientPolicy.from_env()
+        return _policy
+
+
+def http_client() -> httpx.Client:
+    """The process-wide pooled sync client"""
+    global _http_client
+    current_policy = policy()
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(transport=ResilientTransport(current_policy, _stats),
+                                        timeout=current_policy.attempt_timeout)
+        return _http_client
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """The process-wide pooled async client; its connections belong to the event loop that first uses them"""
+    global _async_http_client
+    current_policy = policy()
+    with _lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(transport=AsyncResilientTransport(current_policy, _stats),
+                                                   timeout=current_policy.attempt_timeout)
+        return _async_http_client
+
+
+def _client_kwargs(api_key: Optional[str]) -> Dict[str, Any]:
+    # Retries happen in the transport, so the SDK's own retries are switched off
+    return {
+        "api_key": api_key or os.getenv("OPENAI_API_KEY"),
+        "base_url": os.getenv("OPENAI_API_BASE") or None,
+        "max_retries": 0,
+        "timeout": policy().attempt_timeout,
+    }
+
+
+def openai_client(api_key: Optional[str] = None):
+    """openai.OpenAI on the shared pooled client"""
+    from openai import OpenAI
+
+    return OpenAI(http_client=http_client(), **_client_kwargs(api_key))
+
+
+def async_openai_client(api_key: Optional[str] = None):
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(http_client=async_http_client(), **_client_kwargs(api_key))
+
+
+def _use_shared_clients(model, api_key: Optional[str]):
+    """Point a llama_index OpenAI model at the shared clients (it reuses _client/_aclient once set)"""
+    model._client = openai_client(api_key)
+    model._aclient = async_openai_client(api_key)
+    return model
+
+
+def make_llm(model: str = "gpt-4", temperature: float = 0.3, api_key: Optional[str] = None):
+    """llama_index OpenAI LLM on the shared pooled clients"""
+    from llama_index.llms.openai import OpenAI
+
+    llm = OpenAI(api_key=api_key, model=model, temperature=temperature, max_retries=0,
+                 timeout=policy().attempt_timeout, api_base=os.getenv("OPENAI_API_BASE") or None)
+    return _use_shared_clients(llm, api_key)
+
+
+def make_embed_model(api_key: Optional[str] = None):
+    """llama_index OpenAIEmbedding on the shared pooled clients"""
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    embed_model = OpenAIEmbedding(api_key=api_key, max_retries=0, timeout=policy().attempt_timeout,
+                                  api_base=os.getenv("OPENAI_API_BASE") or None)
+    return _use_shared_clients(embed_model, api_key)
+
+
+def stats() -> Dict[str, Any]:
+    return _stats.stats()
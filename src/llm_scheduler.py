@@ -0,0 +1,348 @@
+"""Process-wide scheduler for upstream LLM calls: RPM/TPM token buckets in front of priority queues
+
+Every RAG query asks the scheduler for one request and its estimated tokens before it
+calls the LLM. While both buckets have room the call goes straight through; otherwise it
+queues in its priority class and is released, highest class first and FIFO within a
+class, as the buckets refill. The buckets refill continuously at headroom x the quota
+and hold only a few seconds' worth, so traffic is paced just under the limit rather than
+bursting into 429s and then backing off.
+
+The priority of a call comes from the surrounding priority() block (default interactive),
+and waiting counts against the caller's llm_client deadline. Retries of a call made inside
+charging() take another request and its tokens from the buckets before they are sent, and
+a hedged duplicate is only sent when the buckets have room for it right away.
+
+Settings come from the environment:
+    OPENAI_RPM               requests per minute allowed for the chat model (default 0: unlimited)
+    OPENAI_TPM               tokens per minute allowed for the chat model (default 0: unlimited)
+    OPENAI_QUOTA_HEADROOM    fraction of the quota to use (default 0.9)
+    OPENAI_BURST_SECONDS     seconds of quota that may be spent at once (default 2)
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Optional
+import asyncio
+import os
+import threading
+import time
+import llm_client
+
+
+# Highest first: a queued interactive call is always released before batch or evaluation work
+PRIORITIES = ("interactive", "batch", "evaluation")
+
+# Rough size of the prompt template around the query and context, and of the answer
+PROMPT_OVERHEAD_TOKENS = 150
+COMPLETION_TOKENS = 256
+
+_priority: ContextVar[str] = ContextVar("llm_priority", default=PRIORITIES[0])
+
+
+@contextmanager
+def priority(name: str):
+    """LLM calls made inside the block, including from tasks started in it, queue in this class"""
+    if name not in PRIORITIES:
+        raise ValueError(f"priority must be one of {PRIORITIES}, got {name!r}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def estimate_tokens(text: str) -> int:
+    """About four characters per token for English text"""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second, up to burst_seconds' worth"""
+
+    def __init__(self, per_minute: float, burst_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = clock()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken; a call larger than the bucket waits for a full one"""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self.level = min(self.capacity, self.level + min(amount, self.capacity))
+
+
+class _Waiter:
+    __slots__ = ("priority", "cost", "enqueued", "event", "loop", "future", "granted")
+
+    def __init__(self, priority: str, cost: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    """Requests-per-minute and tokens-per-minute budgets shared by every LLM call in the process"""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, headroom: float = 0.9, burst_seconds: float = 2.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rpm, self.tpm, self.headroom = rpm, tpm, headroom
+        self.clock = clock
+        self.requests = TokenBucket(rpm * headroom, burst_seconds, clock) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm * headroom, burst_seconds, clock) if tpm > 0 else None
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Waiter]] = {name: deque() for name in PRIORITIES}
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {name: {"granted": 0, "queued": 0, "timeouts": 0, "refunded": 0, "retries": 0,
+                              "hedges": 0, "hedges_skipped": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+                       for name in PRIORITIES}
+        self.estimated_tokens = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(
+            rpm=float(os.getenv("OPENAI_RPM", "0")),
+            tpm=float(os.getenv("OPENAI_TPM", "0")),
+            headroom=float(os.getenv("OPENAI_QUOTA_HEADROOM", "0.9")),
+            burst_seconds=float(os.getenv("OPENAI_BURST_SECONDS", "2")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def acquire(self, cost: int):
+        """Block until the call fits in the budgets, or raise DeadlineExceeded"""
+        if not self.enabled:
+            return
+        waiter = _Waiter(current_priority(), cost)
+        if self._admit(waiter):
+            return
+        if not waiter.event.wait(self._timeout()):
+            self._abandon(waiter)
+
+    def try_acquire(self, cost: int) -> bool:
+        """Take the budget for a call only if it is available now and nothing is queued ahead of it"""
+        if not self.enabled:
+            return True
+        with self._cond:
+            if any(self._queues.values()) or self._try_take(cost) > 0:
+                return False
+            self._record(_Waiter(current_priority(), cost))
+            return True
+
+    @contextmanager
+    def charging(self, cost: int):
+        """Retries and hedges of the upstream calls made inside the block are charged cost each
+
+        Use it around a call whose first attempt was paid for with acquire() or aacquire().
+        """
+        if not self.enabled:
+            yield
+            return
+        with llm_client.extra_attempts(_ExtraAttempts(self, cost)):
+            yield
+
+    async def aacquire(self, cost: int):
+        """Async acquire; a cancelled caller leaves the queue, or returns its grant if it already had one"""
+        if not self.enabled:
+            return
+        waiter = _Waiter(current_priority(), cost, asyncio.get_running_loop())
+        if self._admit(waiter):
+            return
+        try:
+            await asyncio.wait_for(waiter.future, self._timeout())
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+        except asyncio.CancelledError:
+            with self._cond:
+                if waiter.granted:
+                    # Granted as the caller was cancelled: the call will not be made
+                    self._refund(waiter)
+                else:
+                    self._remove(waiter)
+            raise
+
+    @staticmethod
+    def _timeout() -> Optional[float]:
+        left = llm_client.remaining()
+        return None if left is None else max(0.0, left)
+
+    def _admit(self, waiter: _Waiter) -> bool:
+        """Grant straight away if nothing is queued and the budgets allow, otherwise enqueue"""
+        with self._cond:
+            if not any(self._queues.values()) and self._try_take(waiter.cost) == 0:
+                self._record(waiter)
+                return True
+            self._queues[waiter.priority].append(waiter)
+            self._stats[waiter.priority]["queued"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name="llm-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return False
+
+    def _abandon(self, waiter: _Waiter):
+        with self._cond:
+            if waiter.granted:
+                return  # Granted as the wait timed out
+            self._remove(waiter)
+            self._stats[waiter.priority]["timeouts"] += 1
+        raise llm_client.DeadlineExceeded("Deadline exceeded while waiting for LLM quota")
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues[waiter.priority]
+        if waiter in queue:
+            queue.remove(waiter)
+            self._cond.notify()
+
+    def _refund(self, waiter: _Waiter):
+        """Put a granted call's request and tokens back in the buckets for the next waiter"""
+        for bucket, amount in ((self.requests, 1), (self.tokens, waiter.cost)):
+            if bucket is not None:
+                bucket.refund(amount)
+        self.estimated_tokens -= waiter.cost
+        self._stats[waiter.priority]["refunded"] += 1
+        self._cond.notify()
+
+    def _try_take(self, cost: int) -> float:
+        """Take one request and cost tokens and return 0, or return the seconds until they fit"""
+        now = self.clock()
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, cost)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount))
+        if wait > 0:
+            return wait
+        for bucket, amount in ((self.requests, 1), (self.tokens, cost)):
+            if bucket is not None:
+                bucket.take(amount)
+        return 0.0
+
+    def _head(self) -> Optional[_Waiter]:
+        for name in PRIORITIES:
+            if self._queues[name]:
+                return self._queues[name][0]
+        return None
+
+    def _dispatch(self):
+        with self._cond:
+            while True:
+                waiter = self._head()
+                if waiter is None:
+                    self._cond.wait()
+                    continue
+                wait = self._try_take(waiter.cost)
+                if wait > 0:
+                    # Woken early when a higher-priority call arrives or a waiter leaves
+                    self._cond.wait(timeout=wait)
+                    continue
+                self._queues[waiter.priority].popleft()
+                self._record(waiter)
+                if waiter.future is not None:
+                    try:
+                        waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+                    except RuntimeError:
+                        pass  # The caller's event loop has closed
+                else:
+                    waiter.event.set()
+
+    def _record(self, waiter: _Waiter):
+        waiter.granted = True
+        waited = time.monotonic() - waiter.enqueued
+        stats = self._stats[waiter.priority]
+        stats["granted"] += 1
+        stats["wait_seconds"] += waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+        self.estimated_tokens += waiter.cost
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            classes = {
+                name: {
+                    "queue_depth": len(self._queues[name]),
+                    "granted": stats["granted"],
+                    "queued": stats["queued"],
+                    "timeouts": stats["timeouts"],
+                    "refunded": stats["refunded"],
+                    "retries": stats["retries"],
+                    "hedges": stats["hedges"],
+                    "hedges_skipped": stats["hedges_skipped"],
+                    "mean_wait_ms": round(stats["wait_seconds"] * 1000 / stats["granted"], 3)
+                    if stats["granted"] else 0.0,
+                    "max_wait_ms": round(stats["max_wait_seconds"] * 1000, 3),
+                }
+                for name, stats in self._stats.items()
+            }
+            estimated_tokens = self.estimated_tokens
+        return {
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "headroom": self.headroom,
+            "queue_depth": sum(stats["queue_depth"] for stats in classes.values()),
+            "estimated_tokens": estimated_tokens,
+            "classes": classes,
+        }
+
+
+class _ExtraAttempts:
+    """Charges the retries and hedges of one scheduled call to the scheduler, in the caller's priority class"""
+
+    def __init__(self, scheduler: LLMScheduler, cost: int):
+        self.scheduler = scheduler
+        self.cost = cost
+
+    def _count(self, name: str):
+        with self.scheduler._cond:
+            self.scheduler._stats[current_priority()][name] += 1
+
+    def retry(self):
+        """Wait for budget for a retry, like any other call (DeadlineExceeded if it does not come in time)"""
+        self.scheduler.acquire(self.cost)
+        self._count("retries")
+
+    async def aretry(self):
+        await self.scheduler.aacquire(self.cost)
+        self._count("retries")
+
+    def hedge(self) -> bool:
+        """True if a hedged duplicate may be sent: only when the budget is free right now"""
+        allowed = self.scheduler.try_acquire(self.cost)
+        self._count("hedges" if allowed else "hedges_skipped")
+        return allowed
+
+
+_lock = threading.Lock()
+_scheduler: Optional[LLMScheduler] = None
+
+
+def scheduler() -> LLMScheduler:
+    """The process-wide scheduler, configured from the environment on first use"""
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler.from_env()
+        return _scheduler
@@ -0,0 +1,134 @@
+from typing import Any, Dict, List, Optional
+import queue
+import threading
+import time
+
+
+class MetricsWriter:
+    """Background MLflow writer so requests never wait on the tracking store
+
+    Requests call log(), which only puts the metrics on a bounded queue. A daemon
+    thread drains the queue and, every `flush_interval` seconds or once `flush_size`
+    entries are pending, logs the mean and count of each metric to MLflow in one
+    batch. Metrics that arrive while the queue is full are dropped and counted.
+    """
+
+    def __init__(self, experiment_name: str = "vat-predictions", run_name: str = "api-metrics",
+                 max_queue: int = 10000, flush_interval: float = 5.0, flush_size: int = 500):
+        self.experiment_name = experiment_name
+        self.run_name = run_name
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._queue: "queue.Queue[Dict[str, float]]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._client = None
+        self._run_id: Optional[str] = None
+        self._step = 0
+
+        self.logged = self.dropped = self.flushed = self.flushes = self.flush_errors = 0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mlflow-metrics-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the worker after flushing everything still queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._client is not None and self._run_id is not None:
+            try:
+                self._client.set_terminated(self._run_id)
+            except Exception as e:
+                print(f"Metrics writer error: {str(e)}")
+            self._run_id = None
+
+    def log(self, metrics: Dict[str, float]) -> bool:
+        """Queue metrics without blocking; returns False if they were dropped"""
+        try:
+            self._queue.put_nowait(metrics)
+            self.logged += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        pending: List[Dict[str, float]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                pending.append(self._queue.get(timeout=min(timeout, 0.5)))
+            except queue.Empty:
+                pass
+
+            stopping = self._stop.is_set()
+            if stopping:
+                # Drain whatever is left so shutdown loses nothing
+                while True:
+                    try:
+                        pending.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+            if pending and (stopping or len(pending) >= self.flush_size or time.monotonic() >= deadline):
+                self._flush(pending)
+                pending = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+            if stopping:
+                return
+
+    def _flush(self, batch: List[Dict[str, float]]):
+        """Log the mean and count of every metric in batch as one MLflow step"""
+        totals: Dict[str, float] = {}
+        counts: Dict[str, int] = {}
+        for metrics in batch:
+            for name, value in metrics.items():
+                totals[name] = totals.get(name, 0.0) + float(value)
+                counts[name] = counts.get(name, 0) + 1
+
+        try:
+            from mlflow.entities import Metric
+
+            client = self._get_client()
+            timestamp = int(time.time() * 1000)
+            entries = []
+            for name, total in totals.items():
+                entries.append(Metric(name, total / counts[name], timestamp, self._step))
+                entries.append(Metric(f"{name}_count", counts[name], timestamp, self._step))
+            client.log_batch(self._run_id, metrics=entries)
+            self._step += 1
+            self.flushes += 1
+            self.flushed += len(batch)
+        except Exception as e:
+            self.flush_errors += 1
+            print(f"Metrics writer error: {str(e)}")
+
+    def _get_client(self):
+        if self._client is None:
+            import mlflow
+            from mlflow.tracking import MlflowClient
+
+            client = MlflowClient()
+            experiment = mlflow.get_experiment_by_name(self.experiment_name)
+            experiment_id = experiment.experiment_id if experiment else client.create_experiment(self.experiment_name)
+            self._run_id = client.create_run(experiment_id, run_name=self.run_name).info.run_id
+            self._client = client
+        return self._client
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "logged": self.logged,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
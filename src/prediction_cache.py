@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def normalise_invoice_text(text: str) -> str:
+    """Collapse whitespace and case so trivially different copies share a key"""
+    return " ".join(str(text).split()).casefold()
+
+
+def cache_key(text: str, namespace: str = "") -> str:
+    """Stable digest of the normalised invoice text (unlike hash(), identical across processes)"""
+    payload = f"{namespace}\0{normalise_invoice_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU cache with an optional time-to-live"""
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SqliteCache:
+    """On-disk cache shared by every worker on the host through one SQLite file"""
+
+    name = "sqlite"
+    blocking = True  # Does file I/O, so async callers run it in a thread
+
+    def __init__(self, path: Path, max_entries: int = 100000, ttl_seconds: Optional[float] = None):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._sets_since_trim = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at)")
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.ttl_seconds is not None and time.time() - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, default=str), time.time())
+            )
+            self._sets_since_trim += 1
+            if self._sets_since_trim >= 100:
+                self._trim()
+
+    def _trim(self):
+        """Drop the oldest rows once the table is over max_entries"""
+        self._sets_since_trim = 0
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM predictions WHERE key IN "
+                "(SELECT key FROM predictions ORDER BY created_at LIMIT ?)", (excess,)
+            )
+            self.evictions += excess
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        return {
+            "path": str(self.path),
+            "entries": count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class TieredCache:
+    """Look up tiers in order, back-filling faster tiers on a lower-tier hit"""
+
+    def __init__(self, tiers: List[Any]):
+        self.tiers = tiers
+        self.hits = self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster in self.tiers[:i]:
+                    faster.set(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() for the event loop: in-memory tiers are used inline, blocking tiers from a worker thread"""
+        for i, tier in enumerate(self.tiers):
+            value = await self._call(tier.get, tier, key)
+            if value is not None:
+                for faster in self.tiers[:i]:
+                    await self._call(faster.set, faster, key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def aset(self, key: str, value: Any):
+        for tier in self.tiers:
+            await self._call(tier.set, tier, key, value)
+
+    @staticmethod
+    async def _call(method, tier, *args):
+        if getattr(tier, "blocking", False):
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "tiers": {tier.name: tier.stats() for tier in self.tiers},
+        }
+
+
+def build_prediction_cache(default_path: Optional[Path] = None) -> TieredCache:
+    """Build the cache from PREDICTION_CACHE_* environment settings
+
+    PREDICTION_CACHE_PATH set to an empty string disables the shared on-disk tier.
+    """
+    ttl = os.getenv("PREDICTION_CACHE_TTL")
+    ttl_seconds = float(ttl) if ttl else None
+    tiers = [MemoryCache(int(os.getenv("PREDICTION_CACHE_SIZE", "10000")), ttl_seconds)]
+
+    path = os.getenv("PREDICTION_CACHE_PATH", str(default_path) if default_path else "")
+    if path:
+        tiers.append(SqliteCache(Path(path), int(os.getenv("PREDICTION_CACHE_DISK_SIZE", "100000")), ttl_seconds))
+    return TieredCache(tiers)
@@ -0,0 +1,328 @@
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Tuple, Union
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+import numpy as np
+from bm25 import BM25Index, reciprocal_rank_fusion
+
+if TYPE_CHECKING:
+    from ann import IVFIndex
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores along the last axis, best first
+
+    argpartition finds the top k in linear time; only those k are then sorted.
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def retrieval_text(query_bundle: QueryBundle) -> str:
+    """The text to retrieve for: the bundle's custom embedding strings when set, else the query itself"""
+    return " ".join(query_bundle.embedding_strs)
+
+
+class DenseMatrix:
+    """All chunk embeddings in one contiguous float32 matrix with unit-norm rows
+
+    With pre-normalised rows cosine similarity is a plain dot product, so one query
+    is a single matrix-vector product and a batch of queries one matrix-matrix product.
+    """
+
+    def __init__(self, embeddings: Any, normalised: bool = False):
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1) if matrix.size else matrix.reshape(0, 0)
+        if not normalised:
+            matrix = self.normalise(matrix)
+        self.matrix = matrix
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @staticmethod
+    def normalise(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def scores(self, query: Sequence[float]) -> np.ndarray:
+        """Cosine similarity of the query to every row"""
+        return self.matrix @ self.normalise(query)
+
+    def rescore(self, query: Sequence[float], indices: Sequence[int]) -> np.ndarray:
+        """Cosine similarity of the query to the given rows"""
+        return self.matrix[np.asarray(indices, dtype=np.int64)] @ self.normalise(query)
+
+    def search(self, query: Sequence[float], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores) of the top_k rows for one query"""
+        scores = self.scores(query)
+        indices = top_k_indices(scores, top_k)
+        return indices, scores[indices]
+
+    def search_batch(self, queries: Sequence[Sequence[float]], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores), each of shape (n_queries, top_k)"""
+        scores = self.normalise(np.atleast_2d(queries)) @ self.matrix.T
+        indices = top_k_indices(scores, top_k)
+        return indices, np.take_along_axis(scores, indices, axis=-1)
+
+
+QUANTIZATIONS = ("int8", "float16")
+
+
+def quantize(embeddings: np.ndarray, kind: str, codes: Optional[np.ndarray] = None,
+             scales: Optional[np.ndarray] = None, block_rows: int = 16384) -> Tuple[np.ndarray, np.ndarray]:
+    """Quantise rows to int8 codes with a per-row scale (row ~= codes * scale), or to float16 with unit scales
+
+    Works block by block, so embeddings and codes may be memory-mapped files larger than RAM.
+    """
+    if kind not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {kind!r}, expected one of {QUANTIZATIONS}")
+    n_rows, dim = embeddings.shape
+    codes = codes if codes is not None else np.empty((n_rows, dim), dtype=np.int8 if kind == "int8" else np.float16)
+    scales = scales if scales is not None else np.ones(n_rows, dtype=np.float32)
+    for start in range(0, n_rows, block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        end = start + len(block)
+        if kind == "int8":
+            block_scales = np.abs(block).max(axis=1) / 127.0
+            block_scales[block_scales == 0] = 1.0
+            codes[start:end] = np.rint(block / block_scales[:, None]).astype(np.int8)
+            scales[start:end] = block_scales
+        else:
+            codes[start:end] = block.astype(np.float16)
+    return codes, scales
+
+
+class QuantizedMatrix:
+    """int8 or float16 codes of a unit-norm matrix for candidate search, with exact re-rank
+
+    Candidates are scored on the codes block by block, so a query never materialises a
+    float32 copy of the matrix. The best top_k * oversample candidates are then re-scored
+    against the exact float32 rows, which can stay memory-mapped on disk: only those rows
+    are ever read. Returned scores are exact, so similarity_cutoff behaves as before.
+
+    This saves memory, not time: NumPy has no BLAS kernel for int8 or float16, so each
+    block is converted to float32 before the product and a query is slower than on the
+    float32 DenseMatrix.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray, exact: np.ndarray, oversample: int = 4,
+                 block_rows: Optional[int] = None):
+        self.codes = codes
+        self.scales = scales
+        self.exact = exact
+        self.oversample = max(1, oversample)
+        # About 4 MiB of float32 per converted block, so each block is still in cache for the product
+        self.block_rows = block_rows or max(256, (1 << 20) // max(codes.shape[1], 1))
+
+    @classmethod
+    def from_matrix(cls, exact: np.ndarray, kind: str, oversample: int = 4) -> "QuantizedMatrix":
+        """Quantise a unit-norm float32 matrix in memory"""
+        codes, scales = quantize(exact, kind)
+        return cls(codes, scales, exact, oversample)
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    normalise = staticmethod(DenseMatrix.normalise)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def _approximate(self, queries: np.ndarray) -> np.ndarray:
+        """Approximate scores of shape (n_queries, n_rows) for unit-norm queries"""
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = np.asarray(self.codes[start:start + self.block_rows], dtype=np.float32)
+            end = start + len(block)
+            scores[:, start:end] = (queries @ block.T) * self.scales[start:end]
+        return scores
+
+    def scores(self, query: Sequence[float]) -> np.ndarray:
+        """Approximate cosine similarity of the query to every row"""
+        return self._approximate(self.normalise(query).reshape(1, -1))[0]
+
+    def rescore(self, query: Sequence[float], indices: Sequence[int]) -> np.ndarray:
+        """Exact cosine similarity of the query to the given rows"""
+        indices = np.asarray(indices, dtype=np.int64)
+        order = np.argsort(indices)  # Read the mapped rows in file order
+        scores = np.empty(len(indices), dtype=np.float32)
+        scores[order] = np.asarray(self.exact[indices[order]], dtype=np.float32) @ self.normalise(query)
+        return scores
+
+    def _rerank(self, query: np.ndarray, approximate: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        candidates = top_k_indices(approximate, top_k * self.oversample)
+        exact = self.rescore(query, candidates)
+        best = top_k_indices(exact, top_k)
+        return candidates[best], exact[best]
+
+    def search(self, query: Sequence[float], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, exact scores) of the top_k rows for one query"""
+        query = self.normalise(query)
+        return self._rerank(query, self._approximate(query.reshape(1, -1))[0], top_k)
+
+    def search_batch(self, queries: Sequence[Sequence[float]], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, exact scores), each of shape (n_queries, top_k)"""
+        queries = self.normalise(np.atleast_2d(queries))
+        results = [self._rerank(query, approximate, top_k)
+                   for query, approximate in zip(queries, self._approximate(queries))]
+        return np.stack([indices for indices, _ in results]), np.stack([scores for _, scores in results])
+
+
+def shared_store_matrix(store, quantization: Optional[str] = None, oversample: int = 4, ann: Optional[str] = None,
+                        nprobe: int = 8, n_lists: Optional[int] = None
+                        ) -> Union[DenseMatrix, QuantizedMatrix, "IVFIndex"]:
+    """Searchable matrix over a SharedEmbeddingStore: float32, quantised, or an IVF index built on first use"""
+    if ann == "ivf":
+        from ann import IVFIndex, default_n_lists
+
+        n_lists = n_lists or default_n_lists(len(store))
+        return IVFIndex.load_or_build(store.directory / f"ivf-{n_lists}", store.embeddings, n_lists, nprobe)
+    if not quantization:
+        return DenseMatrix(store.embeddings, normalised=True)
+    codes, scales = store.quantized(quantization)
+    return QuantizedMatrix(codes, scales, store.embeddings, oversample)
+
+
+class NumpyRetriever(BaseRetriever):
+    """Top-k retriever over a DenseMatrix, QuantizedMatrix or IVFIndex
+
+    Honours similarity_top_k and similarity_cutoff whichever matrix is used.
+    """
+
+    def __init__(self, matrix: Union[DenseMatrix, QuantizedMatrix, "IVFIndex"], nodes: Sequence[BaseNode],
+                 embed_model, similarity_top_k: int = 2, similarity_cutoff: Optional[float] = None):
+        super().__init__()
+        self.matrix = matrix
+        self.nodes = nodes
+        self.embed_model = embed_model
+        self.similarity_top_k = similarity_top_k
+        self.similarity_cutoff = similarity_cutoff
+
+    @classmethod
+    def from_index(cls, index, embed_model, similarity_top_k: int = 2,
+                   similarity_cutoff: Optional[float] = None) -> "NumpyRetriever":
+        """Copy the embeddings of a VectorStoreIndex into one matrix"""
+        node_ids = list(index.index_struct.nodes_dict.values())
+        nodes = index.docstore.get_nodes(node_ids)
+        embeddings = [index.vector_store.get(node_id) for node_id in node_ids]
+        return cls(DenseMatrix(embeddings), nodes, embed_model, similarity_top_k, similarity_cutoff)
+
+    @classmethod
+    def from_shared_store(cls, store, embed_model, similarity_top_k: int = 2,
+                          similarity_cutoff: Optional[float] = None, **matrix_options) -> "NumpyRetriever":
+        """Search the memory-mapped matrix of a SharedEmbeddingStore in place, without copying it
+
+        matrix_options are passed to shared_store_matrix: with quantization ("int8" or "float16")
+        candidates come from the store's quantised codes and only they are re-scored against the
+        float32 matrix; with ann="ivf" only the nprobe closest IVF lists are scanned.
+        """
+        return cls(shared_store_matrix(store, **matrix_options), store.nodes(), embed_model,
+                   similarity_top_k, similarity_cutoff)
+
+    def _to_nodes(self, indices: np.ndarray, scores: np.ndarray) -> List[NodeWithScore]:
+        results = []
+        for i, score in zip(indices.tolist(), scores.tolist()):
+            if self.similarity_cutoff is not None and score < self.similarity_cutoff:
+                continue
+            results.append(NodeWithScore(node=self.nodes[i], score=score))
+        return results
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding or self.embed_model.get_query_embedding(retrieval_text(query_bundle))
+        return self._to_nodes(*self.matrix.search(embedding, self.similarity_top_k))
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding or await self.embed_model.aget_query_embedding(retrieval_text(query_bundle))
+        return self._to_nodes(*self.matrix.search(embedding, self.similarity_top_k))
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed each query as retrieve() does, so a batch returns what the queries would one by one
+
+        Query and document embeddings differ for some models, so get_text_embedding_batch is not used.
+        """
+        return [self.embed_model.get_query_embedding(query) for query in queries]
+
+    def retrieve_batch(self, queries: List[str]) -> List[List[NodeWithScore]]:
+        """Embed the queries and score them all with one matrix-matrix product"""
+        embeddings = self._embed_queries(queries)
+        indices, scores = self.matrix.search_batch(embeddings, self.similarity_top_k)
+        return [self._to_nodes(row_indices, row_scores) for row_indices, row_scores in zip(indices, scores)]
+
+
+class HybridRetriever(NumpyRetriever):
+    """Dense retrieval fused with BM25 keyword retrieval by reciprocal rank fusion
+
+    Exact terms such as "reverse charge" or "zero-rated" are found by BM25 even when
+    the dense ranking misses them. similarity_cutoff only applies to chunks that BM25
+    did not rank; returned scores are the dense cosine similarities.
+    """
+
+    def __init__(self, matrix: Union[DenseMatrix, QuantizedMatrix, "IVFIndex"], nodes: Sequence[BaseNode],
+                 embed_model, bm25: BM25Index,
+                 similarity_top_k: int = 2, similarity_cutoff: Optional[float] = None,
+                 candidate_k: int = 20, rrf_k: int = 60):
+        super().__init__(matrix, nodes, embed_model, similarity_top_k, similarity_cutoff)
+        self.bm25 = bm25
+        self.candidate_k = candidate_k
+        self.rrf_k = rrf_k
+
+    @classmethod
+    def from_index(cls, index, embed_model, similarity_top_k: int = 2,
+                   similarity_cutoff: Optional[float] = None,
+                   bm25: Optional[BM25Index] = None) -> "HybridRetriever":
+        dense = NumpyRetriever.from_index(index, embed_model, similarity_top_k, similarity_cutoff)
+        node_ids = [node.node_id for node in dense.nodes]
+        if bm25 is None or bm25.doc_ids != node_ids:
+            bm25 = BM25Index().build(node_ids, [node.get_content() for node in dense.nodes])
+        return cls(dense.matrix, dense.nodes, embed_model, bm25, similarity_top_k, similarity_cutoff)
+
+    @classmethod
+    def from_shared_store(cls, store, embed_model, similarity_top_k: int = 2,
+                          similarity_cutoff: Optional[float] = None, bm25: Optional[BM25Index] = None,
+                          **matrix_options) -> "HybridRetriever":
+        if bm25 is None or (bm25.doc_ids is not store.node_ids and list(bm25.doc_ids) != list(store.node_ids)):
+            bm25 = store.bm25()
+        return cls(shared_store_matrix(store, **matrix_options), store.nodes(), embed_model, bm25,
+                   similarity_top_k, similarity_cutoff)
+
+    def _fuse(self, query_str: str, embedding) -> List[NodeWithScore]:
+        # Approximate when the matrix is quantised or an IVF index; the fused candidates are re-scored exactly below
+        dense_indices, _ = self.matrix.search(embedding, self.candidate_k)
+        keyword_indices, _ = self.bm25.top_k(query_str, self.candidate_k)
+        keyword_hits = set(keyword_indices.tolist())
+
+        fused = [i for i, _ in reciprocal_rank_fusion([dense_indices.tolist(), keyword_indices.tolist()], k=self.rrf_k)]
+        results = []
+        for i, score in zip(fused, self.matrix.rescore(embedding, fused).tolist()):
+            if self.similarity_cutoff is not None and score < self.similarity_cutoff and i not in keyword_hits:
+                continue
+            results.append(NodeWithScore(node=self.nodes[i], score=score))
+            if len(results) == self.similarity_top_k:
+                break
+        return results
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        text = retrieval_text(query_bundle)
+        embedding = query_bundle.embedding or self.embed_model.get_query_embedding(text)
+        return self._fuse(text, embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        text = retrieval_text(query_bundle)
+        embedding = query_bundle.embedding or await self.embed_model.aget_query_embedding(text)
+        return self._fuse(text, embedding)
+
+    def retrieve_batch(self, queries: List[str]) -> List[List[NodeWithScore]]:
+        embeddings = self._embed_queries(queries)
+        return [self._fuse(query, embedding) for query, embedding in zip(queries, embeddings)]
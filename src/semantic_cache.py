@@ -0,0 +1,127 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import copy
+import re
+import threading
+import numpy as np
+
+
+# Tokens that change between invoices from the same supplier template
+VOLATILE_PATTERNS = [
+    (re.compile(r"\b\d{1,4}[/\-.]\d{1,2}[/\-.]\d{1,4}\b"), "<date>"),
+    (re.compile(r"\b\d{1,2}(st|nd|rd|th)?\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{2,4}\b", re.I), "<date>"),
+    (re.compile(r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}(st|nd|rd|th)?,?\s+\d{2,4}\b", re.I), "<date>"),
+    (re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b"), "<email>"),
+    (re.compile(r"[£$€]\s?\d[\d,]*(\.\d+)?"), "<amount>"),
+    (re.compile(r"\b[A-Z]{1,6}[-/ ]?\d[\w/-]*\b(?!\s?%)"), "<ref>"),
+    # Percentages are kept: they usually carry the VAT rate
+    (re.compile(r"\b\d[\d,]*(\.\d+)?\b(?!\s?%)"), "<num>"),
+]
+
+# Upper edges of the buckets used to report how close the best match was
+SIMILARITY_BUCKETS = [0.8, 0.9, 0.95, 0.97, 0.99, 1.0]
+
+
+def mask_volatile_tokens(text: str) -> str:
+    """Replace dates, amounts and reference numbers with placeholders"""
+    masked = " ".join(str(text).split())
+    for pattern, placeholder in VOLATILE_PATTERNS:
+        masked = pattern.sub(placeholder, masked)
+    return masked
+
+
+class SemanticCache:
+    """Return a past prediction when a new invoice embeds close enough to an old one
+
+    Invoices are masked, embedded and compared by cosine similarity against the stored
+    ones; a best match at or above `threshold` is a hit.
+    """
+
+    def __init__(self, embed: Callable[[str], List[float]], aembed: Optional[Callable] = None,
+                 threshold: float = 0.97, max_entries: int = 5000):
+        self.embed = embed
+        self.aembed = aembed
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        self._vectors: Optional[np.ndarray] = None
+        self._predictions: List[Dict[str, Any]] = []
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+        self.lookups = self.hits = 0
+        self._best_similarity_counts = [0] * len(SIMILARITY_BUCKETS)
+
+    def lookup(self, text: str) -> Tuple[np.ndarray, Optional[Dict[str, Any]]]:
+        """Embed text and return (vector, prediction or None); pass the vector to add() on a miss"""
+        vector = self._normalise(self.embed(mask_volatile_tokens(text)))
+        return vector, self._search(vector)
+
+    async def alookup(self, text: str) -> Tuple[np.ndarray, Optional[Dict[str, Any]]]:
+        embedded = await self.aembed(mask_volatile_tokens(text)) if self.aembed else self.embed(mask_volatile_tokens(text))
+        vector = self._normalise(embedded)
+        return vector, self._search(vector)
+
+    def add(self, vector: np.ndarray, prediction: Dict[str, Any]):
+        """Store a prediction; once full, the oldest entry is overwritten"""
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            slot = self._next_slot % self.max_entries
+            self._vectors[slot] = vector
+            if slot < len(self._predictions):
+                self._predictions[slot] = prediction
+            else:
+                self._predictions.append(prediction)
+            self._next_slot += 1
+
+    def clear(self):
+        """Forget every stored prediction, e.g. after the index they were answered from is replaced"""
+        with self._lock:
+            self._vectors = None
+            self._predictions = []
+            self._next_slot = 0
+
+    def _search(self, vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self.lookups += 1
+            if not self._predictions:
+                return None
+            similarities = self._vectors[:len(self._predictions)] @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            self._record_similarity(similarity)
+            if similarity < self.threshold:
+                return None
+            self.hits += 1
+            prediction = copy.deepcopy(self._predictions[best])
+
+        for part in ("vat_prediction", "category_prediction"):
+            prediction[part]["source"] = "semantic_cache"
+            prediction[part]["similarity"] = round(similarity, 4)
+        return prediction
+
+    def _record_similarity(self, similarity: float):
+        for i, edge in enumerate(SIMILARITY_BUCKETS):
+            if similarity < edge or i == len(SIMILARITY_BUCKETS) - 1:
+                self._best_similarity_counts[i] += 1
+                return
+
+    @staticmethod
+    def _normalise(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "entries": len(self._predictions),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            # Distribution of the best match per lookup, to see what a threshold change would do
+            "best_similarity": {
+                f"<{edge}" if edge < 1.0 else f">={SIMILARITY_BUCKETS[-2]}": count
+                for edge, count in zip(SIMILARITY_BUCKETS, self._best_similarity_counts)
+            },
+        }
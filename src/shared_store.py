@@ -0,0 +1,303 @@
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Mapping, Sequence, Tuple
+import bisect
+import json
+import os
+import shutil
+import numpy as np
+from llama_index.core.schema import TextNode
+
+if TYPE_CHECKING:
+    from bm25 import BM25Index
+
+
+EMBEDDINGS_FILE = "embeddings.npy"
+OFFSETS_FILE = "offsets.npy"
+TEXTS_FILE = "texts.bin"
+IDS_FILE = "ids.bin"
+ID_OFFSETS_FILE = "id_offsets.npy"
+METADATA_FILE = "metadata.bin"
+METADATA_OFFSETS_FILE = "metadata_offsets.npy"
+META_FILE = "meta.json"
+
+BM25_DIR = "bm25"
+TERMS_FILE = "terms.bin"
+TERM_OFFSETS_FILE = "term_offsets.npy"
+POSTING_OFFSETS_FILE = "posting_offsets.npy"
+POSTING_DOCS_FILE = "posting_docs.npy"
+POSTING_FREQS_FILE = "posting_freqs.npy"
+DOC_LENGTHS_FILE = "doc_lengths.npy"
+
+
+def _map_bytes(path: Path) -> np.ndarray:
+    """Read-only byte buffer; np.memmap cannot map an empty file"""
+    return np.memmap(path, dtype=np.uint8, mode="r") if path.stat().st_size else np.zeros(0, dtype=np.uint8)
+
+
+def _write_strings(directory: Path, buffer_file: str, offsets_file: str, strings: Iterable[str], count: int):
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    with open(directory / buffer_file, "wb") as f:
+        for i, string in enumerate(strings):
+            chunk = string.encode("utf-8")
+            f.write(chunk)
+            offsets[i + 1] = offsets[i] + len(chunk)
+    np.save(directory / offsets_file, offsets)
+
+
+class MappedStrings(Sequence):
+    """Sequence of strings decoded on access from a mapped UTF-8 buffer and its offset table"""
+
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def open(cls, directory: Path, buffer_file: str, offsets_file: str) -> "MappedStrings":
+        return cls(_map_bytes(directory / buffer_file), np.load(directory / offsets_file, mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.buffer[start:end]).decode("utf-8")
+
+
+class MappedPostings(Mapping):
+    """BM25 postings read from mapped arrays: term -> (document positions, term frequencies)
+
+    Terms are stored sorted, so a lookup is a binary search over the mapped term table
+    and returns slices of the mapped posting arrays without copying them.
+    """
+
+    def __init__(self, terms: MappedStrings, offsets: np.ndarray, docs: np.ndarray, freqs: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.freqs = freqs
+
+    def __getitem__(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            raise KeyError(term)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.docs[start:end], self.freqs[start:end]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+class LazyNodes(Sequence):
+    """Sequence of TextNodes built on access from the mapped text buffer"""
+
+    def __init__(self, store: "SharedEmbeddingStore"):
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store.node(j) for j in range(*i.indices(len(self)))]
+        return self.store.node(i)
+
+
+class SharedEmbeddingStore:
+    """Read-only, memory-mapped copy of a built index that every worker can share
+
+    The directory holds the unit-norm float32 embedding matrix (embeddings.npy), the
+    chunk texts concatenated as UTF-8 (texts.bin) with an int64 offset table
+    (offsets.npy), and the node ids and JSON metadata stored the same way (ids.bin,
+    metadata.bin). Workers map the files read-only, so the OS page cache keeps one
+    physical copy however many workers run. The BM25 index is written to bm25/ on first
+    use and mapped the same way.
+    """
+
+    def __init__(self, directory: Path, embeddings: np.ndarray, offsets: np.ndarray, texts: np.ndarray,
+                 node_ids: Sequence[str], metadata: Sequence[str]):
+        self.directory = Path(directory)
+        self.embeddings = embeddings
+        self.offsets = offsets
+        self.texts = texts
+        self.node_ids = node_ids
+        self.metadata = metadata  # JSON per node, parsed when a node is built
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        return (Path(directory) / META_FILE).exists()
+
+    @classmethod
+    def export(cls, directory: Path, node_ids: List[str],
+               records: Iterable[Tuple[str, Dict[str, Any], Sequence[float]]]) -> Path:
+        """Write the store files from (text, metadata, embedding) records aligned with node_ids
+
+        Records are consumed one at a time: texts are appended to the buffer and each
+        embedding is written straight into the memory-mapped matrix, so the store is never
+        held in memory as Python lists. The directory appears atomically, and if another
+        worker exported the same store first its copy is kept.
+        """
+        directory = Path(directory)
+        staging = directory.with_name(f".{directory.name}.tmp-{os.getpid()}")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        metadata_offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        matrix = None
+        dim = 0
+        with open(staging / TEXTS_FILE, "wb") as f, open(staging / METADATA_FILE, "wb") as metadata:
+            for i, (text, node_metadata, embedding) in enumerate(records):
+                vector = np.asarray(embedding, dtype=np.float32)
+                if matrix is None:
+                    dim = vector.shape[0]
+                    matrix = np.lib.format.open_memmap(
+                        staging / EMBEDDINGS_FILE, mode="w+", dtype=np.float32, shape=(len(node_ids), dim)
+                    )
+                norm = np.linalg.norm(vector)
+                matrix[i] = vector / norm if norm else vector
+
+                chunk = text.encode("utf-8")
+                f.write(chunk)
+                offsets[i + 1] = offsets[i] + len(chunk)
+                encoded = json.dumps(node_metadata, default=str).encode("utf-8")
+                metadata.write(encoded)
+                metadata_offsets[i + 1] = metadata_offsets[i] + len(encoded)
+        if matrix is None:
+            np.save(staging / EMBEDDINGS_FILE, np.zeros((0, 0), dtype=np.float32))
+        else:
+            matrix.flush()
+            del matrix
+        np.save(staging / OFFSETS_FILE, offsets)
+        np.save(staging / METADATA_OFFSETS_FILE, metadata_offsets)
+        _write_strings(staging, IDS_FILE, ID_OFFSETS_FILE, node_ids, len(node_ids))
+
+        with open(staging / META_FILE, "w", encoding="utf-8") as f:
+            json.dump({"rows": len(node_ids), "dim": dim}, f)
+
+        try:
+            os.replace(staging, directory)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+        return directory
+
+    @classmethod
+    def export_index(cls, directory: Path, index) -> Path:
+        """Export a llama_index VectorStoreIndex, one node at a time"""
+        node_ids = list(index.index_struct.nodes_dict.values())
+
+        def records():
+            for node_id in node_ids:
+                node = index.docstore.get_node(node_id)
+                yield node.get_content(), node.metadata, index.vector_store.get(node_id)
+
+        return cls.export(directory, node_ids, records())
+
+    @classmethod
+    def open(cls, directory: Path) -> "SharedEmbeddingStore":
+        directory = Path(directory)
+        with open(directory / META_FILE, encoding="utf-8") as f:
+            meta = json.load(f)
+        if "node_ids" in meta:
+            # Stores exported before ids and metadata were mapped kept them in meta.json
+            node_ids = meta["node_ids"]
+            metadata = [json.dumps(node_metadata) for node_metadata in meta["metadata"]]
+        else:
+            node_ids = MappedStrings.open(directory, IDS_FILE, ID_OFFSETS_FILE)
+            metadata = MappedStrings.open(directory, METADATA_FILE, METADATA_OFFSETS_FILE)
+        return cls(
+            directory,
+            np.load(directory / EMBEDDINGS_FILE, mmap_mode="r"),
+            np.load(directory / OFFSETS_FILE, mmap_mode="r"),
+            _map_bytes(directory / TEXTS_FILE),
+            node_ids,
+            metadata
+        )
+
+    def quantized(self, kind: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Memory-mapped quantised codes and per-row scales, written next to the float32 matrix on first use"""
+        from retrieval import quantize
+
+        codes_path = self.directory / f"embeddings.{kind}.npy"
+        scales_path = self.directory / f"scales.{kind}.npy"
+        if not codes_path.exists():
+            codes_tmp = self.directory / f".{codes_path.name}.tmp-{os.getpid()}"
+            scales_tmp = self.directory / f".{scales_path.name}.tmp-{os.getpid()}"
+            n_rows, dim = self.embeddings.shape
+            codes = np.lib.format.open_memmap(
+                codes_tmp, mode="w+", dtype=np.int8 if kind == "int8" else np.float16, shape=(n_rows, dim)
+            )
+            _, scales = quantize(self.embeddings, kind, codes=codes)
+            codes.flush()
+            del codes
+            with open(scales_tmp, "wb") as f:
+                np.save(f, scales)
+            # Scales first: the codes file appearing is what marks the pair complete
+            os.replace(scales_tmp, scales_path)
+            os.replace(codes_tmp, codes_path)
+        return np.load(codes_path, mmap_mode="r"), np.load(scales_path)
+
+    def bm25(self, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """BM25 index over the chunk texts, written to bm25/ on first use and memory-mapped
+
+        Postings are stored as one sorted term table and flat posting arrays, so every
+        worker scores against the same physical pages instead of its own Python dicts.
+        """
+        from bm25 import BM25Index
+
+        directory = self.directory / BM25_DIR
+        if not (directory / META_FILE).exists():
+            built = BM25Index(k1, b).build(self.node_ids, [self.text(i) for i in range(len(self))])
+            staging = directory.with_name(f".{directory.name}.tmp-{os.getpid()}")
+            shutil.rmtree(staging, ignore_errors=True)
+            staging.mkdir(parents=True)
+            terms = sorted(built.postings)
+            posting_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            posting_offsets[1:] = np.cumsum([len(built.postings[term][0]) for term in terms])
+            empty = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+            postings = [built.postings[term] for term in terms] or [empty]
+            _write_strings(staging, TERMS_FILE, TERM_OFFSETS_FILE, terms, len(terms))
+            np.save(staging / POSTING_OFFSETS_FILE, posting_offsets)
+            np.save(staging / POSTING_DOCS_FILE, np.concatenate([docs for docs, _ in postings]))
+            np.save(staging / POSTING_FREQS_FILE, np.concatenate([freqs for _, freqs in postings]))
+            np.save(staging / DOC_LENGTHS_FILE, built.doc_lengths)
+            with open(staging / META_FILE, "w", encoding="utf-8") as f:
+                json.dump({"k1": k1, "b": b, "terms": len(terms)}, f)
+            try:
+                os.replace(staging, directory)
+            except OSError:
+                shutil.rmtree(staging, ignore_errors=True)  # Another worker wrote it first
+
+        with open(directory / META_FILE, encoding="utf-8") as f:
+            meta = json.load(f)
+        index = BM25Index(meta["k1"], meta["b"])
+        index.doc_ids = self.node_ids
+        index.doc_lengths = np.load(directory / DOC_LENGTHS_FILE, mmap_mode="r")
+        index.postings = MappedPostings(
+            MappedStrings.open(directory, TERMS_FILE, TERM_OFFSETS_FILE),
+            np.load(directory / POSTING_OFFSETS_FILE, mmap_mode="r"),
+            np.load(directory / POSTING_DOCS_FILE, mmap_mode="r"),
+            np.load(directory / POSTING_FREQS_FILE, mmap_mode="r"),
+        )
+        return index
+
+    def text(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def node(self, i: int) -> TextNode:
+        return TextNode(id_=self.node_ids[i], text=self.text(i), metadata=json.loads(self.metadata[i]))
+
+    def nodes(self) -> LazyNodes:
+        return LazyNodes(self)
@@ -0,0 +1,85 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import copy
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one execution
+
+    The first caller for a key runs the function; callers arriving while it is still
+    in flight wait for it and get a copy of its result (or its exception). Nothing is
+    remembered once the call finishes, so this complements the prediction cache, which
+    only fills after the first call returns. do() serves threads, ado() the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.executions = self.collapsed = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._forget(key, task))
+                self.executions += 1
+            else:
+                self.collapsed += 1
+
+        # Shielded, so a caller that disconnects does not cancel the work the others are waiting on
+        result = await asyncio.shield(task)
+        return result if leader else copy.deepcopy(result)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls) + len(self._tasks)
+        calls = self.executions + self.collapsed
+        return {
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+            "in_flight": in_flight,
+            "collapse_rate": round(self.collapsed / calls, 4) if calls else 0.0,
+        }
@@ -0,0 +1,222 @@
+"""Row sources for VatRag: the legislation pages as (id, text) rows, streamed in fixed-size batches
+
+Load the CSV into a SQLite stand-in for the database path:
+    python src/sources.py data/vat_legislation.csv data/vat_legislation.sqlite
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import os
+import re
+import sqlite3
+import uuid
+
+Row = Tuple[Any, str]
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$")
+
+
+class RowSource:
+    """Base class: yields (id, text) rows in batches of at most batch_size"""
+
+    name = "rows"
+
+    def __init__(self, id_column: str = "id", content_column: str = "page_content", batch_size: int = 256):
+        self.id_column = id_column
+        self.content_column = content_column
+        self.batch_size = batch_size
+
+    def batches(self) -> Iterator[List[Row]]:
+        raise NotImplementedError
+
+    def rows(self) -> Iterator[Row]:
+        for batch in self.batches():
+            yield from batch
+
+    def digest(self) -> str:
+        """Hash of the source content, streamed so the table is never held in memory"""
+        digest = hashlib.sha256()
+        for row_id, text in self.rows():
+            digest.update(f"{row_id}\0{text}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.name, "id_column": self.id_column, "content_column": self.content_column}
+
+    def close(self):
+        pass
+
+
+class CsvSource(RowSource):
+    """CSV file read with pandas in chunks of batch_size rows"""
+
+    name = "csv"
+
+    def __init__(self, path: Path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+
+    def batches(self) -> Iterator[List[Row]]:
+        import pandas as pd
+
+        with pd.read_csv(self.path, usecols=[self.id_column, self.content_column], chunksize=self.batch_size) as reader:
+            for chunk in reader:
+                yield list(zip(chunk[self.id_column].tolist(), chunk[self.content_column].astype(str).tolist()))
+
+    def digest(self) -> str:
+        # Hashing the bytes is much cheaper than parsing every row
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+class SqlSource(RowSource):
+    """Table read through a pooled DB-API connection with fetchmany(batch_size)
+
+    pool needs getconn() and putconn(conn), as psycopg2's pools provide.
+    """
+
+    name = "sql"
+
+    def __init__(self, pool, table: str = "vat_legislation", **kwargs):
+        super().__init__(**kwargs)
+        for identifier in (table, self.id_column, self.content_column):
+            if not _IDENTIFIER.match(identifier):
+                raise ValueError(f"Invalid SQL identifier {identifier!r}")
+        self.pool = pool
+        self.table = table
+
+    def _query(self) -> str:
+        return f"SELECT {self.id_column}, {self.content_column} FROM {self.table} ORDER BY {self.id_column}"
+
+    def _cursor(self, conn):
+        return conn.cursor()
+
+    def batches(self) -> Iterator[List[Row]]:
+        conn = self.pool.getconn()
+        try:
+            cursor = self._cursor(conn)
+            try:
+                cursor.execute(self._query())
+                while True:
+                    rows = cursor.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    yield [(row_id, "" if text is None else str(text)) for row_id, text in rows]
+            finally:
+                cursor.close()
+        finally:
+            self._release(conn)
+
+    def _release(self, conn):
+        self.pool.putconn(conn)
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "table": self.table}
+
+    def close(self):
+        closeall = getattr(self.pool, "closeall", None)
+        if closeall is not None:
+            closeall()
+
+
+class PostgresSource(SqlSource):
+    """PostgreSQL through a psycopg2 ThreadedConnectionPool and a server-side (named) cursor
+
+    The named cursor keeps the result set on the server and ships batch_size rows per
+    round trip, so client memory does not grow with the table.
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, table: str = "vat_legislation", min_connections: int = 1,
+                 max_connections: int = 4, **kwargs):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        super().__init__(ThreadedConnectionPool(min_connections, max_connections, dsn), table, **kwargs)
+
+    def _cursor(self, conn):
+        cursor = conn.cursor(name=f"vat_rag_ingest_{uuid.uuid4().hex[:12]}")
+        cursor.itersize = self.batch_size
+        return cursor
+
+    def _release(self, conn):
+        # Named cursors live inside a transaction; end it before the connection goes back to the pool
+        conn.rollback()
+        self.pool.putconn(conn)
+
+
+class SqlitePool:
+    """Minimal getconn/putconn pool over a SQLite file, standing in for Postgres locally"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def getconn(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def putconn(self, conn):
+        conn.close()
+
+
+class SqliteSource(SqlSource):
+    """SQLite table; sqlite3 cursors step through results lazily, so fetchmany streams too"""
+
+    name = "sqlite"
+
+    def __init__(self, path: Path, table: str = "vat_legislation", **kwargs):
+        super().__init__(SqlitePool(path), table, **kwargs)
+
+
+def source_from_env(csv_path: Path, id_column: str = "id", content_column: str = "page_content") -> RowSource:
+    """Source selected by VAT_RAG_SOURCE (csv, postgres or sqlite)"""
+    kind = os.getenv("VAT_RAG_SOURCE", "csv")
+    kwargs = {
+        "id_column": id_column,
+        "content_column": content_column,
+        "batch_size": int(os.getenv("INGEST_BATCH_SIZE", "256")),
+    }
+    table = os.getenv("VAT_RAG_TABLE", "vat_legislation")
+    if kind == "csv":
+        return CsvSource(csv_path, **kwargs)
+    if kind == "postgres":
+        dsn = os.getenv("VAT_RAG_DSN")
+        if not dsn:
+            raise ValueError("VAT_RAG_DSN not found")
+        return PostgresSource(dsn, table, max_connections=int(os.getenv("VAT_RAG_DB_POOL_SIZE", "4")), **kwargs)
+    if kind == "sqlite":
+        return SqliteSource(os.getenv("VAT_RAG_SQLITE_PATH", str(Path(csv_path).with_suffix(".sqlite"))), table,
+                            **kwargs)
+    raise ValueError(f"Unknown source {kind!r}, expected one of ('csv', 'postgres', 'sqlite')")
+
+
+def copy_csv_to_sqlite(csv_path: Path, db_path: Path, table: str = "vat_legislation", id_column: str = "id",
+                       content_column: str = "page_content", batch_size: int = 256) -> int:
+    """Stream a CSV into a SQLite table (replacing it); returns the number of rows copied"""
+    source = CsvSource(csv_path, id_column=id_column, content_column=content_column, batch_size=batch_size)
+    SqliteSource(db_path, table, id_column=id_column, content_column=content_column)  # Validates identifiers
+    copied = 0
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} ({id_column} INTEGER PRIMARY KEY, {content_column} TEXT)")
+        for batch in source.batches():
+            conn.executemany(f"INSERT INTO {table} VALUES (?, ?)", batch)
+            copied += len(batch)
+    return copied
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Copy the legislation CSV into a SQLite table")
+    parser.add_argument("csv_path")
+    parser.add_argument("db_path")
+    parser.add_argument("--table", default="vat_legislation")
+    args = parser.parse_args(argv)
+    print(f"Copied {copy_csv_to_sqlite(args.csv_path, args.db_path, args.table)} rows into {args.db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Report where startup time goes: module imports, then initialisation phases
+
+Data and index paths resolve relative to the repository, so it can be run from any directory:
+    python src/startup_profile.py              # imports + VatRag/GLPredictor initialisation
+    python src/startup_profile.py --imports-only
+    python src/startup_profile.py --warm-up    # also time the warm-up invoices (makes LLM calls)
+"""
+from pathlib import Path
+from typing import Dict, List, Tuple
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = Path(__file__).resolve().parent
+
+
+def _importtime(code: str):
+    """Run code in a fresh interpreter with -X importtime; return (entries, stderr lines, returncode)"""
+    env = dict(os.environ)
+    # src/ first, as in print_phases: the repository root holds stale copies of vat_rag.py, gl_predictor.py and api.py
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC_DIR), str(SRC_DIR.parent), env.get("PYTHONPATH")]))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env)
+
+    entries, other = [], []
+    for line in result.stderr.splitlines():
+        parts = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+        if len(parts) != 3:
+            other.append(line)
+        elif parts[0].strip().isdigit():  # Skip the header line
+            entries.append((int(parts[0]), int(parts[1]), parts[2].strip()))
+    return entries, other, result.returncode
+
+
+def profile_imports(module: str) -> Tuple[float, Dict[str, float], str]:
+    """Import module in a fresh interpreter
+
+    Returns (total seconds, self-time seconds per top-level package, error output).
+    Modules the bare interpreter already loads at startup are left out.
+    """
+    baseline = {name for _, _, name in _importtime("pass")[0]}
+    # Fails the run if the module was found anywhere but src/; os and sys are loaded at startup, so cost nothing here
+    entries, other, returncode = _importtime(
+        f"import {module}\n"
+        "import os, sys\n"
+        f"path = os.path.realpath(sys.modules[{module!r}].__file__)\n"
+        f"if not path.startswith({str(SRC_DIR) + os.sep!r}):\n"
+        f"    sys.exit(f'{module} was imported from {{path}}, not from src/')\n"
+    )
+
+    per_package: Dict[str, float] = {}
+    total = 0.0
+    for self_us, cumulative_us, name in entries:
+        if name in baseline:
+            continue
+        package = name.split(".")[0]
+        per_package[package] = per_package.get(package, 0.0) + self_us / 1e6
+        if name == module:
+            total = cumulative_us / 1e6
+    return total, per_package, "\n".join(other[-5:]) if returncode else ""
+
+
+def print_imports(modules: List[str], top: int):
+    print("Import time (fresh interpreter per module)")
+    print("-" * 60)
+    for module in modules:
+        total, per_package, error = profile_imports(module)
+        if error:
+            print(f"{module}: import failed\n{error}")
+            continue
+        print(f"{module}: {total * 1000:.1f} ms total")
+        for package, seconds in sorted(per_package.items(), key=lambda item: -item[1])[:top]:
+            print(f"    {package:<32} {seconds * 1000:>9.1f} ms")
+    print()
+
+
+def print_phases(warm_up: bool):
+    """Time initialisation in this process, phase by phase"""
+    sys.path[:0] = [str(SRC_DIR), str(SRC_DIR.parent)]
+    phases: List[Tuple[str, float]] = []
+
+    def timed(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        phases.append((name, time.perf_counter() - start))
+        return result
+
+    vat_rag_module = timed("import vat_rag", lambda: __import__("vat_rag"))
+    gl_predictor_module = timed("import gl_predictor", lambda: __import__("gl_predictor"))
+    vat_rag = timed("VatRag()", lambda: vat_rag_module.VatRag("data/vat_legislation.csv"))
+    timed("VatRag.build_index()", vat_rag.build_index)
+    predictor = timed("GLPredictor()", lambda: gl_predictor_module.GLPredictor(vat_rag))
+
+    if warm_up:
+        from src.api import WARMUP_INVOICES
+        for i, invoice in enumerate(WARMUP_INVOICES, start=1):
+            timed(f"warm-up invoice {i}", lambda: predictor.predict(invoice))
+
+    print("Initialisation phases")
+    print("-" * 60)
+    for name, seconds in phases:
+        print(f"{name:<36} {seconds * 1000:>9.1f} ms")
+    print(f"{'total':<36} {sum(seconds for _, seconds in phases) * 1000:>9.1f} ms")
+    print()
+    print("VatRag phase breakdown")
+    print("-" * 60)
+    for name, seconds in vat_rag.timings.items():
+        print(f"{name:<36} {seconds * 1000:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile import and initialisation time")
+    parser.add_argument("--modules", nargs="+", default=["src.api", "vat_rag", "gl_predictor"])
+    parser.add_argument("--top", type=int, default=12, help="packages to list per module")
+    parser.add_argument("--imports-only", action="store_true")
+    parser.add_argument("--warm-up", action="store_true", help="also time the warm-up invoices")
+    args = parser.parse_args()
+
+    print_imports(args.modules, args.top)
+    if not args.imports_only:
+        print_phases(args.warm_up)
+
+
+if __name__ == "__main__":
+    main()
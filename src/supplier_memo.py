@@ -0,0 +1,223 @@
+"""Per-supplier memo of VAT treatment and category, persisted in SQLite
+
+Invoices are keyed by the supplier's VAT registration number (normalised to GB123456789)
+and by its normalised name, so "CATER OILS LTD" and "Cater Oils" share an entry. The VAT
+treatment and the category are remembered separately: each trusted label on a prediction
+is an observation of its field, and once a field has min_observations consistent ones the
+memo answers that field before any RAG call. /evaluate feedback is authoritative:
+agreement confirms the labels, disagreement replaces them, and a confirmed label answers
+straight away and is no longer changed by predictions.
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+FIELDS = ("vat", "category")
+
+_VAT_NUMBER = re.compile(
+    r"\bVAT\s*(?:Reg(?:istration)?\.?\s*)?(?:No\.?|Number|#)?\s*[:.]?\s*(?:GB)?\s*"
+    r"(\d{3}\s?\d{4}\s?\d{2}(?:\s?\d{3})?)\b", re.IGNORECASE)
+_SUPPLIER_LINE = re.compile(r"^\s*(?:supplier|vendor|from|seller)\s*(?:name)?\s*[:\-]\s*(.+?)\s*$",
+                            re.IGNORECASE | re.MULTILINE)
+_COMPANY_SUFFIXES = re.compile(r"\b(?:ltd|limited|plc|llp|llc|inc|co|company|group|uk)\b\.?")
+
+
+def normalise_vat_number(value: str) -> Optional[str]:
+    """GB plus the 9 or 12 digits, whatever the spacing; None when it is not a UK VAT number"""
+    digits = re.sub(r"\D", "", str(value))
+    return f"GB{digits}" if len(digits) in (9, 12) else None
+
+
+def normalise_supplier_name(value: str) -> Optional[str]:
+    name = re.sub(r"[^a-z0-9 ]", " ", str(value).casefold())
+    name = " ".join(_COMPANY_SUFFIXES.sub(" ", name).split())
+    return name or None
+
+
+def _keys(vat_number: Optional[str], name: Optional[str]) -> List[str]:
+    keys = []
+    vat_number = normalise_vat_number(vat_number) if vat_number else None
+    name = normalise_supplier_name(name) if name else None
+    if vat_number:
+        keys.append(f"vat:{vat_number}")
+    if name:
+        keys.append(f"name:{name}")
+    return keys
+
+
+def supplier_keys(invoice_text: str) -> List[str]:
+    """Memo keys for an invoice, VAT number first: from the JSON invoice fields, else from the text"""
+    if invoice_text.lstrip().startswith("{"):
+        try:
+            invoice = json.loads(invoice_text)
+        except json.JSONDecodeError:
+            invoice = None
+        if isinstance(invoice, dict):
+            return _keys(invoice.get("VAT Number"), invoice.get("Supplier"))
+
+    # On a text invoice the first VAT number is usually the supplier's, in its header
+    vat_match = _VAT_NUMBER.search(invoice_text)
+    name_match = _SUPPLIER_LINE.search(invoice_text)
+    return _keys(vat_match.group(1) if vat_match else None, name_match.group(1) if name_match else None)
+
+
+def keys_for_supplier(supplier: Dict[str, str]) -> List[str]:
+    """Memo keys for a supplier given explicitly, as {"vat_number": ..., "name": ...}"""
+    return _keys(supplier.get("vat_number"), supplier.get("name"))
+
+
+class SupplierMemo:
+    """Labels per supplier key and field ("vat", "category"), each with a count of consistent observations"""
+
+    def __init__(self, path: Path, min_observations: int = 3, generation_refresh_seconds: float = 5.0):
+        self.path = Path(path)
+        self.min_observations = min_observations
+        self.hits = self.misses = self.observations = self.invalidations = self.confirmations = 0
+        self._lock = threading.Lock()
+        # The generation is kept in memory: feedback here updates it at once, feedback from other
+        # workers is picked up when it is re-read, at most every generation_refresh_seconds
+        self.generation_refresh_seconds = generation_refresh_seconds
+        self._generation: Optional[int] = None
+        self._generation_read_at = 0.0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS supplier_labels "
+            "(key TEXT NOT NULL, field TEXT NOT NULL, label TEXT NOT NULL, observations INTEGER NOT NULL, "
+            "confirmed INTEGER NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (key, field))"
+        )
+        # Bumped whenever feedback changes what the memo answers, so cached predictions can be keyed by it
+        self._conn.execute("CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                           "value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0)")
+
+    def lookup(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Per field, the first key with a stable or confirmed label, as {key, label, observations, confirmed}"""
+        found = {}
+        with self._lock:
+            for field in FIELDS:
+                for key in keys:
+                    row = self._row(key, field)
+                    if row is not None and (row[1] >= self.min_observations or row[2]):
+                        found[field] = {"key": key, "label": row[0], "observations": row[1],
+                                        "confirmed": bool(row[2])}
+                        break
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def observe(self, keys: List[str], labels: Dict[str, str]):
+        """Count computed labels, per field; a different label restarts that field's unconfirmed history
+
+        Labels confirmed by feedback are left alone: only further feedback changes them.
+        """
+        with self._lock:
+            self.observations += 1
+            for field, label in labels.items():
+                for key in keys:
+                    row = self._row(key, field)
+                    if row is not None and row[2]:
+                        continue
+                    if row is not None and row[0] == label:
+                        self._conn.execute(
+                            "UPDATE supplier_labels SET observations = observations + 1, updated_at = ? "
+                            "WHERE key = ? AND field = ?", (time.time(), key, field)
+                        )
+                    else:
+                        self._write(key, field, label, confirmed=False)
+
+    def feedback(self, keys: List[str], vat: str, category: str) -> str:
+        """Apply the correct labels from /evaluate; returns "confirmed", "invalidated" or "added" """
+        outcome = "added"
+        changed = False
+        with self._lock:
+            for field, label in (("vat", vat), ("category", category)):
+                for key in keys:
+                    row = self._row(key, field)
+                    changed = changed or row is None or row[0] != label or not row[2]
+                    if row is not None and row[0] == label:
+                        self._conn.execute(
+                            "UPDATE supplier_labels SET observations = observations + 1, confirmed = 1, "
+                            "updated_at = ? WHERE key = ? AND field = ?", (time.time(), key, field)
+                        )
+                        outcome = "confirmed" if outcome == "added" else outcome
+                    else:
+                        if row is not None:
+                            outcome = "invalidated"
+                        self._write(key, field, label, confirmed=True)
+            if changed:
+                self._conn.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+                self._read_generation()
+            if outcome == "invalidated":
+                self.invalidations += 1
+            elif outcome == "confirmed":
+                self.confirmations += 1
+        return outcome
+
+    def generation(self) -> int:
+        """Count of feedback changes so far, shared by every process using the file
+
+        Observations do not move it: they only learn labels the model already produced.
+        """
+        with self._lock:
+            if (self._generation is None
+                    or time.monotonic() - self._generation_read_at >= self.generation_refresh_seconds):
+                self._read_generation()
+            return self._generation
+
+    def _read_generation(self):
+        (self._generation,) = self._conn.execute("SELECT value FROM generation WHERE id = 0").fetchone()
+        self._generation_read_at = time.monotonic()
+
+    def _row(self, key: str, field: str) -> Optional[Tuple[str, int, int]]:
+        return self._conn.execute(
+            "SELECT label, observations, confirmed FROM supplier_labels WHERE key = ? AND field = ?", (key, field)
+        ).fetchone()
+
+    def _write(self, key: str, field: str, label: str, confirmed: bool):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO supplier_labels (key, field, label, observations, confirmed, updated_at) "
+            "VALUES (?, ?, ?, 1, ?, ?)", (key, field, label, int(confirmed), time.time())
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(DISTINCT key) FROM supplier_labels").fetchone()
+            (stable,) = self._conn.execute(
+                "SELECT COUNT(*) FROM supplier_labels WHERE observations >= ? OR confirmed = 1",
+                (self.min_observations,)
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "stable_labels": stable,
+            "min_observations": self.min_observations,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "observations": self.observations,
+            "confirmations": self.confirmations,
+            "invalidations": self.invalidations,
+            "generation": self.generation(),
+        }
+
+
+def build_supplier_memo(default_path: Optional[Path] = None) -> Optional[SupplierMemo]:
+    """Build the memo from SUPPLIER_MEMO_* environment settings; an empty SUPPLIER_MEMO_PATH disables it"""
+    path = os.getenv("SUPPLIER_MEMO_PATH", str(default_path) if default_path else "")
+    if not path:
+        return None
+    return SupplierMemo(Path(path), int(os.getenv("SUPPLIER_MEMO_MIN_OBSERVATIONS", "3")),
+                        float(os.getenv("SUPPLIER_MEMO_GENERATION_REFRESH", "5")))
@@ -0,0 +1,126 @@
+"""VAT treatment inferred from the amounts on an invoice, without retrieval or an LLM
+
+Reads the net, VAT and gross amounts from labelled lines ("Subtotal £6,000 / VAT £1,200 /
+Total £7,200") or from the "VAT" and "Total" fields of the JSON invoices (data/Test), and
+maps the implied rate onto the VAT labels when the amounts agree within a tolerance.
+"""
+from typing import Dict, Optional, Tuple
+import json
+import re
+
+
+STANDARD_RATE = 0.20
+
+# Net is tried before VAT and VAT before gross, so "Total excl. VAT" and "Total VAT" are not read as the gross total
+_LINE_LABELS = [
+    ("net", re.compile(
+        r"(?:sub[\s-]*total|net\b|(?:total|amount)\s*\(?\s*(?:excl|ex|exclusive|before)\b|amount(?!\s*(?:due|payable)))",
+        re.IGNORECASE)),
+    ("vat", re.compile(
+        r"(?:total\s+)?(?:vat|tax)\b(?!\s*(?:reg|no\b|number|#|id\b|treatment|information|exclusive|inclusive|rate\b))",
+        re.IGNORECASE)),
+    ("gross", re.compile(
+        r"(?:grand\s+|invoice\s+)?total|gross|(?:amount|balance)\s+(?:due|payable)", re.IGNORECASE)),
+]
+
+# A money amount, not a percentage and not part of a reference such as GB123456789
+_AMOUNT = re.compile(r"(?<![\w.,])[£$€]?\s?(\d[\d,]*(?:\.\d+)?)(?![\d%]|\s*%)")
+
+# Segments: lines, and " / ", "|" or ";" separated parts of one line
+_SEGMENTS = re.compile(r"\n|\s/\s|\||;")
+_LEADING = re.compile(r"^[\s*\-•#>]+")
+
+_ZERO_RATED = re.compile(r"zero[\s-]*rated", re.IGNORECASE)
+_NO_VAT = re.compile(r"\bvat[\s-]*exempt|\bexempt\b|outside\s+the\s+scope|\bno\s+vat\b", re.IGNORECASE)
+_REVERSE_CHARGE = re.compile(r"reverse[\s-]*charge", re.IGNORECASE)
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(str(value).replace(",", "").replace("£", "").strip())
+    except ValueError:
+        return None
+
+
+def _json_amounts(invoice_text: str) -> Optional[Dict[str, float]]:
+    """Amounts from a JSON invoice's top-level fields; "Total" is the gross amount there"""
+    if not invoice_text.lstrip().startswith("{"):
+        return None
+    try:
+        invoice = json.loads(invoice_text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(invoice, dict):
+        return None
+
+    amounts = {}
+    for field, keys in (("net", ("Subtotal", "Net")), ("vat", ("VAT",)), ("gross", ("Total",))):
+        for key in keys:
+            value = _number(invoice.get(key) or "")
+            if value is not None:
+                amounts[field] = value
+                break
+    return amounts
+
+
+def parse_amounts(invoice_text: str) -> Dict[str, float]:
+    """Net, VAT and gross amounts found on the invoice (each key only when found)"""
+    amounts = _json_amounts(invoice_text)
+    if amounts is not None:
+        return amounts
+
+    amounts = {}
+    for segment in _SEGMENTS.split(invoice_text):
+        segment = _LEADING.sub("", segment)
+        for field, label in _LINE_LABELS:
+            match = label.match(segment)
+            if not match:
+                continue
+            found = _AMOUNT.findall(segment[match.end():])
+            if found:
+                # Totals come last on an invoice, so a later line wins
+                amounts[field] = _number(found[-1])
+            break
+    return {field: value for field, value in amounts.items() if value is not None}
+
+
+def net_and_vat(amounts: Dict[str, float], tolerance: float = 0.002) -> Optional[Tuple[float, float, bool]]:
+    """(net, VAT, whether all three amounts were stated), or None when they are missing or do not add up"""
+    vat = amounts.get("vat")
+    net, gross = amounts.get("net"), amounts.get("gross")
+    if vat is None or (net is None and gross is None):
+        return None
+    if net is None:
+        net = gross - vat
+    if net <= 0 or vat < 0:
+        return None
+    if gross is not None and abs(net + vat - gross) > max(0.02, tolerance * gross):
+        return None
+    return net, vat, gross is not None and "net" in amounts
+
+
+def infer_vat_label(invoice_text: str, tolerance: float = 0.002) -> Optional[Tuple[str, float, float]]:
+    """(VAT label, confidence, implied rate) when the amounts determine it, otherwise None
+
+    Reverse-charge invoices are left alone: whether they quote the 20% or not, the amounts do not
+    say who accounts for the VAT. A zero rate is only mapped when the invoice also says why.
+    """
+    if _REVERSE_CHARGE.search(invoice_text):
+        return None
+    found = net_and_vat(parse_amounts(invoice_text), tolerance)
+    if found is None:
+        return None
+    net, vat, all_three = found
+    rate = vat / net
+    confidence = 0.98 if all_three else 0.9
+
+    # VAT is rounded to the penny, which moves the rate of small invoices by more than the tolerance
+    if abs(vat - STANDARD_RATE * net) <= max(0.01, tolerance * net):
+        return "20% (VAT on Expenses)", confidence, rate
+    if vat <= 0.01:
+        if _ZERO_RATED.search(invoice_text):
+            return "Zero Rated Expenses", confidence, rate
+        if _NO_VAT.search(invoice_text):
+            return "No VAT", confidence, rate
+    # Reduced rates (5%) and mixed-rate invoices have no label of their own
+    return None
@@ -0,0 +1,89 @@
+import pytest
+from cascade import Cascade, RuleTier, build_cascade
+
+DEFAULT_THRESHOLD = 0.8
+
+
+@pytest.fixture
+def rules():
+    return RuleTier()
+
+
+@pytest.mark.parametrize("text", [
+    "Invoice from Carter & Sons Ltd for office items. VAT 20%",
+    "Card payment received, thank you. VAT 20%",
+    "Of course we supply stationery. VAT 20%",
+    "Motivational posters from Vanguard Prints. VAT 20%",
+])
+def test_category_keywords_do_not_match_inside_other_words(rules, text):
+    assert "category" not in rules.answer(text)
+
+
+@pytest.mark.parametrize("text", [
+    "Carter & Sons: fuel delivered. VAT 20%",
+    "Laptop delivered. VAT 20%",
+])
+def test_single_category_keyword_stays_below_threshold(rules, text):
+    answer = rules.answer(text)["category"]
+    assert answer.confidence < DEFAULT_THRESHOLD
+
+
+def test_two_keywords_of_one_category_reach_threshold(rules):
+    answer = rules.answer("Laptop and monitor delivered. VAT 20%")["category"]
+    assert answer.label == "Computer Equipment"
+    assert answer.confidence >= DEFAULT_THRESHOLD
+
+
+def test_keywords_of_other_categories_lower_confidence(rules):
+    answer = rules.answer("Laptop and monitor for the training workshop")["category"]
+    assert answer.confidence < DEFAULT_THRESHOLD
+
+
+def test_text_naming_another_category_is_not_settled(rules):
+    answer = rules.answer("Professional services and consulting related to Cost of Goods Sold")["category"]
+    assert answer.label == "Professional Services"
+    assert answer.confidence < DEFAULT_THRESHOLD
+
+
+@pytest.mark.parametrize("text, label", [
+    ("Consulting services\nVAT (20%): £200", "20% (VAT on Expenses)"),
+    ("Printed books, zero-rated supply", "Zero Rated Expenses"),
+    ("Insurance premium, VAT exempt", "No VAT"),
+    ("Construction services, 20% VAT, reverse charge applies", "Reverse Charge Expenses (20%)"),
+])
+def test_vat_wording(rules, text, label):
+    answer = rules.answer(text)["vat"]
+    assert answer.label == label
+    assert answer.confidence >= DEFAULT_THRESHOLD
+
+
+def test_conflicting_vat_wording_is_not_settled(rules):
+    assert rules.answer("Zero-rated books and standard rated stationery")["vat"].confidence < DEFAULT_THRESHOLD
+
+
+def test_single_keyword_invoice_is_not_settled_by_rules():
+    cascade = build_cascade("rules", [], [], default_threshold=DEFAULT_THRESHOLD)
+    result = cascade.run("Invoice from Carter & Sons Ltd for office items. VAT 20%")
+    assert set(result.accepted) == {"vat"}
+    assert result.needs_final
+
+
+def test_cascade_counts_settled_invoices():
+    cascade = Cascade([(RuleTier(), DEFAULT_THRESHOLD)])
+    cascade.run("Laptop and monitor delivered. VAT 20%")
+    cascade.run("Office items")
+    stats = cascade.stats()
+    assert stats["invoices"] == 2
+    assert stats["tiers"]["rules"]["finished"] == 1
+    assert stats["finished_at_cheap_tiers_rate"] == 0.5
+
+
+def test_rag_path_is_asked_only_for_unsettled_fields():
+    cascade = build_cascade("rules", [], [], default_threshold=DEFAULT_THRESHOLD)
+    result = cascade.run("Invoice from Carter & Sons Ltd for office items. VAT 20%")
+    assert result.pending == ("category",)
+
+    cascade.record_final(result, {"category": "Professional Services"}, 1.0)
+    agreement = cascade.stats()["tiers"]["rules"]["agreement"]
+    assert agreement["confident"]["compared"] == 0
+    assert agreement["unconfident"]["compared"] == 0
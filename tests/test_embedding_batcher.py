@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import llm_client
+from embedding_batcher import MicroBatchingEmbedder
+from llm_scheduler import current_priority, priority
+
+
+class InvalidInput(Exception):
+    status_code = 400
+
+
+class FakeEmbedModel:
+    """Embeds a text as [len(text)], recording each batch with the deadline and priority it was sent under"""
+
+    def __init__(self, fail_on=(), error=InvalidInput):
+        self.fail_on = set(fail_on)
+        self.error = error
+        self.calls = []
+
+    def get_text_embedding_batch(self, texts, **kwargs):
+        self.calls.append({"texts": list(texts), "remaining": llm_client.remaining(),
+                           "priority": current_priority()})
+        bad = self.fail_on.intersection(texts)
+        if bad:
+            raise self.error(f"cannot embed {sorted(bad)}")
+        return [[float(len(text))] for text in texts]
+
+
+def embed_concurrently(embedder, texts):
+    results = {}
+
+    def embed(text):
+        try:
+            results[text] = embedder.get_query_embedding(text)
+        except Exception as e:
+            results[text] = e
+
+    threads = [threading.Thread(target=embed, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    model = FakeEmbedModel()
+    embedder = MicroBatchingEmbedder(model, window_ms=5000, max_batch=3)
+    start = time.perf_counter()
+    results = embed_concurrently(embedder, ["a", "bb", "ccc"])
+    assert time.perf_counter() - start < 2
+    assert results == {"a": [1.0], "bb": [2.0], "ccc": [3.0]}
+    assert [sorted(call["texts"]) for call in model.calls] == [["a", "bb", "ccc"]]
+
+
+def test_partial_batch_is_sent_when_the_window_closes():
+    model = FakeEmbedModel()
+    embedder = MicroBatchingEmbedder(model, window_ms=50, max_batch=64)
+    start = time.perf_counter()
+    assert embedder.get_query_embedding("vat") == [3.0]
+    assert time.perf_counter() - start >= 0.05
+    assert len(model.calls) == 1 and embedder.stats()["batches"] == 1
+
+
+def test_identical_texts_in_a_window_are_embedded_once():
+    model = FakeEmbedModel()
+    embedder = MicroBatchingEmbedder(model, window_ms=50)
+    futures = [embedder.submit("same") for _ in range(3)]
+    assert [future.result(timeout=2) for future in futures] == [[4.0]] * 3
+    assert model.calls[0]["texts"] == ["same"]
+    assert embedder.stats()["deduplicated"] == 2
+
+
+def test_batch_is_sent_with_the_latest_deadline_and_that_callers_priority():
+    model = FakeEmbedModel()
+    embedder = MicroBatchingEmbedder(model, window_ms=50)
+    with priority("interactive"), llm_client.deadline(1):
+        short = embedder.submit("short")
+    with priority("batch"), llm_client.deadline(30):
+        long = embedder.submit("long")
+    assert short.result(timeout=2) == [5.0] and long.result(timeout=2) == [4.0]
+
+    [call] = model.calls
+    assert 20 < call["remaining"] <= 30
+    assert call["priority"] == "batch"
+
+
+def test_caller_stops_waiting_at_its_own_deadline():
+    class SlowModel(FakeEmbedModel):
+        def get_text_embedding_batch(self, texts, **kwargs):
+            time.sleep(0.2)
+            return super().get_text_embedding_batch(texts)
+
+    embedder = MicroBatchingEmbedder(SlowModel(), window_ms=1)
+    with llm_client.deadline(0.05), pytest.raises(llm_client.DeadlineExceeded):
+        embedder.get_query_embedding("vat")
+
+    async def main():
+        with llm_client.deadline(0.05):
+            await embedder.aget_query_embedding("vat")
+
+    with pytest.raises(llm_client.DeadlineExceeded):
+        asyncio.run(main())
+
+
+def test_invalid_text_only_fails_its_own_caller():
+    model = FakeEmbedModel(fail_on={"bad"})
+    embedder = MicroBatchingEmbedder(model, window_ms=5000, max_batch=3)
+    results = embed_concurrently(embedder, ["good", "bad", "fine"])
+
+    assert results["good"] == [4.0] and results["fine"] == [4.0]
+    assert isinstance(results["bad"], InvalidInput)
+    assert embedder.stats()["errors"] == 1
+
+
+def test_service_errors_fail_the_whole_batch_without_retrying_each_text():
+    model = FakeEmbedModel(fail_on={"a"}, error=RuntimeError)
+    embedder = MicroBatchingEmbedder(model, window_ms=5000, max_batch=2)
+    results = embed_concurrently(embedder, ["a", "b"])
+
+    assert all(isinstance(result, RuntimeError) for result in results.values())
+    assert len(model.calls) == 1
@@ -0,0 +1,160 @@
+import asyncio
+import csv
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from gl_predictor import GLPredictor
+from llm_scheduler import priority
+from prediction_cache import MemoryCache, SqliteCache, TieredCache
+from supplier_memo import SupplierMemo
+
+TEST_INVOICES = Path(__file__).resolve().parent.parent / "data" / "Test" / "Sam (1).csv"
+
+
+class FakeRag:
+    """Stands in for VatRag: answers every query with fixed labels and counts the calls"""
+
+    index_key = "test-index"
+    embedder = None
+
+    def __init__(self, tmp_path: Path, vat: str = "20% (VAT on Expenses)", category: str = "Professional Services"):
+        self.csv_path = tmp_path / "vat_legislation.csv"
+        self.answer = json.dumps({"vat_rate": vat, "category": category})
+        self.queries = []
+
+    def query(self, query: str, retrieve_on=None) -> dict:
+        self.queries.append((query, retrieve_on))
+        return {"response": self.answer, "source_nodes": []}
+
+    async def aquery(self, query: str, retrieve_on=None) -> dict:
+        return self.query(query, retrieve_on)
+
+
+@pytest.fixture
+def memo(tmp_path):
+    return SupplierMemo(tmp_path / "supplier_memo.sqlite", min_observations=3)
+
+
+def predictor(rag: FakeRag, memo: SupplierMemo, cascade: str = "arithmetic,supplier,rules") -> GLPredictor:
+    return GLPredictor(rag, mode="joint", cache=TieredCache([MemoryCache()]), semantic_threshold=0,
+                       cascade=cascade, supplier_memo=memo)
+
+
+def test_replayed_invoices_teach_the_memo_repeat_suppliers(tmp_path):
+    with open(TEST_INVOICES, newline="") as f:
+        invoices = [row["data"] for row in csv.DictReader(f)]
+    memo = SupplierMemo(tmp_path / "supplier_memo.sqlite", min_observations=2)
+    rag = FakeRag(tmp_path)
+    gl = predictor(rag, memo)
+
+    predictions = {invoice: gl.predict(invoice) for invoice in invoices}
+
+    # Verbatim repeats come from the prediction cache; the two distinct SeedLegals invoices before it
+    # teach the memo the category of "Seed Legals 2", which shares their VAT number
+    seed_legals_2 = next(invoice for invoice in invoices if '"Seed Legals 2"' in invoice)
+    prediction = predictions[seed_legals_2]
+    assert prediction["vat_prediction"]["source"] == "arithmetic"
+    assert prediction["category_prediction"]["source"] == "supplier"
+    assert prediction["category_prediction"]["evidence"]["supplier"] == "vat:GB255817286"
+    # "Cater Oils" likewise follows two "CATER OILS LTD" invoices, and the memo answers both its fields
+    cater_oils = next(invoice for invoice in invoices if '"Cater Oils"' in invoice)
+    assert {predictions[cater_oils][part]["source"] for part in ("vat_prediction", "category_prediction")} == {
+        "supplier"
+    }
+    assert memo.stats()["hits"] == 2
+    assert len(rag.queries) == len(predictions) - 2
+
+
+def test_memo_learns_vat_from_the_amounts_and_category_from_the_model(tmp_path, memo):
+    rag = FakeRag(tmp_path, category="Motor Vehicle Expenses")
+    gl = predictor(rag, memo)
+    for day in range(1, 4):
+        gl.predict(f"Supplier: Cater Oils\nDelivery {day} March\nNet £100\nVAT £20\nTotal £120")
+
+    found = memo.lookup(["name:cater oils"])
+    assert {field: entry["label"] for field, entry in found.items()} == {
+        "vat": "20% (VAT on Expenses)", "category": "Motor Vehicle Expenses"
+    }
+
+
+def test_rule_answers_are_not_observed(tmp_path, memo):
+    gl = predictor(FakeRag(tmp_path), memo, cascade="rules")
+    for day in range(1, 4):
+        gl.predict(f"Supplier: Acme\nLaptop and monitor, order {day}. VAT 20%")
+    assert memo.lookup(["name:acme"]) == {}
+
+
+def test_semantic_cache_answers_are_not_counted_as_rag_agreement(tmp_path, memo, monkeypatch):
+    gl = predictor(FakeRag(tmp_path), memo, cascade="rules")
+    similar = {"vat_prediction": {"rate": "No VAT"}, "category_prediction": {"category": "Staff Training"}}
+    monkeypatch.setattr(gl, "_semantic_lookup", lambda invoice_text: (None, similar))
+
+    prediction = gl.predict("Supplier: Acme\nOffice items. VAT 20%")
+    assert prediction["vat_prediction"]["source"] == "rules"
+    assert prediction["category_prediction"] == {"category": "Staff Training"}
+    tiers = gl.cascade.stats()["tiers"]
+    assert tiers["rag"]["invoices"] == 0
+    assert all(counts["compared"] == 0 for counts in tiers["rules"]["agreement"].values())
+
+
+def test_joint_query_retrieves_on_the_invoice_not_the_label_lists(tmp_path, memo):
+    rag = FakeRag(tmp_path)
+    predictor(rag, memo, cascade="none").predict("IT consulting for March")
+
+    [(query, retrieve_on)] = rag.queries
+    assert "Reverse Charge Expenses (20%)" in query and "Staff Training" in query
+    assert "IT consulting for March" in retrieve_on
+    assert not any(label in retrieve_on for label in ("Reverse Charge", "Zero Rated", "Staff Training"))
+
+
+def test_apredict_keeps_sqlite_off_the_event_loop(tmp_path, memo, monkeypatch):
+    loop_thread = threading.get_ident()
+    touched_on_loop = []
+    for cls, method in ((SqliteCache, "get"), (SqliteCache, "set"), (SupplierMemo, "lookup"),
+                        (SupplierMemo, "observe")):
+        original = getattr(cls, method)
+
+        def spy(self, *args, _original=original, _name=f"{cls.__name__}.{method}"):
+            if threading.get_ident() == loop_thread:
+                touched_on_loop.append(_name)
+            return _original(self, *args)
+
+        monkeypatch.setattr(cls, method, spy)
+
+    cache = TieredCache([MemoryCache(), SqliteCache(tmp_path / "cache.sqlite")])
+    gl = GLPredictor(FakeRag(tmp_path), mode="joint", cache=cache, semantic_threshold=0,
+                     cascade="arithmetic,supplier,rules", supplier_memo=memo)
+    prediction = asyncio.run(gl.apredict("Supplier: Cater Oils\nNet £100\nVAT £20\nTotal £120"))
+
+    assert prediction["category_prediction"]["category"] == "Professional Services"
+    assert memo.observations == 1
+    assert touched_on_loop == []
+
+
+class SlowRag(FakeRag):
+    def query(self, query: str, retrieve_on=None) -> dict:
+        time.sleep(0.05)
+        return super().query(query, retrieve_on)
+
+
+@pytest.mark.parametrize("priorities, expected_queries", [
+    (("interactive", "interactive"), 1),
+    (("interactive", "batch"), 2),
+])
+def test_identical_invoices_coalesce_only_within_a_priority_class(tmp_path, memo, priorities, expected_queries):
+    rag = SlowRag(tmp_path)
+    gl = predictor(rag, memo, cascade="none")
+
+    def predict(name):
+        with priority(name):
+            gl.predict("IT consulting for March")
+
+    threads = [threading.Thread(target=predict, args=(name,)) for name in priorities]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(rag.queries) == expected_queries
@@ -0,0 +1,69 @@
+import json
+import threading
+from pathlib import Path
+
+from index_store import MANIFEST_FILE, IndexStore
+
+KEY = "a" * 64
+OTHER = "b" * 64
+
+
+class FakeIndex:
+    """Persists a single file, counting how often it was written"""
+
+    def __init__(self, content: str = "index"):
+        self.content = content
+        self.persisted = 0
+        self.storage_context = self
+
+    def persist(self, persist_dir: str):
+        self.persisted += 1
+        (Path(persist_dir) / "docstore.json").write_text(self.content, encoding="utf-8")
+
+
+def backdate(store: IndexStore, key: str, seconds: float):
+    path = store.snapshot_dir(key) / MANIFEST_FILE
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    manifest["created_at"] -= seconds
+    path.write_text(json.dumps(manifest), encoding="utf-8")
+
+
+def test_concurrent_writers_publish_one_complete_snapshot(tmp_path):
+    store = IndexStore(tmp_path)
+    errors = []
+
+    def save():
+        try:
+            store.save(KEY, FakeIndex(), {"documents": 1})
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert store.current() == KEY and store.has(KEY)
+    assert (store.snapshot_dir(KEY) / "docstore.json").read_text(encoding="utf-8") == "index"
+    assert [path.name for path in tmp_path.iterdir() if path.is_dir()] == [KEY[:16]]
+
+
+def test_published_snapshot_is_not_rewritten(tmp_path):
+    store = IndexStore(tmp_path)
+    store.save(KEY, FakeIndex(), {})
+    again = FakeIndex()
+    store.save(KEY, again, {})
+    assert again.persisted == 0
+
+
+def test_prune_keeps_snapshots_within_the_grace_period(tmp_path):
+    store = IndexStore(tmp_path, prune_grace=60)
+    store.save(OTHER, FakeIndex(), {})
+    store.save(KEY, FakeIndex(), {})
+    assert store.has(OTHER)
+
+    backdate(store, OTHER, 120)
+    store.save(KEY, FakeIndex(), {})
+    assert not store.has(OTHER) and store.has(KEY)
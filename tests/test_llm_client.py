@@ -0,0 +1,164 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from llm_client import (AsyncResilientTransport, CallStats, ClientPolicy, DeadlineExceeded, ResilientTransport,
+                        deadline)
+
+URL = "https://api.test/v1/chat/completions"
+
+
+class Replies:
+    """Answers requests with the given statuses in turn, counting them"""
+
+    def __init__(self, *statuses, headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.sent = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.sent += 1
+        return httpx.Response(self.statuses.pop(0), headers=self.headers)
+
+
+def client(handler, **policy) -> httpx.Client:
+    policy = {"retry_base_delay": 0, "max_retries": 3, **policy}
+    transport = ResilientTransport(ClientPolicy(**policy), CallStats())
+    transport.inner = httpx.MockTransport(handler)
+    return httpx.Client(transport=transport)
+
+
+def async_client(handler, **policy) -> httpx.AsyncClient:
+    policy = {"retry_base_delay": 0, "max_retries": 3, **policy}
+    transport = AsyncResilientTransport(ClientPolicy(**policy), CallStats())
+    transport.inner = httpx.MockTransport(handler)
+    return httpx.AsyncClient(transport=transport)
+
+
+def counts(http_client) -> dict:
+    return http_client._transport.stats.counts
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_rate_limits_and_server_errors_are_retried(status):
+    replies = Replies(status, status, 200)
+    http = client(replies)
+    assert http.post(URL).status_code == 200
+    assert replies.sent == 3 and counts(http)["retries"] == 2
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+def test_client_errors_are_not_retried(status):
+    replies = Replies(status, 200)
+    http = client(replies)
+    assert http.post(URL).status_code == status
+    assert replies.sent == 1 and counts(http)["retries"] == 0
+
+
+def test_retries_stop_after_max_retries():
+    replies = Replies(503, 503, 503)
+    http = client(replies, max_retries=2)
+    assert http.post(URL).status_code == 503
+    assert replies.sent == 3
+
+
+def test_connection_errors_are_retried_and_then_raised():
+    attempts = []
+
+    def refuse(request):
+        attempts.append(request)
+        raise httpx.ConnectError("refused", request=request)
+
+    http = client(refuse, max_retries=2)
+    with pytest.raises(httpx.ConnectError):
+        http.post(URL)
+    assert len(attempts) == 3 and counts(http)["failures"] == 1
+
+
+def test_backoff_that_would_pass_the_deadline_gives_up():
+    replies = Replies(429, 200, headers={"retry-after": "5"})
+    http = client(replies)
+    with deadline(0.5), pytest.raises(DeadlineExceeded):
+        http.post(URL)
+    assert replies.sent == 1 and counts(http)["deadline_exceeded"] == 1
+
+
+def test_spent_deadline_sends_nothing():
+    replies = Replies(200)
+    http = client(replies)
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            http.post(URL)
+    assert replies.sent == 0
+
+
+def test_async_retries_and_deadline():
+    async def main():
+        replies = Replies(503, 200)
+        http = async_client(replies)
+        assert (await http.post(URL)).status_code == 200
+        assert replies.sent == 2
+
+        slow = async_client(Replies(429, 200, headers={"retry-after": "5"}))
+        with deadline(0.5):
+            await slow.post(URL)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+
+
+def test_async_hedge_wins_and_the_slow_attempt_is_cancelled():
+    state = {"attempts": 0, "cancelled": 0}
+
+    async def handler(request):
+        state["attempts"] += 1
+        first = state["attempts"] == 1
+        try:
+            await asyncio.sleep(1.0 if first else 0.01)
+        except asyncio.CancelledError:
+            state["cancelled"] += 1
+            raise
+        return httpx.Response(200, json={"attempt": 1 if first else 2})
+
+    async def main():
+        http = async_client(handler, hedge_percentile=50, hedge_min_samples=1)
+        for _ in range(10):
+            http._transport.stats.record_latency(0.02)
+        start = time.perf_counter()
+        response = await http.post(URL)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0)
+        return response.json(), elapsed, counts(http)
+
+    body, elapsed, stats = asyncio.run(main())
+    assert body == {"attempt": 2} and elapsed < 0.5
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+    assert state["cancelled"] == 1
+
+
+def test_sync_hedge_answers_before_the_slow_attempt():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        time.sleep(0.3 if len(attempts) == 1 else 0.01)
+        return httpx.Response(200, json={"attempt": len(attempts)})
+
+    http = client(handler, hedge_percentile=50, hedge_min_samples=1)
+    for _ in range(10):
+        http._transport.stats.record_latency(0.02)
+    start = time.perf_counter()
+    assert http.post(URL).json() == {"attempt": 2}
+    assert time.perf_counter() - start < 0.25
+    assert (counts(http)["hedges"], counts(http)["hedge_wins"]) == (1, 1)
+
+
+def test_fast_answers_are_not_hedged():
+    replies = Replies(200)
+    http = client(replies, hedge_percentile=50, hedge_min_samples=1)
+    for _ in range(10):
+        http._transport.stats.record_latency(1.0)
+    assert http.post(URL).status_code == 200
+    assert replies.sent == 1 and counts(http)["hedges"] == 0
@@ -0,0 +1,185 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from llm_client import CallStats, ClientPolicy, DeadlineExceeded, ResilientTransport, deadline
+from llm_scheduler import LLMScheduler, priority
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def requests_left(scheduler: LLMScheduler) -> float:
+    scheduler.requests.refill(scheduler.clock())
+    return scheduler.requests.level
+
+
+def wait_until(condition, timeout: float = 2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+
+def test_requests_are_paced_at_the_refill_rate(clock):
+    # 60 RPM at full headroom refills one request a second and holds two
+    scheduler = LLMScheduler(rpm=60, headroom=1.0, burst_seconds=2, clock=clock)
+    assert scheduler.try_acquire(1) and scheduler.try_acquire(1)
+    assert not scheduler.try_acquire(1)
+
+    clock.advance(0.5)
+    assert not scheduler.try_acquire(1)
+    clock.advance(0.5)
+    assert scheduler.try_acquire(1)
+    assert not scheduler.try_acquire(1)
+
+
+def test_token_quota_holds_back_large_calls(clock):
+    scheduler = LLMScheduler(tpm=6000, headroom=1.0, burst_seconds=1, clock=clock)  # 100 tokens a second
+    assert scheduler.try_acquire(80)
+    assert not scheduler.try_acquire(80)
+    clock.advance(0.6)
+    assert scheduler.try_acquire(80)
+
+
+def test_queued_calls_are_released_highest_priority_first(clock):
+    # One request every 0.1 s, so the dispatcher re-checks the fake clock every 0.1 s
+    scheduler = LLMScheduler(rpm=600, headroom=1.0, burst_seconds=0.1, clock=clock)
+    scheduler.acquire(1)
+    order = []
+
+    async def call(name):
+        with priority(name):
+            await scheduler.aacquire(1)
+        order.append(name)
+
+    async def main():
+        tasks = [asyncio.ensure_future(call("evaluation")), asyncio.ensure_future(call("batch"))]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.ensure_future(call("interactive")))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queue_depth"] == 3
+        for released in range(1, 4):
+            clock.advance(0.1)
+            while len(order) < released:
+                await asyncio.sleep(0.005)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["interactive", "batch", "evaluation"]
+
+
+def test_cancelled_caller_leaves_the_queue(clock):
+    scheduler = LLMScheduler(rpm=60, headroom=1.0, burst_seconds=1, clock=clock)
+    scheduler.acquire(1)
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.aacquire(1))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queue_depth"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert scheduler.stats()["queue_depth"] == 0
+    assert scheduler.stats()["classes"]["interactive"]["granted"] == 1
+
+
+def test_grant_is_refunded_when_the_caller_is_cancelled(clock):
+    scheduler = LLMScheduler(rpm=600, headroom=1.0, burst_seconds=0.1, clock=clock)
+    scheduler.acquire(1)
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.aacquire(1))
+        await asyncio.sleep(0.01)
+        clock.advance(0.1)
+        # Block the event loop until the dispatcher has granted, so the task only sees its cancellation
+        wait_until(lambda: scheduler.stats()["classes"]["interactive"]["granted"] == 2)
+        assert requests_left(scheduler) == 0
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert scheduler.stats()["classes"]["interactive"]["refunded"] == 1
+    assert requests_left(scheduler) == 1
+
+
+def test_waiting_for_quota_counts_against_the_deadline(clock):
+    scheduler = LLMScheduler(rpm=60, headroom=1.0, burst_seconds=1, clock=clock)
+    scheduler.acquire(1)
+    with deadline(0.05), pytest.raises(DeadlineExceeded):
+        scheduler.acquire(1)
+    assert scheduler.stats()["classes"]["interactive"]["timeouts"] == 1
+
+
+def transport_returning(*statuses) -> ResilientTransport:
+    replies = iter(statuses)
+    transport = ResilientTransport(ClientPolicy(retry_base_delay=0, max_retries=3), CallStats())
+    transport.inner = httpx.MockTransport(lambda request: httpx.Response(next(replies)))
+    return transport
+
+
+def test_retries_of_a_completion_are_charged(clock):
+    scheduler = LLMScheduler(rpm=60, headroom=1.0, burst_seconds=5, clock=clock)
+    client = httpx.Client(transport=transport_returning(503, 429, 200))
+    scheduler.acquire(1)
+    with scheduler.charging(1):
+        assert client.post("https://api.test/v1/chat/completions").status_code == 200
+    assert requests_left(scheduler) == 2
+    assert scheduler.stats()["classes"]["interactive"]["retries"] == 2
+
+    # Embedding calls are not on the chat quota
+    client = httpx.Client(transport=transport_returning(503, 200))
+    with scheduler.charging(1):
+        client.post("https://api.test/v1/embeddings")
+    assert requests_left(scheduler) == 2
+
+
+def test_retry_waits_for_quota_within_the_deadline(clock):
+    scheduler = LLMScheduler(rpm=60, headroom=1.0, burst_seconds=1, clock=clock)
+    client = httpx.Client(transport=transport_returning(503, 200))
+    scheduler.acquire(1)
+    with scheduler.charging(1), deadline(0.05), pytest.raises(DeadlineExceeded):
+        client.post("https://api.test/v1/chat/completions")
+
+
+def test_hedges_are_only_sent_when_the_budget_has_room(clock):
+    def slow(request):
+        time.sleep(0.05)
+        return httpx.Response(200)
+
+    scheduler = LLMScheduler(rpm=60, headroom=1.0, burst_seconds=2, clock=clock)
+    stats = CallStats()
+    transport = ResilientTransport(ClientPolicy(hedge_percentile=50, hedge_min_samples=1), stats)
+    transport.inner = httpx.MockTransport(slow)
+    for _ in range(10):
+        stats.record_latency(0.001)  # Every call is slow next to these, so each one would be hedged
+    client = httpx.Client(transport=transport)
+
+    scheduler.acquire(1)
+    with scheduler.charging(1):
+        client.post("https://api.test/v1/chat/completions")
+    assert stats.counts["hedges"] == 1 and requests_left(scheduler) == 0
+
+    # The buckets are now empty, so the slow call is left to finish on its own
+    with scheduler.charging(1):
+        client.post("https://api.test/v1/chat/completions")
+    assert stats.counts["hedges"] == 1
+    classes = scheduler.stats()["classes"]["interactive"]
+    assert (classes["hedges"], classes["hedges_skipped"]) == (1, 1)
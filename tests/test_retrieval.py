@@ -0,0 +1,185 @@
+import zlib
+
+import numpy as np
+import pytest
+from llama_index.core.schema import QueryBundle, TextNode
+from ann import IVFIndex
+from bm25 import BM25Index, reciprocal_rank_fusion
+from gl_predictor import CATEGORY_LABELS, VAT_LABELS
+from retrieval import DenseMatrix, HybridRetriever, NumpyRetriever, QuantizedMatrix
+from shared_store import SharedEmbeddingStore
+
+CHUNKS = [
+    "Reverse charge applies to construction services supplied by subcontractors",
+    "Zero-rated supplies include most food and printed books",
+    "Consulting and other professional services are standard rated",
+    "Staff training courses may be exempt when provided by an eligible body",
+]
+
+
+class RecordingEmbedder:
+    """Embeds every text to the same vector, which ranks the chunks in reverse order, and records what it embedded"""
+
+    def __init__(self):
+        self.texts = []
+
+    def get_query_embedding(self, text):
+        self.texts.append(text)
+        return [0.1, 0.2, 0.3, 0.4]
+
+    async def aget_query_embedding(self, text):
+        return self.get_query_embedding(text)
+
+    def get_text_embedding_batch(self, texts):
+        raise AssertionError("queries must be embedded with get_query_embedding")
+
+
+@pytest.fixture
+def hybrid():
+    nodes = [TextNode(text=text, id_=str(i)) for i, text in enumerate(CHUNKS)]
+    bm25 = BM25Index().build([node.node_id for node in nodes], CHUNKS)
+    return HybridRetriever(DenseMatrix(np.eye(len(nodes))), nodes, RecordingEmbedder(), bm25,
+                           similarity_top_k=1)
+
+
+def test_retrieval_uses_the_custom_embedding_text_not_the_prompt(hybrid, monkeypatch):
+    keyword_queries = []
+    top_k = hybrid.bm25.top_k
+    monkeypatch.setattr(hybrid.bm25, "top_k", lambda query, k: keyword_queries.append(query) or top_k(query, k))
+
+    prompt = (f"VAT treatment must be one of: {', '.join(VAT_LABELS)}. "
+              f"Accounting category must be one of: {', '.join(CATEGORY_LABELS)}. Invoice: IT consulting")
+    hybrid.retrieve(QueryBundle(query_str=prompt, custom_embedding_strs=["IT consulting"]))
+    assert hybrid.embed_model.texts == ["IT consulting"]
+    assert keyword_queries == ["IT consulting"]
+
+    # A plain query string is retrieved on as it is
+    hybrid.retrieve("Reverse charge on construction")
+    assert keyword_queries[-1] == "Reverse charge on construction"
+
+
+class HashEmbedder(RecordingEmbedder):
+    """A different, repeatable 4-d vector per text"""
+
+    def get_query_embedding(self, text):
+        self.texts.append(text)
+        return np.random.default_rng(zlib.crc32(text.encode("utf-8"))).normal(size=4).tolist()
+
+
+@pytest.mark.parametrize("retriever_class", [NumpyRetriever, HybridRetriever])
+def test_retrieve_batch_matches_single_queries(retriever_class):
+    nodes = [TextNode(text=text, id_=str(i)) for i, text in enumerate(CHUNKS)]
+    matrix = DenseMatrix(np.random.default_rng(7).normal(size=(len(CHUNKS), 4)))
+    args = (BM25Index().build([node.node_id for node in nodes], CHUNKS),) if retriever_class is HybridRetriever else ()
+    retriever = retriever_class(matrix, nodes, HashEmbedder(), *args, similarity_top_k=2)
+
+    queries = ["reverse charge on construction", "printed books", "staff training"]
+    single = [[(r.node.node_id, round(r.score, 5)) for r in retriever.retrieve(query)] for query in queries]
+    batched = [[(r.node.node_id, round(r.score, 5)) for r in results] for results in retriever.retrieve_batch(queries)]
+    assert batched == single
+
+
+def test_reciprocal_rank_fusion_sums_reciprocal_ranks():
+    fused = reciprocal_rank_fusion([[0, 1, 2], [2, 0, 3]], k=60)
+    assert [position for position, _ in fused] == [0, 2, 1, 3]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    # Weighting the keyword list lets its top hit win
+    assert reciprocal_rank_fusion([[0, 1, 2], [2, 0, 3]], k=60, weights=[1.0, 2.0])[0][0] == 2
+
+
+def test_hybrid_ranks_chunks_found_by_both_retrievers_first(hybrid):
+    # Dense ranks 3, 2, 1, 0 (see RecordingEmbedder); BM25 finds only chunk 0, which the fusion lifts to the top
+    hybrid.similarity_top_k = 4
+    ranked = [int(result.node.node_id) for result in hybrid.retrieve("construction subcontractors")]
+    assert ranked == [0, 3, 2, 1]
+
+
+def test_shared_store_round_trip(tmp_path):
+    texts = ["Zero-rated: children's clothing", "Exempt – financial services €", ""]
+    metadata = [{"id": i, "type": "vat_legislation"} for i in range(len(texts))]
+    vectors = np.random.default_rng(5).normal(size=(len(texts), 8)) * 3
+    node_ids = [f"node-{i}" for i in range(len(texts))]
+    SharedEmbeddingStore.export(tmp_path / "shared", node_ids, zip(texts, metadata, vectors.tolist()))
+
+    store = SharedEmbeddingStore.open(tmp_path / "shared")
+    assert len(store) == 3 and list(store.node_ids) == node_ids
+    assert [store.text(i) for i in range(3)] == texts
+    assert [node.metadata for node in store.nodes()] == metadata
+    assert store.node(1).node_id == "node-1"
+    np.testing.assert_allclose(store.embeddings, DenseMatrix.normalise(vectors.astype(np.float32)), rtol=1e-6)
+
+    codes, scales = store.quantized("int8")
+    assert codes.dtype == np.int8 and (tmp_path / "shared" / "embeddings.int8.npy").exists()
+    np.testing.assert_allclose(codes * scales[:, None], store.embeddings, atol=0.01)
+
+
+def test_shared_store_bm25_is_mapped_and_scores_as_built(tmp_path):
+    node_ids = [str(i) for i in range(len(CHUNKS))]
+    SharedEmbeddingStore.export(tmp_path / "shared", node_ids,
+                                ((text, {}, [1.0, 0.0]) for text in CHUNKS))
+    store = SharedEmbeddingStore.open(tmp_path / "shared")
+    built = BM25Index().build(node_ids, CHUNKS)
+
+    for mapped in (store.bm25(), SharedEmbeddingStore.open(tmp_path / "shared").bm25()):
+        assert isinstance(mapped.postings.docs, np.memmap) and len(mapped.postings) == len(built.postings)
+        for query in ["reverse charge", "printed books zero-rated", "exempt training", "unknown words"]:
+            np.testing.assert_allclose(mapped.scores(query), built.scores(query))
+
+
+def test_shared_store_retriever_matches_the_in_memory_one(tmp_path):
+    nodes = [TextNode(text=text, id_=str(i)) for i, text in enumerate(CHUNKS)]
+    vectors = np.random.default_rng(6).normal(size=(len(CHUNKS), 4))
+    SharedEmbeddingStore.export(tmp_path / "shared", [node.node_id for node in nodes],
+                                ((node.text, {}, vector) for node, vector in zip(nodes, vectors.tolist())))
+    store = SharedEmbeddingStore.open(tmp_path / "shared")
+
+    in_memory = NumpyRetriever(DenseMatrix(vectors), nodes, HashEmbedder(), similarity_top_k=2)
+    shared = NumpyRetriever.from_shared_store(store, HashEmbedder(), similarity_top_k=2)
+    query = "Is consulting standard rated?"
+    expected = [(result.node.node_id, round(result.score, 5)) for result in in_memory.retrieve(query)]
+    assert [(result.node.node_id, round(result.score, 5)) for result in shared.retrieve(query)] == expected
+
+
+def unit_rows(n_rows, dim, seed=0, clusters=None):
+    rng = np.random.default_rng(seed)
+    if clusters:
+        centres = rng.normal(size=(clusters, dim))
+        rows = centres[rng.integers(clusters, size=n_rows)] + 0.3 * rng.normal(size=(n_rows, dim))
+    else:
+        rows = rng.normal(size=(n_rows, dim))
+    return DenseMatrix.normalise(rows.astype(np.float32))
+
+
+def recall(found, truth):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found.tolist(), truth.tolist())])
+
+
+@pytest.mark.parametrize("kind", ["int8", "float16"])
+def test_quantised_search_with_exact_rerank_matches_float32(kind):
+    exact = unit_rows(2000, 64, seed=1)
+    queries = unit_rows(20, 64, seed=2)
+    truth_indices, truth_scores = DenseMatrix(exact, normalised=True).search_batch(queries, 10)
+
+    indices, scores = QuantizedMatrix.from_matrix(exact, kind, oversample=4).search_batch(queries, 10)
+    assert recall(indices, truth_indices) == 1.0
+    np.testing.assert_allclose(scores, truth_scores, rtol=1e-5, atol=1e-6)
+
+    single_indices, single_scores = QuantizedMatrix.from_matrix(exact, kind).search(queries[0], 10)
+    assert single_indices.tolist() == truth_indices[0].tolist()
+
+
+def test_ivf_recall_against_brute_force(tmp_path):
+    matrix = unit_rows(4000, 32, seed=3, clusters=40)
+    rng = np.random.default_rng(4)
+    queries = DenseMatrix.normalise(matrix[rng.choice(len(matrix), 50)] + 0.1 * rng.normal(size=(50, 32)))
+    truth, _ = DenseMatrix(matrix, normalised=True).search_batch(queries, 10)
+
+    ivf = IVFIndex.build(tmp_path / "ivf", matrix, n_lists=32, nprobe=8)
+    found, _ = ivf.search_batch(queries, 10)
+    assert recall(found, truth) >= 0.9
+    # Probing every list is brute force
+    exhaustive, _ = ivf.search_batch(queries, 10, nprobe=ivf.n_lists)
+    assert recall(exhaustive, truth) == 1.0
+    # Scores for given rows are exact whatever list they are in
+    np.testing.assert_allclose(ivf.rescore(queries[0], truth[0]), matrix[truth[0]] @ queries[0], rtol=1e-5)
+    assert IVFIndex.load(tmp_path / "ivf").search(queries[0], 10)[0].tolist() == ivf.search(queries[0], 10)[0].tolist()
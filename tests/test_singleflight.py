@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from singleflight import SingleFlight
+
+
+def test_concurrent_duplicates_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(2)
+        return {"labels": ["20% (VAT on Expenses)"]}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("invoice", compute))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["collapsed"] < 3:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"labels": ["20% (VAT on Expenses)"]}] * 4
+    # Followers get copies, so one caller changing its result does not affect the others
+    results[0]["labels"].append("changed")
+    assert sum(result["labels"] == ["20% (VAT on Expenses)"] for result in results) == 3
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_leader_failure_reaches_every_waiter_and_is_not_remembered():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(2)
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("invoice", fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["collapsed"] < 2:
+        time.sleep(0.005)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ["upstream down"] * 3
+    assert flight.do("invoice", lambda: "recovered") == "recovered"
+
+
+def test_async_duplicates_share_one_execution_and_its_failure():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"category": "Professional Services"}
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        results = await asyncio.gather(*(flight.ado("invoice", compute) for _ in range(3)))
+        failures = await asyncio.gather(*(flight.ado("other", fail) for _ in range(3)), return_exceptions=True)
+        return results, failures
+
+    results, failures = asyncio.run(main())
+    assert len(calls) == 1 and results == [{"category": "Professional Services"}] * 3
+    assert results[0] is not results[1]
+    assert [str(failure) for failure in failures] == ["upstream down"] * 3
+    assert flight.stats()["executions"] == 2 and flight.stats()["collapsed"] == 4
+
+
+def test_cancelled_follower_does_not_cancel_the_shared_call():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.ado("invoice", compute))
+        follower = asyncio.ensure_future(flight.ado("invoice", compute))
+        await asyncio.sleep(0)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader
+
+    assert asyncio.run(main()) == "done"
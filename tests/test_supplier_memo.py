@@ -0,0 +1,113 @@
+import json
+
+import pytest
+from supplier_memo import SupplierMemo, keys_for_supplier, supplier_keys
+
+VAT = "20% (VAT on Expenses)"
+CATEGORY = "Motor Vehicle Expenses"
+LABELS = {"vat": VAT, "category": CATEGORY}
+KEYS = ["vat:GB123456789", "name:cater oils"]
+
+
+@pytest.fixture
+def memo(tmp_path):
+    return SupplierMemo(tmp_path / "supplier_memo.sqlite", min_observations=3)
+
+
+def labels(found):
+    return {field: entry["label"] for field, entry in found.items()}
+
+
+def test_keys_from_json_and_text_invoices_match():
+    invoice = json.dumps({"Supplier": "CATER OILS LTD", "VAT Number": "GB 123 4567 89"})
+    text = "Supplier: Cater Oils Limited\nVAT Reg No: 123456789\nFuel"
+    assert supplier_keys(invoice) == KEYS
+    assert supplier_keys(text) == KEYS
+    assert keys_for_supplier({"vat_number": "123 4567 89", "name": "Cater Oils"}) == KEYS
+
+
+def test_lookup_waits_for_consistent_observations(memo):
+    for _ in range(2):
+        memo.observe(KEYS, LABELS)
+    assert memo.lookup(KEYS) == {}
+
+    memo.observe(KEYS, LABELS)
+    found = memo.lookup(KEYS)
+    assert labels(found) == LABELS
+    assert found["vat"]["key"] == KEYS[0]
+    assert found["category"]["observations"] == 3
+    assert not found["category"]["confirmed"]
+
+
+def test_fields_are_learnt_separately(memo):
+    for _ in range(3):
+        memo.observe(KEYS, {"vat": VAT})
+    assert labels(memo.lookup(KEYS)) == {"vat": VAT}
+
+
+def test_different_observation_restarts_only_that_field(memo):
+    for _ in range(3):
+        memo.observe(KEYS, LABELS)
+    memo.observe(KEYS, {"vat": "No VAT", "category": CATEGORY})
+    assert labels(memo.lookup(KEYS)) == {"category": CATEGORY}
+
+
+def test_feedback_confirms_labels_and_they_answer_straight_away(memo):
+    assert memo.feedback(KEYS, VAT, CATEGORY) == "added"
+    found = memo.lookup(KEYS)
+    assert labels(found) == LABELS
+    assert found["vat"]["confirmed"]
+
+    assert memo.feedback(KEYS, VAT, CATEGORY) == "confirmed"
+    assert memo.stats()["confirmations"] == 1
+
+
+def test_feedback_replaces_observed_labels(memo):
+    for _ in range(3):
+        memo.observe(KEYS, {"vat": "No VAT", "category": CATEGORY})
+    assert memo.feedback(KEYS, VAT, CATEGORY) == "invalidated"
+    found = memo.lookup(KEYS)
+    assert (found["vat"]["label"], found["vat"]["confirmed"]) == (VAT, True)
+
+
+def test_observations_do_not_change_confirmed_labels(memo):
+    memo.feedback(KEYS, VAT, CATEGORY)
+    memo.observe(KEYS, {"vat": "No VAT", "category": "Staff Training"})
+    memo.observe(KEYS, LABELS)
+    found = memo.lookup(KEYS)
+    assert labels(found) == LABELS
+    assert found["vat"]["observations"] == 1
+
+
+def test_hits_count_lookups_that_answer_a_field(memo):
+    memo.lookup(KEYS)
+    memo.feedback(KEYS, VAT, CATEGORY)
+    memo.lookup(KEYS)
+    stats = memo.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["stable_labels"]) == (1, 1, 2, 4)
+
+
+def test_generation_moves_only_when_feedback_changes_the_memo(memo):
+    assert memo.generation() == 0
+    memo.feedback(KEYS, VAT, CATEGORY)
+    assert memo.generation() == 1
+    memo.feedback(KEYS, VAT, CATEGORY)
+    assert memo.generation() == 1
+    memo.feedback(KEYS, "No VAT", CATEGORY)
+    assert memo.generation() == 2
+
+
+def test_memo_is_shared_through_the_file(memo):
+    memo.feedback(KEYS, VAT, CATEGORY)
+    other = SupplierMemo(memo.path)
+    assert labels(other.lookup(KEYS[1:])) == LABELS
+    assert other.generation() == 1
+
+
+def test_generation_is_served_from_memory_between_refreshes(memo):
+    other = SupplierMemo(memo.path, generation_refresh_seconds=3600)
+    assert other.generation() == 0
+    memo.feedback(KEYS, VAT, CATEGORY)
+    assert other.generation() == 0  # Another worker's feedback shows up at the next refresh
+    other.feedback(KEYS, "No VAT", CATEGORY)
+    assert other.generation() == 2
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+from vat_arithmetic import infer_vat_label, parse_amounts
+
+
+def test_all_three_amounts_give_the_standard_rate():
+    label, confidence, rate = infer_vat_label("Subtotal £6,000 / VAT £1,200 / Total £7,200")
+    assert label == "20% (VAT on Expenses)"
+    assert confidence == 0.98
+    assert rate == pytest.approx(0.2)
+
+
+def test_json_invoice_uses_vat_and_total_fields():
+    invoice = json.dumps({"Supplier": "Cater Oils Ltd", "VAT": "600.00", "Total": "3,600.00"})
+    label, confidence, _ = infer_vat_label(invoice)
+    assert label == "20% (VAT on Expenses)"
+    assert confidence == 0.9
+
+
+def test_penny_rounding_on_small_invoices():
+    assert infer_vat_label("Net £1.03\nVAT £0.21\nTotal £1.24")[0] == "20% (VAT on Expenses)"
+
+
+@pytest.mark.parametrize("wording, label", [
+    ("Zero-rated supply", "Zero Rated Expenses"),
+    ("VAT exempt", "No VAT"),
+])
+def test_zero_vat_needs_the_reason(wording, label):
+    assert infer_vat_label(f"Net £300\nVAT £0.00\nTotal £300\n{wording}")[0] == label
+
+
+@pytest.mark.parametrize("text", [
+    "Net £300\nVAT £0.00\nTotal £300",                                        # zero VAT, reason not stated
+    "Net £100\nVAT £5\nTotal £105",                                           # reduced rate has no label
+    "Net £100\nVAT £20\nTotal £150",                                          # amounts do not add up
+    "Net £1,000\nVAT £200\nTotal £1,200\nReverse charge: customer to account for VAT",
+    "Consulting services, VAT Reg No GB123456789",                            # no amounts at all
+])
+def test_undetermined_invoices_are_left_alone(text):
+    assert infer_vat_label(text) is None
+
+
+def test_vat_registration_number_is_not_an_amount():
+    amounts = parse_amounts("VAT Reg No: GB123456789\nSubtotal £500\nVAT (20%) £100\nTotal £600")
+    assert amounts == {"net": 500.0, "vat": 100.0, "gross": 600.0}